@@ -0,0 +1,81 @@
+import os
+import re
+import sys
+from functools import lru_cache
+from nltk.stem import PorterStemmer
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# spider、indexer、retrieval 和 webui 共用的文本分析：
+# - 分词只用一次正则表达式扫描文本，同时得到原始单词序列（用于 SimHash 和位置）和过滤停用词后的单词；
+# - 词干化使用带有界缓存的 PorterStemmer。同一个单词在不同网页、标题、查询和结果页中反复出现，
+#   缓存命中时不需要再执行 Porter 算法的各个步骤。
+
+# 单词：连续的字母、数字或下划线
+WORD_PATTERN = re.compile(r"\b\w+\b")
+# 词干缓存的容量（单词个数）
+STEM_CACHE_SIZE = 1 << 16
+
+def load_stopwords(stopwords_file):
+    """
+    从文件中加载停用词。
+    :return: 停用词集合。
+    """
+    try:
+        with open(os.path.dirname(os.path.abspath(__file__)) + "/" + stopwords_file, "r", encoding="utf-8") as file:
+            stopwords = set(line.strip() for line in file if line.strip())
+        return stopwords
+    except FileNotFoundError:
+        return set()
+
+def tokenize(text):
+    """
+    将文本转为小写并分词（忽略标点符号）。
+    :return: 原始单词序列（包括停用词）。
+    """
+    return WORD_PATTERN.findall(text.lower())
+
+def analyze_text(text, stopwords):
+    """
+    一次扫描文本，同时得到原始单词序列和每个非停用词的位置。
+    位置为单词在原始单词序列（包括停用词）中的序号，因此相邻单词的位置相差 1。
+    :param text: 输入的纯文本。
+    :param stopwords: 停用词集合。
+    :return: (原始单词序列, {单词: 升序的位置列表})。
+    """
+    words = tokenize(text)
+    positions = {}
+    for position, word in enumerate(words):
+        if word not in stopwords:
+            positions.setdefault(word, []).append(position)
+    return words, positions
+
+def tokenize_and_filter(text, stopwords):
+    """
+    对文本进行分词，并移除停用词。
+    :param text: 输入的纯文本。
+    :param stopwords: 停用词集合。
+    :return: 过滤后的单词列表。
+    """
+    return [word for word in tokenize(text) if word not in stopwords]
+
+def word_positions(text, stopwords):
+    """
+    对文本进行分词，记录每个非停用词出现的位置（见 analyze_text）。
+    :return: {单词: 升序的位置列表}。
+    """
+    return analyze_text(text, stopwords)[1]
+
+# 带缓存的词干化器
+class cached_stemmer:
+    """
+    与 PorterStemmer 的 stem 接口相同，结果缓存在有界的 LRU 缓存中（线程安全）。
+    """
+
+    def __init__(self, maxsize=STEM_CACHE_SIZE):
+        """
+        :param maxsize: 缓存的单词个数。
+        """
+        self.stem = lru_cache(maxsize=maxsize)(PorterStemmer().stem)
+
+# 各模块共用的词干化器
+STEMMER = cached_stemmer()
@@ -0,0 +1,278 @@
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import spider as spider_module
+from spider import spider
+from indexer import indexer
+from retrieval import retrieval, searcher
+from fetcher import fetcher
+
+# 离线基准测试：生成合成网站并由本地 HTTP 服务器提供，依次运行 spider、indexer 和 retrieval，
+# 报告各阶段的耗时、页面/秒、字节/秒和峰值内存。每个规模在单独的子进程中运行，峰值内存互不影响。
+#
+# 用法：python benchmark.py --sizes 100 1000 10000 100000 --links 5 --words 300 --last-modified fixed
+
+# 合成网页 Last-Modified 的行为
+LAST_MODIFIED_MODES = ("fixed", "none", "changing")
+# fixed 模式下网页的最后修改时间
+BASE_MTIME = 1700000000
+
+# 合成网站
+class synthetic_site:
+    """
+    按编号确定性地生成网页，不在内存中保存整个网站。
+    网页 i 链接到 links 个随机网页和网页 i+1（保证所有网页都可以从 p0 到达），
+    标题和正文的单词服从 Zipf 分布。
+    """
+
+    def __init__(self, pages, links=5, words=300, last_modified="fixed", vocabulary=5000, seed=0):
+        """
+        :param pages: 网页数。
+        :param links: 每个网页的随机链接数（链接密度）。
+        :param words: 每个网页的正文单词数（决定网页大小）。
+        :param last_modified: "fixed"：固定的 Last-Modified 和 ETag，支持条件请求；
+                              "none"：不发送 Last-Modified；"changing"：Last-Modified 总是当前时间。
+        :param vocabulary: 词汇量。
+        :param seed: 随机种子。
+        """
+        if last_modified not in LAST_MODIFIED_MODES:
+            raise ValueError(f"last_modified must be one of {LAST_MODIFIED_MODES}")
+        self.pages = pages
+        self.links = links
+        self.words = words
+        self.last_modified = last_modified
+        self.seed = seed
+        self.vocabulary = [f"w{i}" for i in range(vocabulary)]
+        self.cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(vocabulary)))
+
+    def page(self, i):
+        """返回网页 i 的 HTML 内容。"""
+        rnd = random.Random(self.seed * 1000003 + i)
+        title = " ".join(rnd.choices(self.vocabulary, cum_weights=self.cum_weights, k=4))
+        body = " ".join(rnd.choices(self.vocabulary, cum_weights=self.cum_weights, k=self.words))
+        children = [rnd.randrange(self.pages) for _ in range(self.links)]
+        if i + 1 < self.pages:
+            children.append(i + 1)
+        anchors = "".join(f'<a href="p{child}.html">{child}</a>' for child in children)
+        return f"<html><head><title>{title}</title></head><body><p>{body}</p>{anchors}</body></html>".encode("utf-8")
+
+    def queries(self, count):
+        """生成 count 个查询，依次为单词、两个单词和短语查询。"""
+        rnd = random.Random(self.seed)
+        common = self.vocabulary[:200]
+        queries = []
+        for i in range(count):
+            if i % 3 == 0:
+                queries.append(rnd.choice(common))
+            elif i % 3 == 1:
+                queries.append(" ".join(rnd.sample(common, 2)))
+            else:
+                queries.append('"' + " ".join(rnd.sample(common, 2)) + '"')
+        return queries
+
+def serve_site(site, port_queue, requests_served, bytes_served):
+    """在子进程中运行的 HTTP 服务器，通过 port_queue 返回端口。"""
+    class handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # 支持 keep-alive
+
+        def log_message(self, *args):
+            pass
+
+        def respond(self, send_body):
+            match = re.fullmatch(r"/p(\d+)\.html", self.path)
+            if not match or int(match.group(1)) >= site.pages:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            i = int(match.group(1))
+            content = site.page(i)
+            headers = {"Content-Type": "text/html; charset=utf-8"}
+            if site.last_modified == "fixed":
+                etag = '"%s"' % hashlib.md5(content).hexdigest()
+                headers["Last-Modified"] = formatdate(BASE_MTIME + i, usegmt=True)
+                headers["ETag"] = etag
+                if self.headers.get("If-None-Match") == etag or self.headers.get("If-Modified-Since") == headers["Last-Modified"]:
+                    self.send_response(304)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.end_headers()
+                    with requests_served.get_lock():
+                        requests_served.value += 1
+                    return
+            elif site.last_modified == "changing":
+                headers["Last-Modified"] = formatdate(time.time(), usegmt=True)
+            self.send_response(200)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            if send_body:
+                self.wfile.write(content)
+            with requests_served.get_lock():
+                requests_served.value += 1
+            with bytes_served.get_lock():
+                bytes_served.value += len(content) if send_body else 0
+
+        def do_GET(self):
+            self.respond(True)
+
+        def do_HEAD(self):
+            self.respond(False)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+# 本地 HTTP 服务器
+class fixture_server:
+    """
+    在单独的进程中提供合成网站，避免服务器与爬虫争用 GIL。
+    用作上下文管理器，进入时返回网站的根 URL。
+    """
+
+    def __init__(self, site):
+        self.site = site
+        self.requests_served = multiprocessing.Value("q", 0)
+        self.bytes_served = multiprocessing.Value("q", 0)
+        self.process = None
+
+    def __enter__(self):
+        port_queue = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=serve_site, args=(self.site, port_queue, self.requests_served, self.bytes_served), daemon=True)
+        self.process.start()
+        return f"http://127.0.0.1:{port_queue.get(timeout=30)}"
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.join()
+
+    def counters(self):
+        """返回 (已处理的请求数, 已发送的正文字节数)。"""
+        return self.requests_served.value, self.bytes_served.value
+
+def peak_rss_mb():
+    """返回本进程及已结束的子进程（解析进程池）的峰值常驻内存（MB）。"""
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux 上 ru_maxrss 的单位为 KB，macOS 上为字节
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def run_benchmark(pages, links=5, words=300, last_modified="fixed", max_workers=8, parse_processes=None, index_processes=0, index_memory_budget=None, queries=5, seed=0):
+    """
+    对一个规模运行完整的基准测试，数据库写入临时目录，结束后删除。
+    阶段依次为：crawl（首次爬取）、refresh（所有网页过期后的增量刷新）、index（建立倒排索引）、
+    retrieval（每个查询调用一次 retrieval()，每次都重新加载索引）、search（同一个 searcher 执行相同的查询，不包括加载）、
+    sparse（用稀疏矩阵计算得分的 searcher 执行相同的查询）、batch（search_many 一次检索全部查询）。
+    :return: {"pages": 网页数, "stages": [{"stage", "seconds", "items", "items_per_second", "requests", "bytes", "bytes_per_second", "peak_rss_mb"}, ...]}，
+             其中 items 在 crawl、refresh 和 index 阶段为网页数，在其余阶段为查询数；
+             requests 和 bytes 为服务器在该阶段处理的请求数和发送的正文字节数。
+    """
+    site = synthetic_site(pages, links, words, last_modified, seed=seed)
+    data_dir = tempfile.mkdtemp(prefix="spider-benchmark-")
+    spider_module.DATA_DIR = data_dir
+    # 本地服务器不限速，也没有 robots.txt
+    crawl_fetcher = fetcher(max_connections_per_host=max_workers, max_requests_per_second=0, respect_robots=False)
+    stages = []
+    server = fixture_server(site)
+    try:
+        with server as base_url:
+            start_url = f"{base_url}/p0.html"
+
+            def measure(stage, run):
+                requests_before, bytes_before = server.counters()
+                start = time.perf_counter()
+                items = run()
+                seconds = time.perf_counter() - start
+                requests_after, bytes_after = server.counters()
+                stages.append({
+                    "stage": stage,
+                    "seconds": round(seconds, 3),
+                    "items": items,
+                    "items_per_second": round(items / seconds, 1) if seconds else 0.0,
+                    "requests": requests_after - requests_before,
+                    "bytes": bytes_after - bytes_before,
+                    "bytes_per_second": round((bytes_after - bytes_before) / seconds) if seconds else 0,
+                    "peak_rss_mb": round(peak_rss_mb(), 1),
+                })
+
+            measure("crawl", lambda: len(spider(start_url, pages, max_workers=max_workers, fetcher=crawl_fetcher, parse_processes=parse_processes)))
+            measure("refresh", lambda: len(spider(start_url, pages, max_workers=max_workers, incremental=True, max_age=timedelta(0), fetcher=crawl_fetcher, parse_processes=parse_processes)))
+            measure("index", lambda: indexer(start_url, pages, processes=index_processes, memory_budget=index_memory_budget) and pages)
+            measure("retrieval", lambda: len([retrieval(start_url, query, pages) for query in site.queries(queries)]))
+            loaded = searcher(start_url, pages)
+            measure("search", lambda: len([loaded.search(query) for query in site.queries(queries)]))
+            loaded = searcher(start_url, pages, use_sparse=True)
+            measure("sparse", lambda: len([loaded.search(query) for query in site.queries(queries)]))
+            measure("batch", lambda: len(loaded.search_many(site.queries(queries))))
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return {"pages": pages, "stages": stages}
+
+def print_report(results):
+    """以表格形式输出各规模、各阶段的结果。"""
+    print(f"{'pages':>8} {'stage':<10} {'seconds':>9} {'items/s':>9} {'requests':>9} {'MB/s':>8} {'peak RSS MB':>12}")
+    for result in results:
+        for stage in result["stages"]:
+            print(f"{result['pages']:>8} {stage['stage']:<10} {stage['seconds']:>9.3f} {stage['items_per_second']:>9.1f} "
+                  f"{stage['requests']:>9} {stage['bytes_per_second'] / 1e6:>8.2f} {stage['peak_rss_mb']:>12.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of spider, indexer and retrieval against a local synthetic site.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000], help="site sizes (pages) to benchmark")
+    parser.add_argument("--links", type=int, default=5, help="random links per page")
+    parser.add_argument("--words", type=int, default=300, help="body words per page")
+    parser.add_argument("--last-modified", choices=LAST_MODIFIED_MODES, default="fixed", help="Last-Modified behavior of the site")
+    parser.add_argument("--workers", type=int, default=8, help="max_workers passed to spider()")
+    parser.add_argument("--parse-processes", type=int, default=None, help="parse_processes passed to spider()")
+    parser.add_argument("--index-processes", type=int, default=0, help="processes passed to indexer()")
+    parser.add_argument("--index-memory-budget", type=int, default=None, help="memory_budget (bytes) passed to indexer() for an external-memory build")
+    parser.add_argument("--queries", type=int, default=5, help="number of retrieval queries")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the synthetic site")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    options = dict(links=args.links, words=args.words, last_modified=args.last_modified, max_workers=args.workers,
+                   parse_processes=args.parse_processes, index_processes=args.index_processes,
+                   index_memory_budget=args.index_memory_budget, queries=args.queries, seed=args.seed)
+    if args.single:
+        # 子进程：只运行一个规模，结果以 JSON 输出到标准输出的最后一行
+        print(json.dumps(run_benchmark(args.sizes[0], **options)))
+        return
+
+    results = []
+    for size in args.sizes:
+        # 每个规模在新的进程中运行，使峰值内存只反映该规模
+        command = [sys.executable, os.path.abspath(__file__), "--single", "--sizes", str(size), "--links", str(args.links),
+                   "--words", str(args.words), "--last-modified", args.last_modified, "--workers", str(args.workers),
+                   "--index-processes", str(args.index_processes), "--queries", str(args.queries), "--seed", str(args.seed)]
+        if args.parse_processes is not None:
+            command += ["--parse-processes", str(args.parse_processes)]
+        if args.index_memory_budget is not None:
+            command += ["--index-memory-budget", str(args.index_memory_budget)]
+        output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+        print_report(results[-1:])
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
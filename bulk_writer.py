@@ -0,0 +1,128 @@
+import sqlite3
+import os
+import sys
+from contextlib import contextmanager
+from itertools import islice
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# spider 和 indexer 共用的 SQLite 批量写入层：
+# - connect 打开数据库，使用 WAL 日志和适合批量写入的 pragma；
+# - insert_rows 将行按 batch_size 分批 executemany，行可以来自生成器，不需要事先放入列表；
+# - replace_generation 在同一个事务中建立新一代的表、写入数据、替换旧表并建立索引，
+#   读取者只会看到完整的旧数据或完整的新数据，旧数据中已不存在的行不会残留。
+
+# 每次 executemany 的行数
+DEFAULT_BATCH_SIZE = 5000
+# 新一代的表在替换旧表之前使用的后缀
+STAGING_SUFFIX = "__new"
+
+def connect(db_path):
+    """
+    打开数据库用于写入。
+    WAL 日志让写入期间的读取不被阻塞；synchronous=NORMAL 在 WAL 模式下只在检查点时同步磁盘；
+    临时数据放在内存中，并增大页面缓存以加快建立索引。
+    新建的数据库使用增量 auto_vacuum，replace_generation 删除旧表后可以归还空闲页面，文件不会每替换一次就增大一倍
+    （已有的数据库需要 VACUUM 一次才会改变 auto_vacuum 模式）。
+    事务由 transaction 显式管理（isolation_level=None），使 CREATE/DROP 也包含在事务中。
+    :param db_path: 数据库文件路径。
+    :return: sqlite3 连接。
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")  # 只对尚未建表的数据库生效
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -65536")  # 64 MB
+    return conn
+
+@contextmanager
+def transaction(conn):
+    """在一个写事务中执行，正常结束时提交，出现异常时回滚。"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn.cursor()
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+def batches(iterable, batch_size=DEFAULT_BATCH_SIZE):
+    """将可迭代对象按 batch_size 个一组依次返回列表。"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def insert_rows(cursor, table, columns, rows, batch_size=DEFAULT_BATCH_SIZE, replace=False):
+    """
+    分批插入行。
+    :param cursor: SQLite 游标。
+    :param table: 表名。
+    :param columns: 字段名列表。
+    :param rows: 行的可迭代对象（可以是生成器），每行为与 columns 顺序一致的元组。
+    :param batch_size: 每次 executemany 的行数。
+    :param replace: 是否使用 INSERT OR REPLACE。
+    :return: 插入的行数。
+    """
+    statement = f"INSERT {'OR REPLACE ' if replace else ''}INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    count = 0
+    for batch in batches(rows, batch_size):
+        cursor.executemany(statement, batch)
+        count += len(batch)
+    return count
+
+@contextmanager
+def replace_generation(conn, tables, indexes=()):
+    """
+    全量替换一组表。在同一个事务中：建立不带索引的新表（表名加 STAGING_SUFFIX）并交给调用者写入，
+    然后删除旧表、将新表改名，最后建立索引（批量写入后再建立索引比逐行维护索引快）。
+    提交后归还旧表占用的空闲页面。
+    :param conn: connect 返回的连接。
+    :param tables: {表名: 表定义（CREATE TABLE 表名之后的部分，如 "(id INTEGER PRIMARY KEY, name TEXT)"）}。
+    :param indexes: 替换完成后执行的 CREATE INDEX 语句。
+    :return: 上下文管理器，进入时返回 (游标, {表名: 新表名})。
+    """
+    staging = {table: table + STAGING_SUFFIX for table in tables}
+    with transaction(conn) as cursor:
+        for table, definition in tables.items():
+            cursor.execute(f"DROP TABLE IF EXISTS {staging[table]}")
+            cursor.execute(f"CREATE TABLE {staging[table]} {definition}")
+        yield cursor, staging
+        for table in tables:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            cursor.execute(f"ALTER TABLE {staging[table]} RENAME TO {table}")
+        for statement in indexes:
+            cursor.execute(statement)
+    conn.executescript("PRAGMA incremental_vacuum")  # execute 每次只归还一个页面
+
+# 值到整数编号的映射
+class id_map:
+    """
+    为 TEXT 值（URL、关键词）分配整数编号。创建时读入表中已有的编号，新值按顺序分配新编号，
+    新的行暂存在 pending 中，由 flush 批量写入。
+    """
+
+    def __init__(self, cursor, table, id_column, value_column):
+        self.table = table
+        self.columns = (id_column, value_column)
+        self.ids = {}
+        self.pending = []
+        if cursor is not None:
+            self.ids = {value: value_id for value_id, value in cursor.execute(f"SELECT {id_column}, {value_column} FROM {table}")}
+        self.next_id = max(self.ids.values(), default=0) + 1
+
+    def __getitem__(self, value):
+        """返回值的编号，不存在时分配新编号。"""
+        value_id = self.ids.get(value)
+        if value_id is None:
+            value_id = self.ids[value] = self.next_id
+            self.next_id += 1
+            self.pending.append((value_id, value))
+        return value_id
+
+    def flush(self, cursor, table=None, batch_size=DEFAULT_BATCH_SIZE):
+        """将新分配的编号写入 table（默认为创建时的表）。"""
+        insert_rows(cursor, table or self.table, self.columns, self.pending, batch_size)
+        self.pending = []
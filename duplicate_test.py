@@ -0,0 +1,71 @@
+import os
+import sys
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import spider as spider_module
+from spider import spider
+from fetcher import fetcher
+from benchmark import fixture_server
+
+# 近似重复检测的测试：在本地 HTTP 服务器上爬取一个小网站，不访问外部网络。
+# 可以直接运行（python duplicate_test.py），也可以由 pytest 收集。
+
+# 较长的正文，足以计算 SimHash 指纹
+LONG_BODY = " ".join(f"topic{i % 7} detail{i} section{i % 5}" for i in range(40))
+
+# 小型测试网站
+class duplicate_site:
+    """
+    p0 链接到其余的起始网页：
+    p1 和 p2 的正文同为很短的 "coming soon"，标题和链接不同（分别链接到 p5 和 p6），不是重复网页；
+    p3 和 p4 的标题和正文都相同，p4 合并到 p3，但只有 p4 链接到 p7。
+    """
+
+    pages = 8
+    last_modified = "fixed"
+
+    # 网页编号: (标题, 正文, 链接的网页编号)
+    contents = {
+        0: ("Home", LONG_BODY + " home", (1, 2, 3, 4)),
+        1: ("Alpha", "coming soon", (5,)),
+        2: ("Beta", "coming soon", (6,)),
+        3: ("Report", LONG_BODY, ()),
+        4: ("Report", LONG_BODY, (7,)),
+        5: ("Alpha details", LONG_BODY + " alpha", ()),
+        6: ("Beta details", "beta " + LONG_BODY, ()),
+        7: ("Appendix", "appendix notes only", ()),
+    }
+
+    def page(self, i):
+        title, body, links = self.contents[i]
+        anchors = "".join(f'<a href="p{link}.html">p{link}</a>' for link in links)
+        return f"<html><head><title>{title}</title></head><body><p>{body}</p>{anchors}</body></html>".encode("utf-8")
+
+def crawl(base_url):
+    """爬取测试网站，返回 {路径: webpage}。"""
+    pages = spider(f"{base_url}/p0.html", 20, bool_save_to_database=False, max_workers=1, parse_processes=0,
+                   fetcher=fetcher(max_requests_per_second=0, respect_robots=False))
+    return {page.url[len(base_url):]: page for page in pages}
+
+def test_duplicates():
+    data_dir = spider_module.DATA_DIR
+    with tempfile.TemporaryDirectory() as directory, fixture_server(duplicate_site()) as base_url:
+        spider_module.DATA_DIR = directory
+        try:
+            pages = crawl(base_url)
+        finally:
+            spider_module.DATA_DIR = data_dir
+
+    # 正文很短的网页没有指纹，标题不同的两个网页都被保留，其中的链接都被爬取
+    assert pages["/p1.html"].simhash == 0 and pages["/p2.html"].simhash == 0
+    assert pages["/p1.html"].title == "Alpha" and pages["/p2.html"].title == "Beta"
+    assert "/p5.html" in pages and "/p6.html" in pages
+    # 标题和正文都相同的网页合并到先访问的网页，但只能从重复网页到达的网页仍被爬取
+    assert "/p4.html" not in pages
+    assert [url[len(base_url):] for url in pages["/p3.html"].duplicate_urls] == ["/p4.html"]
+    assert "/p7.html" in pages
+    assert sorted(pages) == [f"/p{i}.html" for i in (0, 1, 2, 3, 5, 6, 7)]
+
+if __name__ == "__main__":
+    test_duplicates()
+    print("OK")
@@ -0,0 +1,147 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+import threading
+import time
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 爬虫在请求头和 robots.txt 中使用的名称
+USER_AGENT = "COMP4321Spider"
+
+# robots.txt 禁止抓取
+class robots_disallowed(requests.exceptions.RequestException):
+    pass
+
+# 单个主机的抓取状态
+class host_state:
+    def __init__(self, max_connections):
+        # 每个主机一个 Session，连接池大小与并发上限一致，以复用 keep-alive 连接
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.slots = threading.BoundedSemaphore(max_connections)  # 并发请求数上限
+        self.lock = threading.Lock()
+        self.next_request = 0.0  # 下一个请求最早可以发出的时间（time.monotonic()）
+        self.robots = None  # 缓存的 RobotFileParser
+        self.robots_lock = threading.Lock()
+
+# 抓取层
+class fetcher:
+    """
+    spider、check_database 和 retrieval 共用的抓取层：
+    - 每个主机一个 requests.Session 连接池，复用 keep-alive 连接；
+    - 每个主机的并发请求数上限和请求速率上限；
+    - 缓存每个主机的 robots.txt，遵守 Disallow 规则，并以 Crawl-delay 作为该主机的最小请求间隔。
+    各方法可以在多个线程中同时调用。
+    """
+
+    def __init__(self, max_connections_per_host=4, max_requests_per_second=20.0, respect_robots=True):
+        """
+        :param max_connections_per_host: 每个主机同时进行的请求数上限。
+        :param max_requests_per_second: 每个主机每秒的请求数上限，为 0 时不限制。
+        :param respect_robots: 是否遵守 robots.txt。
+        """
+        self.max_connections_per_host = max(1, max_connections_per_host)
+        self.min_interval = 1.0 / max_requests_per_second if max_requests_per_second else 0.0
+        self.respect_robots = respect_robots
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def host(self, url):
+        """返回 url 所在主机的 host_state，不存在时创建。"""
+        parts = urlsplit(url)
+        key = f"{parts.scheme.lower()}://{parts.netloc.lower()}"
+        with self.lock:
+            state = self.hosts.get(key)
+            if state is None:
+                state = host_state(self.max_connections_per_host)
+                self.hosts[key] = state
+            return state
+
+    def robots(self, url, timeout=5):
+        """
+        返回 url 所在主机的 robots.txt 解析结果，每个主机只下载一次。
+        robots.txt 返回 401/403 时禁止抓取整个主机，其他错误时允许抓取。
+        """
+        state = self.host(url)
+        with state.robots_lock:
+            if state.robots is None:
+                parts = urlsplit(url)
+                robots_url = f"{parts.scheme}://{parts.netloc}/robots.txt"
+                parser = RobotFileParser(robots_url)
+                try:
+                    response = state.session.get(robots_url, timeout=timeout)
+                    if response.status_code in (401, 403):
+                        parser.disallow_all = True
+                    elif response.ok:
+                        parser.parse(response.text.splitlines())
+                    else:
+                        parser.allow_all = True
+                except Exception:
+                    parser.allow_all = True
+                state.robots = parser
+            return state.robots
+
+    def allowed(self, url):
+        """检查 robots.txt 是否允许抓取 url。"""
+        if not self.respect_robots or urlsplit(url).scheme.lower() not in ("http", "https"):
+            return True
+        return self.robots(url).can_fetch(USER_AGENT, url)
+
+    def crawl_delay(self, url):
+        """返回 url 所在主机的最小请求间隔（秒），取速率上限与 Crawl-delay 中的较大值。"""
+        delay = None
+        if self.respect_robots and urlsplit(url).scheme.lower() in ("http", "https"):
+            delay = self.robots(url).crawl_delay(USER_AGENT)
+        return max(self.min_interval, float(delay) if delay else 0.0)
+
+    def wait_turn(self, state, interval):
+        """按主机的最小请求间隔排队，必要时等待。"""
+        with state.lock:
+            now = time.monotonic()
+            wait = state.next_request - now
+            state.next_request = max(now, state.next_request) + interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def request(self, method, url, headers=None, timeout=5):
+        """
+        发送请求。
+        :param method: "GET" 或 "HEAD"。
+        :param url: 网页链接。
+        :param headers: 额外的请求头。
+        :param timeout: 超时时间（秒）。
+        :return: requests 的 Response 对象；robots.txt 禁止抓取时抛出 robots_disallowed。
+        """
+        if not self.allowed(url):
+            raise robots_disallowed(f"robots.txt disallows {url}")
+        interval = self.crawl_delay(url)
+        state = self.host(url)
+        with state.slots:
+            self.wait_turn(state, interval)
+            # 与 requests.get/requests.head 一致：GET 跟随重定向，HEAD 不跟随
+            return state.session.request(method, url, headers=headers, timeout=timeout, allow_redirects=(method != "HEAD"))
+
+    def get(self, url, headers=None, timeout=5):
+        """发送 GET 请求，参数同 request。"""
+        return self.request("GET", url, headers=headers, timeout=timeout)
+
+    def head(self, url, headers=None, timeout=5):
+        """发送 HEAD 请求，参数同 request。"""
+        return self.request("HEAD", url, headers=headers, timeout=timeout)
+
+_shared_fetcher = None
+_shared_fetcher_lock = threading.Lock()
+
+def shared_fetcher():
+    """返回进程内共享的 fetcher，首次调用时创建。"""
+    global _shared_fetcher
+    with _shared_fetcher_lock:
+        if _shared_fetcher is None:
+            _shared_fetcher = fetcher()
+        return _shared_fetcher
@@ -0,0 +1,51 @@
+import os
+import sqlite3
+import sys
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import spider as spider_module
+from spider import spider, database_path
+from indexer import indexer
+from segment import SEGMENT_FILE
+from fetcher import fetcher
+from benchmark import fixture_server, synthetic_site
+
+# 建立索引的测试：同一个网页数据库在当前进程中建立和由进程池并行建立时，输出必须完全相同。
+# 可以直接运行（python index_test.py），也可以由 pytest 收集。
+
+PAGES = 60
+
+def index_files():
+    """读取段文件的字节和两个倒排索引数据库的全部行。"""
+    with open(database_path(SEGMENT_FILE), "rb") as file:
+        files = [file.read()]
+    for database_file in ("body_inverted_index.db", "title_inverted_index.db"):
+        conn = sqlite3.connect(database_path(database_file))
+        try:
+            files.append((conn.execute("SELECT * FROM documents ORDER BY doc_id").fetchall(),
+                          conn.execute("SELECT * FROM postings ORDER BY term").fetchall()))
+        finally:
+            conn.close()
+    return files
+
+def test_parallel_matches_serial():
+    data_dir = spider_module.DATA_DIR
+    with tempfile.TemporaryDirectory() as directory, fixture_server(synthetic_site(PAGES, words=80)) as base_url:
+        spider_module.DATA_DIR = directory
+        try:
+            start_url = f"{base_url}/p0.html"
+            spider(start_url, PAGES, max_workers=1, parse_processes=0,
+                   fetcher=fetcher(max_requests_per_second=0, respect_robots=False))
+            indexer(start_url, PAGES, processes=0)
+            serial = index_files()
+            indexer(start_url, PAGES, processes=2)
+            parallel = index_files()
+        finally:
+            spider_module.DATA_DIR = data_dir
+
+    assert serial[0] == parallel[0]
+    assert serial[1:] == parallel[1:]
+
+if __name__ == "__main__":
+    test_parallel_matches_serial()
+    print("OK")
@@ -2,24 +2,34 @@ import os
 import sys
 import sqlite3
 from datetime import datetime, timezone, timedelta
-import requests
-from nltk.stem import PorterStemmer
-from collections import Counter, defaultdict
-from math import log
-import re
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from math import log, sqrt, fsum, inf
+from array import array
+import heapq
+import pickle
+import tempfile
+import zlib
+from itertools import chain, accumulate, groupby, repeat
+from operator import itemgetter
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from spider import read_database, webpage, spider, load_stopwords, tokenize_and_filter, to_base64
+from spider import read_database, open_page_store, page_store, spider, encode_integers, decode_integers, database_path, MAX_VARIABLES
+from analysis import STEMMER, load_stopwords, word_positions
+from fetcher import shared_fetcher
+from bulk_writer import DEFAULT_BATCH_SIZE, connect, transaction, replace_generation, insert_rows
+from link_analysis import LINK_SCORES_FILE, compute_link_scores, save_link_scores
+from segment import SEGMENT_FILE, FIELDS, MERGED, segment_writer, write_segment, max_score
 
 def check_database(database_file, start_url, start_page):
     """
     检查数据库的有效性
     :param database_file: SQLite 数据库文件名。
     :param start_url: 起始 URL。
-    :param start_page: 起始 webpage。
+    :param start_page: 起始 webpage，为 None 时（数据库中没有起始网页）数据库无效。
     """
-    if start_page.url == start_url:
+    if start_page is not None and start_page.url == start_url:
         try:
-            response = requests.head(start_url, timeout=5)
+            response = shared_fetcher().head(start_url, timeout=5)
             response.raise_for_status()
             last_modified = response.headers.get("Last-Modified")
             if last_modified:
@@ -32,147 +42,950 @@ def check_database(database_file, start_url, start_page):
 
         # 如果 start_url 的最后修改时间不早于网页中记录的日期
         if start_url_last_modified >= start_page.date:
-            db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), database_file)
+            db_path = database_path(database_file)
             db_last_modified = datetime.fromtimestamp(os.path.getmtime(db_path), tz=timezone.utc)
             if datetime.now(timezone.utc) - db_last_modified < timedelta(days=1):
                 return True
             else:
                 return False
 
-    # 如果条件不满足，删除数据库文件后返回 False
-    os.remove(os.path.join(os.path.dirname(os.path.abspath(__file__)), database_file))
+    # 如果条件不满足，返回 False。数据库文件保留，供 spider 增量刷新时沿用未更改的网页
     return False
 
-# 定义辅助函数，将 posting 编码成 "url_base64:tf_base64:tf-idf_base64"
-def encode_posting(posting):
-    url_enc = to_base64(posting['url'])
-    tf_enc = to_base64(str(posting['tf']))
-    tfidf_enc = to_base64(f"{posting['tf-idf']:.4f}")
-    return f"{url_enc}:{tf_enc}:{tfidf_enc}"
+def inverse_document_frequency(total_documents, df):
+    """词项的 IDF，分母加 1 避免除以 0。倒排索引中的 tf-idf 为 tf 乘以该值，读取索引时由 df 重新计算。"""
+    return log(total_documents / (1 + df))
 
-def save_to_database(database_file, inverted_index):
+def encode_postings(postings, doc_ids):
+    """
+    将一个词项的 posting 列表编码为三个 encode_integers 格式的 BLOB（见 encode_posting_arrays）。
+    :param postings: [{"url": url, "tf": tf, "positions": [position, ...]}, ...]。
+    :param doc_ids: {url: 文档编号}。
+    :return: (doc_ids, tfs, positions)。
+    """
+    postings = sorted(postings, key=lambda posting: doc_ids[posting["url"]])
+    return encode_posting_arrays([doc_ids[posting["url"]] for posting in postings], [posting["tf"] for posting in postings],
+                                 chain.from_iterable(posting["positions"] for posting in postings))
+
+def encode_posting_arrays(ids, tfs, positions):
+    """
+    将按文档编号升序排列的 posting 编码为三个 encode_integers 格式的 BLOB：
+    - doc_ids：文档编号之差（第一个为文档编号本身），相邻文档的差通常只需 1 到 2 个字节；
+    - tfs：对应的词频；
+    - positions：依次连接的每个文档中的 tf 个位置。
+    :return: (doc_ids, tfs, positions)。
+    """
+    return (encode_integers([doc_id - previous for previous, doc_id in zip(chain((0,), ids), ids)]),
+            encode_integers(tfs), encode_integers(positions))
+
+def stemmed_terms(keywords, positions, stemmer):
+    """
+    将单词的词频和位置按词干合并。
+    :param keywords: {单词: 词频}。
+    :param positions: {单词: 位置列表}，可能缺少部分单词（例如从 2-5 词短语格式迁移的网页没有位置）。
+    :param stemmer: 词干化器。
+    :return: {词干: (词频, 升序的位置列表)}。
+    """
+    merged = defaultdict(lambda: [0, []])
+    for word, tf in keywords.items():
+        term = merged[stemmer.stem(word)]
+        term[0] += tf
+        if positions.get(word):
+            term[1].append(positions[word])
+    return {term: (tf, lists[0] if len(lists) == 1 else list(heapq.merge(*lists))) for term, (tf, lists) in merged.items()}
+
+def body_terms(page, stemmer):
+    """正文的词干：{词干: (词频, 升序的位置列表)}，词干相同的单词合并为一个 posting，tf 为位置个数。"""
+    return stemmed_terms(page.body_keywords, dict(page.body_positions.items()), stemmer)
+
+def title_terms(page, stemmer, stopwords):
+    """标题的词干：{词干: (词频, 升序的位置列表)}，位置同样按原始标题单词序列（包括停用词）计算。"""
+    title_positions = word_positions(page.title, stopwords)
+    title_keywords = {word: len(positions) for word, positions in title_positions.items()}
+    return stemmed_terms(title_keywords, title_positions, stemmer)
+
+def add_postings(inverted_index, url, terms):
+    """将一个文档的 {词干: (词频, 位置列表)} 加入倒排索引。"""
+    for keyword, (tf, positions) in terms.items():
+        inverted_index[keyword].append({"url": url, "tf": tf, "positions": positions})
+
+def term_list(terms):
+    """文档表 terms 列的值：按词项排序、以空格分隔，与建立索引的方式无关。"""
+    return " ".join(sorted(terms))
+
+def document_terms(inverted_index):
+    """
+    每个文档在倒排索引中的词项，存入文档表，增量更新时由它找到删除或重新建立该文档时需要改写的行。
+    :return: {url: 以空格分隔的词项（见 term_list）}。
+    """
+    terms = defaultdict(list)
+    for keyword, postings in inverted_index.items():
+        for posting in postings:
+            terms[posting["url"]].append(keyword)
+    return {url: term_list(keywords) for url, keywords in terms.items()}
+
+def compute_weights(inverted_index, total_documents):
+    """计算倒排索引中每个 posting 的 TF-IDF 权重，文档频率为词项的 posting 个数。"""
+    for keyword, postings in inverted_index.items():
+        idf = inverse_document_frequency(total_documents, len(postings))
+        for posting in postings:
+            posting["tf-idf"] = posting["tf"] * idf
+
+def build_index(webpages, stopwords):
+    """
+    在当前进程中建立正文和标题的倒排索引（不含 tf-idf）：词项按第一次出现的顺序排列，posting 按网页顺序排列。
+    多个进程并行建立见 build_index_parallel。
+    :param webpages: 网页的集合或列表。
+    :param stopwords: 停用词集合。
+    :return: (正文倒排索引, 标题倒排索引)。
+    """
+    body_inverted_index = defaultdict(list)
+    title_inverted_index = defaultdict(list)
+    for page in webpages:
+        add_postings(body_inverted_index, page.url, body_terms(page, STEMMER))
+        add_postings(title_inverted_index, page.url, title_terms(page, STEMMER, stopwords))
+    return body_inverted_index, title_inverted_index
+
+# 合并正文和标题的文档向量时标题部分的权重
+TITLE_BOOST = 2.0
+
+def document_statistics(urls, body_index, title_index, title_boost=TITLE_BOOST):
+    """
+    计算检索时需要的文档统计量，与 retrieval 的 build_doc_vectors 和 merge_doc_vectors 使用相同的计算顺序：
+    文档向量中每个词项的权重为 tf-idf 除以该文档在同一字段中最大的 tf-idf，合并时标题部分乘以 title_boost。
+    :param urls: 全部文档的 URL 列表，下标为文档编号。
+    :param body_index: 正文倒排索引（posting 已有 tf-idf）。
+    :param title_index: 标题倒排索引。
+    :param title_boost: 标题部分的权重。
+    :return: (文档向量范数列表, 正文最大 tf-idf 列表, 标题最大 tf-idf 列表, 至少有一个词项的文档数,
+              合并后的文档向量按词项转置的 {term: [(文档编号, 权重), ...]})。
+    """
+    doc_ids = {url: doc_id for doc_id, url in enumerate(urls)}
+    field_vectors = []
+    max_weights = []
+    for inverted_index in (body_index, title_index):
+        vectors = defaultdict(dict)
+        for term, postings in inverted_index.items():
+            for posting in postings:
+                vectors[doc_ids[posting["url"]]][term] = posting["tf-idf"]
+        maxima = [0.0] * len(urls)
+        for doc_id, vector in vectors.items():
+            maxima[doc_id] = max(vector.values())
+        field_vectors.append(vectors)
+        max_weights.append(maxima)
+    (body_vectors, title_vectors), (body_max, title_max) = field_vectors, max_weights
+    norms = [0.0] * len(urls)
+    merged_postings = defaultdict(list)
+    for doc_id in body_vectors.keys() | title_vectors.keys():
+        merged = {}
+        for term, weight in body_vectors.get(doc_id, {}).items():
+            merged[term] = merged.get(term, 0) + weight / (body_max[doc_id] or 1.0)
+        for term, weight in title_vectors.get(doc_id, {}).items():
+            merged[term] = merged.get(term, 0) + title_boost * (weight / (title_max[doc_id] or 1.0))
+        # fsum 的结果与求和顺序无关，增量更新后词项顺序改变时范数不变
+        norms[doc_id] = sqrt(fsum(weight ** 2 for weight in merged.values()))
+        for term, weight in merged.items():
+            merged_postings[term].append((doc_id, weight))
+    return norms, body_max, title_max, len(body_vectors.keys() | title_vectors.keys()), merged_postings
+
+# 倒排索引数据库的表：
+# - documents：文档编号到 URL 的映射，正文索引和标题索引使用相同的编号；signature 为建立该文档的 posting 时
+#   该字段内容的签名（见 page_store.iter_signatures），增量更新时用于找出内容发生变化的网页；
+#   terms 为该文档在该字段中的词项（以空格分隔），增量更新时只需改写这些词项的行；
+# - postings：每个词项一行，doc_ids、tfs 和 positions 见 encode_postings。
+INDEX_TABLES = {
+    "documents": "(doc_id INTEGER PRIMARY KEY, url TEXT NOT NULL, signature BLOB NOT NULL, terms TEXT NOT NULL)",
+    "postings": "(term TEXT PRIMARY KEY, doc_ids BLOB NOT NULL, tfs BLOB NOT NULL, positions BLOB NOT NULL)",
+}
+
+def save_to_database(database_file, inverted_index, urls, signatures, batch_size=DEFAULT_BATCH_SIZE):
     """
     将单个倒排索引存入指定的 SQLite 数据库文件。
-    存入时，将 keyword 转换为其 base64 编码，
-    postings 存储格式为：
-    url1_base64:tf1_base64:tf-idf1_base64,url2_base64:tf2_base64:tf-idf2_base64,…
-    
+    tf-idf 不存储，读取时由词频和文档频率重新计算（见 inverse_document_frequency）。
     :param database_file: SQLite 数据库文件名。
-    :param inverted_index: 倒排索引，格式为 
-           {keyword: [{"url": url, "tf": tf, "tf-idf": tf-idf}, ...]}。
+    :param inverted_index: 倒排索引，格式为
+           {keyword: [{"url": url, "tf": tf, "tf-idf": tf-idf, "positions": [position, ...]}, ...]}。
+    :param urls: 全部文档的 URL 列表，下标为文档编号。
+    :param signatures: 与 urls 顺序一致的各文档在该字段的签名。
+    :param batch_size: 每次 executemany 的行数。
     """
-    import os, sqlite3
-    conn = sqlite3.connect(os.path.join(os.path.dirname(os.path.abspath(__file__)), database_file))
-    cursor = conn.cursor()
+    doc_ids = {url: doc_id for doc_id, url in enumerate(urls)}
+    doc_terms = document_terms(inverted_index)
+    conn = connect(database_path(database_file))
+    try:
+        # 在一个事务中写入新一代的索引表并替换旧表（包括旧格式的 inverted_index 表），不会残留已不存在的关键词
+        with replace_generation(conn, INDEX_TABLES) as (cursor, staging):
+            insert_rows(cursor, staging["documents"], ("doc_id", "url", "signature", "terms"),
+                        ((doc_id, url, signature, doc_terms.get(url, "")) for doc_id, (url, signature) in enumerate(zip(urls, signatures))),
+                        batch_size)
+            # 行由生成器逐批产生
+            insert_rows(cursor, staging["postings"], ("term", "doc_ids", "tfs", "positions"),
+                        ((keyword,) + encode_postings(postings, doc_ids) for keyword, postings in inverted_index.items()),
+                        batch_size)
+            cursor.execute("DROP TABLE IF EXISTS inverted_index")
+    finally:
+        conn.close()
 
-    # 创建存储倒排索引的表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS inverted_index (
-            keyword TEXT PRIMARY KEY,
-            postings TEXT
-        )
-    ''')
+def read_index(database_file):
+    """
+    读取倒排索引数据库，tf-idf 由词频和文档频率计算。
+    :param database_file: SQLite 数据库文件名。
+    :return: {keyword: [{"url": url, "tf": tf, "tf-idf": tf-idf, "positions": [position, ...]}, ...]}；
+             数据库中没有当前格式的索引（例如旧格式的 inverted_index 表）时返回 None。
+    """
+    conn = sqlite3.connect(database_path(database_file))
+    try:
+        tables = {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if not set(INDEX_TABLES) <= tables:
+            return None
+        urls = dict(conn.execute("SELECT doc_id, url FROM documents"))
+        total_documents = len(urls)
+        index = defaultdict(list)
+        for term, doc_ids, tfs, positions in conn.execute("SELECT term, doc_ids, tfs, positions FROM postings"):
+            # 文档编号以差值存储，累加还原
+            doc_ids = list(accumulate(decode_integers(doc_ids)))
+            tfs = decode_integers(tfs)
+            positions = decode_integers(positions)
+            idf = inverse_document_frequency(total_documents, len(doc_ids))
+            postings = []
+            offset = 0
+            for doc_id, tf in zip(doc_ids, tfs):
+                postings.append({"url": urls[doc_id], "tf": tf, "tf-idf": tf * idf, "positions": positions[offset:offset + tf]})
+                offset += tf
+            index[term] = postings
+        return index
+    finally:
+        conn.close()
 
-    for keyword, postings in inverted_index.items():
-        # 将 keyword 以 base64 编码存储
-        encoded_keyword = to_base64(keyword)
-        # 将每个 posting 转换后，用逗号分隔
-        postings_str = ",".join(encode_posting(posting) for posting in postings)
-        cursor.execute('''
-            INSERT OR REPLACE INTO inverted_index (keyword, postings)
-            VALUES (?, ?)
-        ''', (encoded_keyword, postings_str))
+def read_documents(database_file):
+    """
+    读取倒排索引数据库中的文档表。
+    :param database_file: SQLite 数据库文件名。
+    :return: {url: (文档编号, 签名)}；数据库不存在或没有 signature 和 terms 字段（旧格式）时返回 None。
+    """
+    db_path = database_path(database_file)
+    if not os.path.exists(db_path):
+        return None
+    conn = sqlite3.connect(db_path)
+    try:
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(documents)")}
+        if not {"signature", "terms"} <= columns:
+            return None
+        return {url: (doc_id, signature) for doc_id, url, signature in conn.execute("SELECT doc_id, url, signature FROM documents")}
+    except sqlite3.DatabaseError:
+        return None
+    finally:
+        conn.close()
+
+# 增量更新时新增、发生变化和删除的网页超过网页总数的该比例时重新建立索引，此时逐行改写不如整体重写快
+INCREMENTAL_LIMIT = 0.25
+
+def decode_postings(doc_ids, tfs, positions):
+    """将 postings 表中的一行解码为按文档编号升序排列的 [(文档编号, 词频, 位置数组), ...]。"""
+    tfs = decode_integers(tfs)
+    positions = decode_integers(positions)
+    postings = []
+    offset = 0
+    for doc_id, tf in zip(accumulate(decode_integers(doc_ids)), tfs):
+        postings.append((doc_id, tf, positions[offset:offset + tf]))
+        offset += tf
+    return postings
+
+def update_field(database_file, removed_ids, documents, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    在一个事务中增量更新一个字段的倒排索引数据库，只读取和改写受影响的词项的行：
+    被删除或重新建立的文档原来的词项由文档表中的 terms 得到，加上重新建立的文档现在的词项；posting 已为空的词项删除。
+    :param database_file: SQLite 数据库文件名。
+    :param removed_ids: 需要删除的文档编号。
+    :param documents: 新增或内容发生变化的文档的 [(文档编号, url, 签名, {词干: (词频, 位置列表)}), ...]。
+    :param batch_size: 每次 executemany 的行数。
+    :return: 改写或删除的词项数。
+    """
+    db_path = database_path(database_file)
+    conn = connect(db_path)
+    try:
+        with transaction(conn) as cursor:
+            dropped = list(set(removed_ids) | {doc_id for doc_id, _, _, _ in documents})
+            affected = set()
+            for start in range(0, len(dropped), MAX_VARIABLES):
+                chunk = dropped[start:start + MAX_VARIABLES]
+                for terms, in cursor.execute(f"SELECT terms FROM documents WHERE doc_id IN ({', '.join('?' for _ in chunk)})", chunk).fetchall():
+                    affected.update(terms.split())
+            added = defaultdict(list)
+            for doc_id, _, _, terms in documents:
+                for keyword, (tf, positions) in terms.items():
+                    added[keyword].append((doc_id, tf, positions))
+            affected.update(added)
 
-    conn.commit()
-    conn.close()
+            dropped = set(dropped)
+            affected = list(affected)
+            rows, empty = [], []
+            for start in range(0, len(affected), MAX_VARIABLES):
+                chunk = affected[start:start + MAX_VARIABLES]
+                stored = {keyword: (doc_ids, tfs, positions) for keyword, doc_ids, tfs, positions in cursor.execute(
+                    f"SELECT term, doc_ids, tfs, positions FROM postings WHERE term IN ({', '.join('?' for _ in chunk)})", chunk).fetchall()}
+                for keyword in chunk:
+                    postings = [posting for posting in decode_postings(*stored[keyword]) if posting[0] not in dropped] if keyword in stored else []
+                    postings.extend(added.get(keyword, ()))
+                    if not postings:
+                        empty.append((keyword,))
+                        continue
+                    postings.sort(key=itemgetter(0))
+                    rows.append((keyword,) + encode_posting_arrays([doc_id for doc_id, _, _ in postings], [tf for _, tf, _ in postings],
+                                                                   chain.from_iterable(positions for _, _, positions in postings)))
+            cursor.executemany("DELETE FROM postings WHERE term = ?", empty)
+            insert_rows(cursor, "postings", ("term", "doc_ids", "tfs", "positions"), rows, batch_size, replace=True)
+            cursor.executemany("DELETE FROM documents WHERE doc_id = ?", [(doc_id,) for doc_id in removed_ids])
+            insert_rows(cursor, "documents", ("doc_id", "url", "signature", "terms"),
+                        ((doc_id, url, signature, term_list(terms)) for doc_id, url, signature, terms in documents), batch_size, replace=True)
+    finally:
+        conn.close()
+    # 没有变化时不会写入数据库，更新修改时间，使检索时不会认为索引已过期
+    os.utime(db_path)
+    return len(affected)
 
-def indexer(start_url, max_pages):
+def update_index(store, stemmer, stopwords, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    增量更新正文和标题的倒排索引数据库，耗时取决于发生变化的网页和它们的词项，而不是网页总数：
+    - 比较 webpages.db 中每个网页的签名（见 page_store.iter_signatures，不解码关键词）与倒排索引文档表中的签名，
+      找出新增、发生变化和已删除的网页，只读取和词干化签名不同的网页；
+    - 被删除或重新建立的文档原来的词项由文档表中的 terms 得到，只读取和改写这些词项和新增词项的 postings 行（见 update_field）。
+    tf-idf 不存储，网页总数改变后不需要改写其他词项；现有文档保留原来的文档编号，新增的文档使用新的编号。
+    段文件和链接分数不在这里更新（见 refresh_search_files）。
+    :param store: webpages.db 的 page_store。
+    :param stemmer: 词干化器。
+    :param stopwords: 停用词。
+    :param batch_size: 每次 executemany 的行数。
+    :return: 新增、发生变化或删除的网页数；数据库不存在、不是当前格式、两个数据库的文档编号不一致，
+             或变化的网页超过 INCREMENTAL_LIMIT 比例时返回 None，需要重新建立索引。
+    """
+    body_documents = read_documents("body_inverted_index.db")
+    title_documents = read_documents("title_inverted_index.db")
+    if (body_documents is None or title_documents is None
+            or {url: doc_id for url, (doc_id, _) in body_documents.items()} != {url: doc_id for url, (doc_id, _) in title_documents.items()}):
+        return None
+
+    signatures = {url: (body, title) for url, body, title in store.iter_signatures()}
+    removed_urls = [url for url in body_documents if url not in signatures]
+    # 每个字段中新增（没有签名）或签名发生变化的网页
+    changed = [{url for url, signature in signatures.items() if documents.get(url, (None, None))[1] != signature[field]}
+               for field, documents in enumerate((body_documents, title_documents))]
+    total_changed = len(changed[0] | changed[1]) + len(removed_urls)
+    if total_changed > INCREMENTAL_LIMIT * max(len(signatures), len(body_documents), 1):
+        return None
+
+    doc_ids = {url: doc_id for url, (doc_id, _) in body_documents.items()}
+    next_id = max(doc_ids.values(), default=-1) + 1
+    for url in signatures:
+        if url not in doc_ids:
+            doc_ids[url] = next_id
+            next_id += 1
+    removed_ids = [doc_ids[url] for url in removed_urls]
+    pages = store.get_many(changed[0] | changed[1])
+    fields = (("body_inverted_index.db", lambda page: body_terms(page, stemmer)),
+              ("title_inverted_index.db", lambda page: title_terms(page, stemmer, stopwords)))
+    for field, (database_file, page_terms) in enumerate(fields):
+        update_field(database_file, removed_ids,
+                     [(doc_ids[url], url, signatures[url][field], page_terms(pages[url])) for url in sorted(changed[field], key=doc_ids.get)],
+                     batch_size)
+    return total_changed
+
+# 外部排序建立索引（SPIMI）：网页从 webpages.db 逐个读取，posting 先积累在内存中的块里，
+# 块的估算大小达到内存预算时按词项排序写入磁盘上的临时 run，全部网页处理完后对每个字段的 run 做 k 路归并，
+# 依次写出 SQLite 中的 postings 行和段文件中的 posting 数组。posting 占用的内存只取决于预算而不是网页总数。
+
+# 外部排序建立索引的默认内存预算（字节）
+DEFAULT_MEMORY_BUDGET = 256 << 20
+# 估算块大小时每个词项的固定开销（字节）：词项字符串、字典项和三个 array 对象
+BLOCK_TERM_BYTES = 400
+
+# 内存中的 posting 块
+class posting_block:
+    """
+    一个字段的部分倒排索引 {词项: (文档编号数组, 词频数组, 依次连接的位置数组)}，
+    文档按加入的顺序（即文档编号升序）排列，并估算占用的字节数。
+    """
+
+    def __init__(self):
+        self.terms = {}
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self.terms)
+
+    def add(self, doc_id, terms):
+        """加入一个文档的 {词干: (词频, 位置列表)}。"""
+        for term, (tf, positions) in terms.items():
+            postings = self.terms.get(term)
+            if postings is None:
+                postings = self.terms[term] = (array("I"), array("I"), array("I"))
+                self.bytes += BLOCK_TERM_BYTES
+            postings[0].append(doc_id)
+            postings[1].append(tf)
+            postings[2].extend(positions)
+            self.bytes += 8 + 4 * len(positions)
+
+def write_run(block, run=None):
+    """
+    将块按词项排序写入文件（run），每个词项一条 pickle 记录 (词项, 文档编号数组, 词频数组, 位置数组)。
+    Python 字符串的顺序与 UTF-8 字节序相同，即 SQLite 的 BINARY 排序规则和段文件中词典的顺序。
+    :param run: 以二进制写入方式打开的文件，为 None 时使用新的临时文件。
+    :return: run；临时文件关闭后自动删除。
+    """
+    run = run if run is not None else tempfile.TemporaryFile()
+    for term in sorted(block.terms):
+        pickle.dump((term,) + block.terms[term], run, pickle.HIGHEST_PROTOCOL)
+    return run
+
+def read_run(run):
+    """从头依次读取 run 中的记录。"""
+    run.seek(0)
+    while True:
+        try:
+            yield pickle.load(run)
+        except EOFError:
+            return
+
+def merge_runs(runs):
+    """
+    k 路归并一个字段的全部 run，每次只在内存中保留每个 run 的一条记录。
+    同一词项在各 run 中的 posting 按 run 的顺序连接，run 按文档编号顺序写出，因此连接后文档编号仍为升序。
+    :return: 按词项排序的 (词项, 文档编号数组, 词频数组, 位置数组) 的生成器。
+    """
+    for term, records in groupby(heapq.merge(*map(read_run, runs), key=itemgetter(0)), key=itemgetter(0)):
+        _, doc_ids, tfs, positions = next(records)
+        for _, more_ids, more_tfs, more_positions in records:
+            doc_ids += more_ids
+            tfs += more_tfs
+            positions += more_positions
+        yield term, doc_ids, tfs, positions
+
+def add_square(partials, x):
+    """
+    将 x 加入 Shewchuk 算法的部分和列表（与 math.fsum 相同的精确求和）。
+    fsum(partials) 等于所有加入的值的 fsum，与加入的顺序无关。
+    """
+    i = 0
+    for y in partials:
+        if abs(x) < abs(y):
+            x, y = y, x
+        high = x + y
+        low = y - (high - x)
+        if low:
+            partials[i] = low
+            i += 1
+        x = high
+    partials[i:] = [x]
+
+def field_postings(runs, field, total_documents, maxima, weights_run):
+    """
+    归并一个字段的 run，计算每个词项的 tf-idf，更新每个文档在该字段中最大的 tf-idf，并将 tf-idf 写入 weights_run。
+    :param runs: 该字段的 run 列表。
+    :param field: 字段下标，0 为正文，1 为标题。
+    :param total_documents: 文档总数。
+    :param maxima: 每个文档在该字段中最大的 tf-idf（没有词项的文档为 -inf），就地更新。
+    :param weights_run: 临时文件，写入 (词项, 字段下标, 文档编号数组, tf-idf 数组) 记录，供 merged_postings 使用。
+    :return: 按词项排序的 (词项, 文档编号数组, 词频数组, 位置数组, postings 行的三个 BLOB) 的生成器。
+    """
+    for term, doc_ids, tfs, positions in merge_runs(runs):
+        idf = inverse_document_frequency(total_documents, len(doc_ids))
+        weights = array("d", [tf * idf for tf in tfs])
+        for doc_id, weight in zip(doc_ids, weights):
+            if weight > maxima[doc_id]:
+                maxima[doc_id] = weight
+        pickle.dump((term, field, doc_ids, weights), weights_run, pickle.HIGHEST_PROTOCOL)
+        yield term, doc_ids, tfs, positions, encode_posting_arrays(doc_ids, tfs, positions)
+
+def append_field(records, name, cursor, table, writer, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    写出一个字段的 postings 行和段文件中该字段的数组。
+    :param records: 按词项排序的 field_postings 记录。
+    :param name: 字段名。
+    :param cursor: 倒排索引数据库的游标。
+    :param table: postings 表的新表名。
+    :param writer: segment_writer。
+    :param batch_size: 每次 executemany 的行数。
+    """
+    term_bytes = postings_count = positions_count = 0
+    writer.append(f"{name}.term_offsets", [0])
+    writer.append(f"{name}.posting_offsets", [0])
+    writer.append(f"{name}.position_offsets", [0])
+
+    def rows():
+        nonlocal term_bytes, postings_count, positions_count
+        for term, doc_ids, tfs, positions, row in records:
+            encoded = term.encode("utf-8")
+            term_bytes += len(encoded)
+            postings_count += len(doc_ids)
+            positions_count += len(positions)
+            writer.append(f"{name}.terms", encoded)
+            writer.append(f"{name}.term_offsets", [term_bytes])
+            writer.append(f"{name}.posting_offsets", [postings_count])
+            writer.append(f"{name}.position_offsets", [positions_count])
+            writer.append(f"{name}.doc_ids", doc_ids)
+            writer.append(f"{name}.tfs", tfs)
+            writer.append(f"{name}.positions", positions)
+            yield (term,) + row
+
+    insert_rows(cursor, table, ("term", "doc_ids", "tfs", "positions"), rows(), batch_size)
+
+def write_field(runs, field, total_documents, cursor, table, writer, weights_run, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    归并一个字段的 run，写出 postings 行和段文件中该字段的数组，并将每个词项的 tf-idf 写入 weights_run。
+    :param runs: 该字段的 run 列表。
+    :param field: 字段下标，0 为正文，1 为标题。
+    :param total_documents: 文档总数。
+    :param cursor: 倒排索引数据库的游标。
+    :param table: postings 表的新表名。
+    :param writer: segment_writer。
+    :param weights_run: 临时文件，写入 (词项, 字段下标, 文档编号数组, tf-idf 数组) 记录，供 write_merged 使用。
+    :param batch_size: 每次 executemany 的行数。
+    :return: 每个文档在该字段中最大的 tf-idf 数组（没有词项的文档为 -inf，见 field_maxima）。
+    """
+    maxima = array("d", [-inf]) * total_documents
+    append_field(field_postings(runs, field, total_documents, maxima, weights_run), FIELDS[field], cursor, table, writer, batch_size)
+    return maxima
+
+def field_maxima(maxima):
+    """
+    :param maxima: 每个文档在一个字段中最大的 tf-idf，没有词项的文档为 -inf。
+    :return: (没有词项的文档改为 0 的数组, 在该字段中有词项的文档编号集合)。
+    """
+    return array("d", [weight if weight != -inf else 0.0 for weight in maxima]), {doc_id for doc_id, weight in enumerate(maxima) if weight != -inf}
+
+def merged_postings(weights_runs, max_weights, title_boost=TITLE_BOOST):
+    """
+    归并 write_field 写出的两个字段的 tf-idf 记录，每个词项只在内存中合并一次，
+    合并方式与 document_statistics 相同（同一词项的正文记录在标题记录之前）。
+    :param weights_runs: 正文和标题的 tf-idf 记录文件。
+    :param max_weights: 正文和标题中每个文档最大的 tf-idf。
+    :param title_boost: 标题部分的权重。
+    :return: 按词项排序的 (词项, {文档编号: 合并后的权重}) 的生成器。
+    """
+    for term, records in groupby(heapq.merge(*map(read_run, weights_runs), key=itemgetter(0)), key=itemgetter(0)):
+        merged = {}
+        for _, field, doc_ids, weights in records:
+            maxima = max_weights[field]
+            for doc_id, weight in zip(doc_ids, weights):
+                weight /= maxima[doc_id] or 1.0
+                merged[doc_id] = merged.get(doc_id, 0) + (title_boost * weight if field else weight)
+        yield term, merged
+
+def merged_squares(weights_runs, max_weights, total_documents, title_boost=TITLE_BOOST):
+    """
+    第一遍归并：每个文档合并后的权重的平方和，以部分和列表精确累加（见 add_square）。
+    :return: 每个文档的部分和列表，fsum 即平方和。
+    """
+    partials = [[] for _ in range(total_documents)]
+    for _, merged in merged_postings(weights_runs, max_weights, title_boost):
+        for doc_id, weight in merged.items():
+            add_square(partials[doc_id], weight ** 2)
+    return partials
+
+def merged_records(weights_runs, max_weights, doc_norms, title_boost=TITLE_BOOST):
+    """
+    第二遍归并：合并后的文档向量按词项转置的 posting。
+    :return: 按词项排序的 (词项, 文档编号数组, 权重数组, 最大得分) 的生成器。
+    """
+    for term, merged in merged_postings(weights_runs, max_weights, title_boost):
+        postings = sorted(merged.items())
+        yield term, array("I", [doc_id for doc_id, _ in postings]), array("d", [weight for _, weight in postings]), max_score(postings, doc_norms)
+
+def append_merged(records, writer):
+    """
+    写出段文件中合并后的文档向量的 posting。
+    :param records: 按词项排序的 merged_records 记录。
+    """
+    term_bytes = postings_count = 0
+    writer.append(f"{MERGED}.term_offsets", [0])
+    writer.append(f"{MERGED}.posting_offsets", [0])
+    for term, doc_ids, weights, score in records:
+        encoded = term.encode("utf-8")
+        term_bytes += len(encoded)
+        postings_count += len(doc_ids)
+        writer.append(f"{MERGED}.terms", encoded)
+        writer.append(f"{MERGED}.term_offsets", [term_bytes])
+        writer.append(f"{MERGED}.posting_offsets", [postings_count])
+        writer.append(f"{MERGED}.doc_ids", doc_ids)
+        writer.append(f"{MERGED}.weights", weights)
+        writer.append(f"{MERGED}.max_scores", [score])
+
+def write_merged(weights_runs, max_weights, total_documents, writer, title_boost=TITLE_BOOST):
+    """
+    写出段文件中的文档向量范数和合并后的文档向量的 posting，结果与 document_statistics 和 write_segment 相同。
+    第一遍归并计算范数，第二遍归并写出 posting 和需要范数的每个词项的最大得分。
+    :param weights_runs: 正文和标题的 tf-idf 记录文件。
+    :param max_weights: 正文和标题中每个文档最大的 tf-idf。
+    :param total_documents: 文档总数。
+    :param writer: segment_writer。
+    :param title_boost: 标题部分的权重。
+    """
+    doc_norms = array("d", [sqrt(fsum(partials)) for partials in merged_squares(weights_runs, max_weights, total_documents, title_boost)])
+    writer.append("doc_norms", doc_norms)
+    append_merged(merged_records(weights_runs, max_weights, doc_norms, title_boost), writer)
+
+def build_index_external(store, stopwords, memory_budget=DEFAULT_MEMORY_BUDGET, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    以有界的内存重新建立正文和标题的倒排索引数据库和段文件（SPIMI）。
+    网页按 webpages.db 中的编号顺序逐个读取，文档编号为读取的顺序；posting 块超过 memory_budget 时写出 run。
+    两个数据库各在一个事务中替换，段文件在数据库提交之后原子地替换。
+    URL、范数等每个文档一项的数组仍与网页总数成正比，但远小于 posting。
+    :param store: webpages.db 的 page_store。
+    :param stopwords: 停用词集合。
+    :param memory_budget: posting 块的内存预算（字节）。
+    :param batch_size: 每次 executemany 的行数。
+    :return: 文档总数。
+    """
+    signatures = {url: (body, title) for url, body, title in store.iter_signatures()}
+    connections = [connect(database_path("body_inverted_index.db")), connect(database_path("title_inverted_index.db"))]
+    runs = ([], [])
+    weights_runs = [tempfile.TemporaryFile(), tempfile.TemporaryFile()]
+    try:
+        with segment_writer(SEGMENT_FILE) as writer:
+            with replace_generation(connections[0], INDEX_TABLES) as body, replace_generation(connections[1], INDEX_TABLES) as title:
+                blocks = (posting_block(), posting_block())
+                documents = ([], [])
+                total_documents = url_bytes = 0
+                writer.append("doc_url_offsets", [0])
+                # 网页逐个读取，处理完后即可回收，不需要同时保留一批网页的关键词
+                for page in store.iter_pages("ORDER BY doc_id"):
+                    doc_id = total_documents
+                    total_documents += 1
+                    encoded = page.url.encode("utf-8")
+                    url_bytes += len(encoded)
+                    writer.append("doc_urls", encoded)
+                    writer.append("doc_url_offsets", [url_bytes])
+                    for field, terms in enumerate((body_terms(page, STEMMER), title_terms(page, STEMMER, stopwords))):
+                        documents[field].append((doc_id, page.url, signatures[page.url][field], term_list(terms)))
+                        blocks[field].add(doc_id, terms)
+                    if blocks[0].bytes + blocks[1].bytes >= memory_budget:
+                        for field, block in enumerate(blocks):
+                            runs[field].append(write_run(block))
+                        blocks = (posting_block(), posting_block())
+                    if len(documents[0]) >= batch_size:
+                        for (cursor, staging), rows in zip((body, title), documents):
+                            insert_rows(cursor, staging["documents"], ("doc_id", "url", "signature", "terms"), rows, batch_size)
+                            rows.clear()
+                for (cursor, staging), rows in zip((body, title), documents):
+                    insert_rows(cursor, staging["documents"], ("doc_id", "url", "signature", "terms"), rows, batch_size)
+                for field, block in enumerate(blocks):
+                    if block:
+                        runs[field].append(write_run(block))
+                del blocks
+
+                max_weights = []
+                indexed = set()
+                for field, (cursor, staging) in enumerate((body, title)):
+                    maxima, field_indexed = field_maxima(write_field(runs[field], field, total_documents, cursor, staging["postings"],
+                                                                     writer, weights_runs[field], batch_size))
+                    max_weights.append(maxima)
+                    indexed |= field_indexed
+                    writer.append(f"{FIELDS[field]}.max_weights", maxima)
+                    # 替换旧格式的 inverted_index 表
+                    cursor.execute("DROP TABLE IF EXISTS inverted_index")
+            write_merged(weights_runs, max_weights, total_documents, writer)
+            writer.append("meta", [total_documents, len(indexed)])
+        return total_documents
+    finally:
+        for run in chain(*runs, weights_runs):
+            run.close()
+        for conn in connections:
+            conn.close()
+
+# 并行建立索引：输出按词项的哈希值分成与进程数相同的分区，每个分区（一组互不相交的词项）由一个索引进程负责，
+# 主进程只按词项顺序连接各分区已经编码好的结果，不处理单个 posting：
+# 1. 网页按编号顺序分段，每个进程为一段网页词干化，将 posting 按分区写成按词项排序的 run（格式与外部排序建立索引相同）；
+# 2. 每个进程归并一个分区在各段中的 run，计算 tf-idf 并编码 postings 行，返回该分区中每个文档最大的 tf-idf；
+# 3. 主进程取各分区的最大值后，每个进程计算一个分区对每个文档范数的部分平方和（精确的部分和列表），主进程合并为范数；
+# 4. 每个进程写出一个分区合并后的文档向量的 posting 和最大得分；
+# 5. 主进程按词项顺序归并各分区的结果，写入数据库和段文件。
+# 文档编号为网页在 webpages.db 中的编号顺序，结果与在当前进程中建立（indexer 的串行路径）和外部排序建立索引（build_index_external）完全相同。
+
+# 并行建立索引时每个进程分到的网页段数，各段耗时不均时可以相互平衡
+SHARDS_PER_PROCESS = 4
+# 索引进程中使用的停用词，由 init_index_worker 设置
+worker_stopwords = None
+
+def init_index_worker(stopwords):
+    """索引进程池的初始化函数：保存停用词，避免每一段网页都传一次。"""
+    global worker_stopwords
+    worker_stopwords = stopwords
+
+def term_partition(term, partitions):
+    """词项所在的分区。使用 crc32 而不是 hash()，保证不同进程中的结果相同。"""
+    return zlib.crc32(term.encode("utf-8")) % partitions
+
+def partition_file(directory, kind, partition, shard=None):
+    """并行建立索引时各步骤之间传递数据的文件路径。"""
+    return os.path.join(directory, f"{kind}.{partition}" if shard is None else f"{kind}.{partition}.{shard}")
+
+def index_shard(db_path, directory, shard, first_doc_id, first_row, last_row, partitions):
+    """
+    第 1 步，在索引进程中运行：为 webpages.db 中编号在 [first_row, last_row] 之间的网页建立 posting，
+    按分区写成 run 文件（正文为 body.分区.段，标题为 title.分区.段）。
+    :param db_path: webpages.db 的路径。
+    :param directory: 临时目录。
+    :param shard: 段号。
+    :param first_doc_id: 该段第一个网页的文档编号。
+    :param first_row: 该段第一个网页在 webpages.db 中的编号。
+    :param last_row: 该段最后一个网页在 webpages.db 中的编号。
+    :param partitions: 分区数。
+    :return: 该段每个网页的 (正文词项, 标题词项)，均以空格分隔，用于倒排索引数据库的文档表。
+    """
+    blocks = [[posting_block() for _ in range(partitions)] for _ in FIELDS]
+    doc_terms = []
+    with page_store(db_path) as store:
+        for doc_id, page in enumerate(store.iter_pages("WHERE doc_id BETWEEN ? AND ? ORDER BY doc_id", (first_row, last_row)), first_doc_id):
+            fields = (body_terms(page, STEMMER), title_terms(page, STEMMER, worker_stopwords))
+            for field, terms in enumerate(fields):
+                parts = [{} for _ in range(partitions)]
+                for term, posting in terms.items():
+                    parts[term_partition(term, partitions)][term] = posting
+                for block, part in zip(blocks[field], parts):
+                    block.add(doc_id, part)
+            doc_terms.append(tuple(term_list(terms) for terms in fields))
+    for name, field_blocks in zip(FIELDS, blocks):
+        for partition, block in enumerate(field_blocks):
+            with open(partition_file(directory, name, partition, shard), "wb") as run:
+                write_run(block, run)
+    return doc_terms
+
+def index_partition(directory, partition, shards, total_documents):
+    """
+    第 2 步，在索引进程中运行：按段的顺序归并一个分区的 run（文档编号仍为升序），
+    写出每个字段按词项排序的 field_postings 记录（postings.字段.分区）和 tf-idf 记录（weights.字段.分区）。
+    :return: [正文中每个文档最大的 tf-idf, 标题中每个文档最大的 tf-idf]，只包括该分区的词项，没有词项的文档为 -inf。
+    """
+    max_weights = []
+    for field, name in enumerate(FIELDS):
+        runs = [open(partition_file(directory, name, partition, shard), "rb") for shard in range(shards)]
+        maxima = array("d", [-inf]) * total_documents
+        try:
+            with open(partition_file(directory, f"postings.{name}", partition), "wb") as output, \
+                    open(partition_file(directory, f"weights.{name}", partition), "wb") as weights_run:
+                for record in field_postings(runs, field, total_documents, maxima, weights_run):
+                    pickle.dump(record, output, pickle.HIGHEST_PROTOCOL)
+        finally:
+            for run in runs:
+                run.close()
+                os.remove(run.name)
+        max_weights.append(maxima)
+    return max_weights
+
+def partition_weights(directory, partition):
+    """打开一个分区的正文和标题 tf-idf 记录文件。"""
+    return [open(partition_file(directory, f"weights.{name}", partition), "rb") for name in FIELDS]
+
+def partition_squares(directory, partition, max_weights, total_documents):
+    """第 3 步，在索引进程中运行：一个分区中每个文档合并后的权重的平方和的部分和列表（见 merged_squares）。"""
+    weights_runs = partition_weights(directory, partition)
+    try:
+        return merged_squares(weights_runs, max_weights, total_documents)
+    finally:
+        for run in weights_runs:
+            run.close()
+
+def partition_merged(directory, partition, max_weights, doc_norms):
+    """第 4 步，在索引进程中运行：写出一个分区按词项排序的 merged_records 记录（merged.分区）。"""
+    weights_runs = partition_weights(directory, partition)
+    try:
+        with open(partition_file(directory, "merged", partition), "wb") as output:
+            for record in merged_records(weights_runs, max_weights, doc_norms):
+                pickle.dump(record, output, pickle.HIGHEST_PROTOCOL)
+    finally:
+        for run in weights_runs:
+            run.close()
+
+def read_partitions(directory, kind, partitions):
+    """第 5 步：按词项顺序归并各分区的记录，各分区的词项互不相交。"""
+    files = [open(partition_file(directory, kind, partition), "rb") for partition in range(partitions)]
+    try:
+        yield from heapq.merge(*map(read_run, files), key=itemgetter(0))
+    finally:
+        for file in files:
+            file.close()
+
+def build_index_parallel(store, stopwords, processes, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    用 processes 个索引进程重新建立正文和标题的倒排索引数据库和段文件，步骤见上面的说明。
+    两个数据库各在一个事务中替换，段文件在数据库提交之后原子地替换。
+    :param store: webpages.db 的 page_store。
+    :param stopwords: 停用词集合。
+    :param processes: 索引进程数，也是分区数。
+    :param batch_size: 每次 executemany 的行数。
+    :return: 文档总数。
+    """
+    rows = [row for row, in store.conn.execute("SELECT doc_id FROM documents ORDER BY doc_id")]
+    urls = [url for url, in store.conn.execute("SELECT url FROM documents JOIN urls ON url_id = doc_id ORDER BY doc_id")]
+    signatures = {url: (body, title) for url, body, title in store.iter_signatures()}
+    total_documents = len(urls)
+    shard_size = max(1, -(-total_documents // (processes * SHARDS_PER_PROCESS)))
+    shards = [(start, rows[start], rows[min(start + shard_size, total_documents) - 1]) for start in range(0, total_documents, shard_size)]
+    partitions = processes
+
+    with tempfile.TemporaryDirectory() as directory:
+        with ProcessPoolExecutor(max_workers=processes, initializer=init_index_worker, initargs=(stopwords,)) as pool:
+            doc_terms = list(chain.from_iterable(pool.map(index_shard, repeat(database_path("webpages.db")), repeat(directory), range(len(shards)),
+                                                          *zip(*shards), repeat(partitions))))
+            max_weights = []
+            indexed = set()
+            for field_maxima_lists in zip(*pool.map(index_partition, repeat(directory), range(partitions), repeat(len(shards)), repeat(total_documents))):
+                maxima = field_maxima_lists[0]
+                for other in field_maxima_lists[1:]:
+                    maxima = array("d", map(max, maxima, other))
+                maxima, field_indexed = field_maxima(maxima)
+                max_weights.append(maxima)
+                indexed |= field_indexed
+            # 各分区的部分和列表合在一起求 fsum，与一次求全部平方和的 fsum 相同
+            doc_norms = array("d", [sqrt(fsum(chain.from_iterable(partials))) for partials in
+                                    zip(*pool.map(partition_squares, repeat(directory), range(partitions), repeat(max_weights), repeat(total_documents)))])
+            list(pool.map(partition_merged, repeat(directory), range(partitions), repeat(max_weights), repeat(doc_norms)))
+
+        connections = [connect(database_path("body_inverted_index.db")), connect(database_path("title_inverted_index.db"))]
+        try:
+            with segment_writer(SEGMENT_FILE) as writer:
+                with replace_generation(connections[0], INDEX_TABLES) as body, replace_generation(connections[1], INDEX_TABLES) as title:
+                    for field, (cursor, staging) in enumerate((body, title)):
+                        insert_rows(cursor, staging["documents"], ("doc_id", "url", "signature", "terms"),
+                                    ((doc_id, url, signatures[url][field], terms[field]) for doc_id, (url, terms) in enumerate(zip(urls, doc_terms))),
+                                    batch_size)
+                        append_field(read_partitions(directory, f"postings.{FIELDS[field]}", partitions), FIELDS[field],
+                                     cursor, staging["postings"], writer, batch_size)
+                        writer.append(f"{FIELDS[field]}.max_weights", max_weights[field])
+                        # 替换旧格式的 inverted_index 表
+                        cursor.execute("DROP TABLE IF EXISTS inverted_index")
+                encoded_urls = [url.encode("utf-8") for url in urls]
+                writer.append("doc_url_offsets", accumulate(map(len, encoded_urls), initial=0))
+                writer.append("doc_urls", b"".join(encoded_urls))
+                writer.append("doc_norms", doc_norms)
+                append_merged(read_partitions(directory, "merged", partitions), writer)
+                writer.append("meta", [total_documents, len(indexed)])
+        finally:
+            for conn in connections:
+                conn.close()
+    return total_documents
+
+def open_webpages(start_url, max_pages):
+    """
+    打开网页数据库用于按需读取；数据库不存在或无效时先调用 spider 爬取（已有数据库时增量刷新，上一次爬取中断时从检查点继续）。
+    :return: page_store。
+    """
+    store = open_page_store("webpages.db")
+    start_page = store.start_page() if store else None
+    if start_page is None or max_pages != len(store) or not check_database("webpages.db", start_url, start_page):
+        if store:
+            store.close()
+        # spider 返回的网页不再使用，建立索引时从数据库重新读取
+        spider(start_url, max_pages, incremental=store is not None, resume=True)
+        store = open_page_store("webpages.db")
+    return store
+
+def external_indexer(start_url, max_pages, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """
+    indexer 的外部排序模式：网页数据库有效时直接从中逐个读取网页，否则先调用 spider 爬取。
+    :return: (None, None)。
+    """
+    with open_webpages(start_url, max_pages) as store:
+        build_index_external(store, load_stopwords("stopwords.txt"), memory_budget)
+        # 链接分析只读取网页的链接，不读取关键词
+        save_link_scores(LINK_SCORES_FILE, compute_link_scores(store.iter_pages()))
+    return None, None
+
+def write_search_files(urls, body_inverted_index, title_inverted_index, webpages):
+    """
+    写出检索使用的段文件（包括文档向量的范数和各字段最大的 tf-idf）和链接分数。
+    :param urls: 全部文档的 URL 列表，下标为段文件中的文档编号。
+    :param body_inverted_index: 正文倒排索引（posting 已有 tf-idf）。
+    :param title_inverted_index: 标题倒排索引。
+    :param webpages: 全部网页，只读取其中的链接。
+    """
+    norms, body_max, title_max, indexed_docs, merged_postings = document_statistics(urls, body_inverted_index, title_inverted_index)
+    write_segment(SEGMENT_FILE, urls, {"body": body_inverted_index, "title": title_inverted_index},
+                  norms, {"body": body_max, "title": title_max}, indexed_docs, merged_postings)
+    # 由网页之间的链接计算 PageRank 和 HITS 分数，检索时直接读取
+    save_link_scores(LINK_SCORES_FILE, compute_link_scores(webpages))
+
+def refresh_search_files(store):
+    """
+    由倒排索引数据库重新写出段文件和链接分数（见 write_search_files）。
+    网页总数改变后所有文档的范数和合并后的权重都会改变，因此需要读取完整的倒排索引（不需要重新词干化），
+    耗时与网页总数成正比；增量更新时可以推迟（见 indexer 的 defer_search_files），在若干次更新之后执行一次。
+    :param store: webpages.db 的 page_store。
+    """
+    documents = read_documents("body_inverted_index.db")
+    urls = [url for url, _ in sorted(documents.items(), key=lambda item: item[1][0])]
+    write_search_files(urls, read_index("body_inverted_index.db"), read_index("title_inverted_index.db"), store.iter_pages())
+
+def indexer(start_url, max_pages, incremental=False, processes=0, memory_budget=None, defer_search_files=False):
     """
     尝试从数据库读取数据或调用 spider 爬取网页，
     并基于正文关键词和标题关键词构建倒排索引。
     :param start_url: 起始 URL。
     :param max_pages: 最大爬取页面数。
-    :return: 包含正文关键词和标题关键词的倒排索引。
+    :param incremental: 已有当前格式的倒排索引数据库时，是否只更新发生变化的网页（见 update_index），
+                        不把网页和倒排索引读入内存；变化的网页过多时仍然重新建立。为 False 时重新建立。
+    :param processes: 重新建立索引时的索引进程数，大于 1 时由进程池按词项分区建立（见 build_index_parallel），
+                      为 0 或 1 时在当前进程中建立，为 None 时为 CPU 核数（单核时为 0）。
+    :param memory_budget: 不为 None 时以该内存预算（字节）外部排序重新建立索引（见 build_index_external），
+                          忽略 incremental 和 processes，不把网页和倒排索引读入内存。
+    :param defer_search_files: 增量更新后不重写段文件和链接分数，由调用者之后调用 refresh_search_files；
+                               在此之前检索仍使用上一次写出的段文件。
+    :return: 包含正文关键词和标题关键词的倒排索引；增量更新、并行或外部排序建立索引时返回 (None, None)，检索时从段文件或数据库读取。
     """
-    # 尝试从数据库读取数据
-    webpages, start_page = read_database("webpages.db")
-
-    # 数据库无效
-    if webpages is None or start_page is None or max_pages != len(webpages) or not check_database("webpages.db", start_url, start_page):
-        # 调用 spider 函数进行爬取
-        webpages = spider(start_url, max_pages)
-        start_page = next((page for page in webpages if page.url == start_url), None)
-
-    # 初始化 PorterStemmer
-    stemmer = PorterStemmer()
+    if memory_budget is not None:
+        return external_indexer(start_url, max_pages, memory_budget)
 
+    # 带缓存的 PorterStemmer：每个不同的单词只词干化一次
+    stemmer = STEMMER
     # 加载停用词
     stopwords = load_stopwords("stopwords.txt")
 
-    # 构建正文关键词倒排索引
-    body_inverted_index = defaultdict(list)
-    body_document_frequencies = defaultdict(int)  # 用于存储每个正文词干的文档频率（DF）
+    if processes is None:
+        # 单核机器上进程池只会增加序列化开销
+        processes = os.cpu_count() or 1
+        processes = processes if processes > 1 else 0
 
-    # 构建标题关键词倒排索引
-    title_inverted_index = defaultdict(list)
-    title_document_frequencies = defaultdict(int)  # 用于存储每个标题词干的文档频率（DF）
+    if incremental or processes > 1:
+        with open_webpages(start_url, max_pages) as store:
+            if incremental and update_index(store, stemmer, stopwords) is not None:
+                if not defer_search_files:
+                    refresh_search_files(store)
+                return None, None
+            if processes > 1:
+                # 多核时由索引进程池按词项分区建立，直接写出数据库和段文件
+                build_index_parallel(store, stopwords, processes)
+                save_link_scores(LINK_SCORES_FILE, compute_link_scores(store.iter_pages()))
+                return None, None
+        # 网页数据库已经检查过，重新建立索引时不需要再次检查
+        webpages, _ = read_database("webpages.db")
+    else:
+        # 尝试从数据库读取数据
+        webpages, start_page = read_database("webpages.db")
 
-    total_documents = len(webpages)  # 文档总数
+        # 数据库无效
+        if webpages is None or start_page is None or max_pages != len(webpages) or not check_database("webpages.db", start_url, start_page):
+            # 调用 spider 函数进行爬取；已有数据库时增量刷新，只重新抓取过期的和新发现的网页；
+            # 上一次爬取中断时从检查点继续
+            webpages = spider(start_url, max_pages, incremental=webpages is not None, resume=True)
 
-    # 遍历每个网页，填充正文和标题的倒排索引
-    for page in webpages:
-        # 处理正文关键词
-        for keyword, tf in page.body_keywords.items():
-            # 如果关键词多于1个单词，则对其中每个单词都进行词干化
-            if " " in keyword:
-                tokens = keyword.split()
-                stemmed_keyword = " ".join(stemmer.stem(token) for token in tokens)
-            else:
-                stemmed_keyword = stemmer.stem(keyword)
-            body_inverted_index[stemmed_keyword].append({"url": page.url, "tf": tf})
-            body_document_frequencies[stemmed_keyword] += 1
-
-        # 处理标题关键词
-
-        # 1. 单词统计：通过 tokenize_and_filter 获取去除停用词后的单词，并词干化统计
-        title_single_words = tokenize_and_filter(page.title, stopwords)
-        title_single_counter = Counter(stemmer.stem(word) for word in title_single_words)
-
-        # 2. 短语统计：直接从原始标题文本提取单词（不移除停用词），组合连续2到5个词构成短语，并词干化每个短语
-        raw_title_words = re.findall(r'\b\w+\b', page.title.lower())
-        title_phrase_counter = Counter()
-        # 当标题较短时，确保 n 不超过标题单词个数
-        for n in range(2, min(6, len(raw_title_words) + 1)):
-            for i in range(len(raw_title_words) - n + 1):
-                phrase = " ".join(raw_title_words[i:i+n])
-                # 对短语中的每个单词进行词干化
-                stemmed_phrase = " ".join(stemmer.stem(word) for word in phrase.split())
-                title_phrase_counter[stemmed_phrase] += 1
-
-        # 合并单词和短语的统计结果
-        title_combined_counter = title_single_counter + title_phrase_counter
-
-        # 更新标题倒排索引和文档频率统计
-        for keyword, tf in title_combined_counter.items():
-            title_inverted_index[keyword].append({"url": page.url, "tf": tf})
-            title_document_frequencies[keyword] += 1
-
-    # 计算正文关键词的 TF-IDF 权重并更新倒排索引
-    for keyword, postings in body_inverted_index.items():
-        df = body_document_frequencies[keyword]  # 文档频率
-        idf = log(total_documents / (1 + df))  # 计算 IDF，避免除以 0
-        for posting in postings:
-            tf = posting["tf"]
-            posting["tf-idf"] = tf * idf  # 计算 TF-IDF 权重
+    with open_page_store("webpages.db") as store:
+        signatures = {url: (body, title) for url, body, title in store.iter_signatures()}
+    # 两个索引使用相同的文档编号：网页按 webpages.db 中的编号顺序排列，与并行和外部排序建立索引相同，
+    # 不依赖集合的迭代顺序（随字符串哈希的种子变化）
+    doc_ids = {url: doc_id for doc_id, url in enumerate(signatures)}
+    webpages = sorted(webpages, key=lambda page: doc_ids[page.url])
+    urls = [page.url for page in webpages]
 
-    # 计算标题关键词的 TF-IDF 权重并更新倒排索引
-    for keyword, postings in title_inverted_index.items():
-        df = title_document_frequencies[keyword]  # 文档频率
-        idf = log(total_documents / (1 + df))  # 计算 IDF，避免除以 0
-        for posting in postings:
-            tf = posting["tf"]
-            posting["tf-idf"] = tf * idf  # 计算 TF-IDF 权重
+    # 构建正文和标题关键词倒排索引
+    body_inverted_index, title_inverted_index = build_index(webpages, stopwords)
+
+    # 计算正文和标题关键词的 TF-IDF 权重并更新倒排索引
+    total_documents = len(webpages)  # 文档总数
+    compute_weights(body_inverted_index, total_documents)
+    compute_weights(title_inverted_index, total_documents)
 
-    save_to_database("body_inverted_index.db", body_inverted_index)
-    save_to_database("title_inverted_index.db", title_inverted_index)
-    return body_inverted_index, title_inverted_index
\ No newline at end of file
+    save_to_database("body_inverted_index.db", body_inverted_index, urls, [signatures[url][0] for url in urls])
+    save_to_database("title_inverted_index.db", title_inverted_index, urls, [signatures[url][1] for url in urls])
+    # 同时写出供 mmap 访问的段文件和链接分数
+    write_search_files(urls, body_inverted_index, title_inverted_index, webpages)
+    return body_inverted_index, title_inverted_index
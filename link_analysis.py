@@ -0,0 +1,140 @@
+import os
+import sys
+import sqlite3
+import numpy as np
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from spider import database_path
+from bulk_writer import DEFAULT_BATCH_SIZE, connect, replace_generation, insert_rows
+
+# 链接分析：在建立索引时由网页的子链接构造稀疏的整数编号邻接矩阵，
+# 用向量化的幂迭代计算 PageRank 和 HITS，结果存入 link_scores.db，检索时直接读取，不需要在查询时计算。
+
+# 链接分数数据库
+LINK_SCORES_FILE = "link_scores.db"
+# 链接分数的种类，即 link_scores 表中分数字段的名称
+LINK_SCORES = ("pagerank", "authority", "hub")
+
+def build_adjacency(pages):
+    """
+    将网页之间的链接转换为整数编号的边列表（COO 格式的稀疏邻接矩阵）。
+    只保留指向已访问网页的链接，指向近似重复网页的链接计入其规范网页；忽略自环，同一对网页之间的多个链接只计一次。
+    :param pages: webpage 的可迭代对象。
+    :return: (URL 列表, 源网页编号数组, 目标网页编号数组)，编号为 URL 在列表中的下标。
+    """
+    pages = list(pages)
+    urls = [page.url for page in pages]
+    ids = {url: i for i, url in enumerate(urls)}
+    for i, page in enumerate(pages):
+        for duplicate_url in page.duplicate_urls:
+            ids.setdefault(duplicate_url, i)
+    edges = set()
+    for i, page in enumerate(pages):
+        for link in page.child_links:
+            j = ids.get(link)
+            if j is not None and j != i:
+                edges.add((i, j))
+    edges = np.array(sorted(edges), dtype=np.int64).reshape(-1, 2)
+    return urls, edges[:, 0], edges[:, 1]
+
+def pagerank(sources, targets, n, damping=0.85, tolerance=1e-9, max_iterations=100):
+    """
+    用幂迭代计算 PageRank。没有出链的网页的分数均匀分配给所有网页。
+    :param sources: 边的源网页编号数组。
+    :param targets: 边的目标网页编号数组。
+    :param n: 网页数。
+    :param damping: 阻尼系数。
+    :param tolerance: 两次迭代之间分数的 L1 距离小于该值时停止。
+    :param max_iterations: 最大迭代次数。
+    :return: 长度为 n 的分数数组，总和为 1。
+    """
+    if n == 0:
+        return np.zeros(0)
+    out_degree = np.bincount(sources, minlength=n).astype(np.float64)
+    dangling = out_degree == 0
+    # 每条边的权重为 1 / 源网页的出度
+    weights = 1.0 / out_degree[sources]
+    rank = np.full(n, 1.0 / n)
+    for _ in range(max_iterations):
+        spread = np.bincount(targets, weights=rank[sources] * weights, minlength=n)
+        new_rank = (1.0 - damping) / n + damping * (spread + rank[dangling].sum() / n)
+        converged = np.abs(new_rank - rank).sum() < tolerance
+        rank = new_rank
+        if converged:
+            break
+    return rank
+
+def hits(sources, targets, n, tolerance=1e-9, max_iterations=100):
+    """
+    用幂迭代计算 HITS 的权威值和枢纽值。
+    :param sources: 边的源网页编号数组。
+    :param targets: 边的目标网页编号数组。
+    :param n: 网页数。
+    :param tolerance: 两次迭代之间权威值的 L1 距离小于该值时停止。
+    :param max_iterations: 最大迭代次数。
+    :return: (权威值数组, 枢纽值数组)，均按 L2 范数归一化；没有链接时全为 0。
+    """
+    if n == 0 or len(sources) == 0:
+        return np.zeros(n), np.zeros(n)
+    hub = np.ones(n) / np.sqrt(n)
+    authority = np.zeros(n)
+    for _ in range(max_iterations):
+        # authority = A^T · hub，hub = A · authority
+        new_authority = np.bincount(targets, weights=hub[sources], minlength=n)
+        new_authority /= np.linalg.norm(new_authority)
+        hub = np.bincount(sources, weights=new_authority[targets], minlength=n)
+        hub /= np.linalg.norm(hub)
+        converged = np.abs(new_authority - authority).sum() < tolerance
+        authority = new_authority
+        if converged:
+            break
+    return authority, hub
+
+def compute_link_scores(pages):
+    """
+    计算网页的链接分数。
+    :param pages: webpage 的可迭代对象。
+    :return: {url: (pagerank, authority, hub)}。
+    """
+    urls, sources, targets = build_adjacency(pages)
+    n = len(urls)
+    rank = pagerank(sources, targets, n)
+    authority, hub = hits(sources, targets, n)
+    return {url: scores for url, scores in zip(urls, zip(rank.tolist(), authority.tolist(), hub.tolist()))}
+
+def save_link_scores(database_file, link_scores, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    将链接分数存入数据库，替换原有的分数。
+    :param database_file: SQLite 数据库文件名。
+    :param link_scores: compute_link_scores 的返回值。
+    :param batch_size: 每次 executemany 的行数。
+    """
+    conn = connect(database_path(database_file))
+    try:
+        definition = "(url TEXT PRIMARY KEY, " + ", ".join(f"{name} REAL NOT NULL" for name in LINK_SCORES) + ")"
+        with replace_generation(conn, {"link_scores": definition}) as (cursor, staging):
+            insert_rows(cursor, staging["link_scores"], ("url",) + LINK_SCORES,
+                        ((url,) + scores for url, scores in link_scores.items()), batch_size)
+    finally:
+        conn.close()
+
+def read_link_scores(database_file, score="pagerank"):
+    """
+    读取一种链接分数，并除以最大值归一化到 [0, 1]。
+    :param database_file: SQLite 数据库文件名。
+    :param score: LINK_SCORES 中的一种。
+    :return: {url: 分数}；数据库不存在或已损坏时返回空字典。
+    """
+    if score not in LINK_SCORES:
+        raise ValueError(f"score must be one of {LINK_SCORES}")
+    db_path = database_path(database_file)
+    if not os.path.exists(db_path):
+        return {}
+    conn = sqlite3.connect(db_path)
+    try:
+        scores = dict(conn.execute(f"SELECT url, {score} FROM link_scores"))
+    except sqlite3.DatabaseError:
+        return {}
+    finally:
+        conn.close()
+    largest = max(scores.values(), default=0.0)
+    return {url: value / largest for url, value in scores.items()} if largest > 0 else scores
@@ -0,0 +1,104 @@
+import argparse
+import os
+import sys
+from datetime import datetime, timezone
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from spider import webpage, string_tables, from_base64, has_schema, write_webpages, database_path, TABLES, INDEXES
+from bulk_writer import connect, replace_generation
+
+# 将旧格式（所有字段 base64 编码后存为 TEXT 的 webpages 表）的 webpages.db 一次性转换为当前的表结构。
+#
+# 用法：python migrate_database.py [webpages.db ...]
+
+def read_legacy_pages(cursor):
+    """
+    读取旧格式的 webpages 表。
+    旧表的正文关键词字段有两种：body_positions（{单词: 位置列表}），以及更早的 body_keywords
+    （{单词或 2-5 词短语: 词频}）。后者没有位置，只保留单词的词频，并清除缓存验证字段，
+    使下一次爬取重新抓取和解析这些网页。
+    :return: (webpage 列表, 起始 URL)。
+    """
+    cursor.execute("PRAGMA table_info(webpages)")
+    existing_columns = {row[1] for row in cursor.fetchall()}
+    columns = [column for column in ("url", "title", "date", "size", "body_positions", "body_keywords", "parent_links", "child_links",
+                                     "is_start", "last_modified", "etag", "crawled", "simhash", "duplicate_urls") if column in existing_columns]
+    cursor.execute(f"SELECT {', '.join(columns)} FROM webpages")
+
+    def decode_links(links_str):
+        return [from_base64(link) for link in links_str.split(",")] if links_str else []
+
+    def decode_map(map_str):
+        items = {}
+        for item in map_str.split(",") if map_str else ():
+            parts = item.split(":")
+            if len(parts) == 2:
+                items[from_base64(parts[0])] = from_base64(parts[1])
+        return items
+
+    tables = string_tables()  # 转换的网页共用的编号表
+    pages = []
+    start_url = None
+    for values in cursor.fetchall():
+        row = dict(zip(columns, values))
+        date_str = from_base64(row["date"]) if row.get("date") else ""
+        crawled_str = from_base64(row["crawled"]) if row.get("crawled") else ""
+        page = webpage(
+            url=from_base64(row["url"]),
+            title=from_base64(row["title"]) if row.get("title") else "",
+            date=datetime.fromisoformat(date_str) if date_str else None,
+            size=int(from_base64(row["size"])) if row.get("size") else 0,
+            parent_links=set(decode_links(row.get("parent_links"))),
+            child_links=decode_links(row.get("child_links")),
+            last_modified=from_base64(row["last_modified"]) if row.get("last_modified") else "",
+            etag=from_base64(row["etag"]) if row.get("etag") else "",
+            crawled=datetime.fromisoformat(crawled_str) if crawled_str else None,
+            simhash=int(from_base64(row["simhash"])) if row.get("simhash") else 0,
+            duplicate_urls=decode_links(row.get("duplicate_urls")),
+            tables=tables
+        )
+        if "body_positions" in row:
+            page.body_positions = {word: [int(position) for position in positions.split()]
+                                   for word, positions in decode_map(row["body_positions"]).items()}
+        else:
+            page.body_keywords = {word: int(tf) for word, tf in decode_map(row.get("body_keywords")).items() if " " not in word}
+            page.last_modified = ""
+            page.etag = ""
+            page.crawled = datetime(1970, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
+        pages.append(page)
+        if row.get("is_start") and from_base64(row["is_start"]) == "1":
+            start_url = page.url
+    return pages, start_url
+
+def migrate(database_file):
+    """
+    在同一个事务中将旧格式的数据库转换为当前格式，并回收空间。
+    :param database_file: 数据库文件名，相对路径相对于 spider.DATA_DIR。
+    :return: 转换的网页数；数据库已是当前格式时返回 0。
+    """
+    db_path = database_path(database_file)
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(db_path)
+    conn = connect(db_path)
+    try:
+        cursor = conn.cursor()
+        if has_schema(cursor):
+            return 0
+        pages, start_url = read_legacy_pages(cursor)
+        with replace_generation(conn, TABLES, INDEXES) as (cursor, staging):
+            write_webpages(cursor, pages, start_url, staging=staging)
+            cursor.execute("DROP TABLE webpages")
+        conn.execute("VACUUM")
+        return len(pages)
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert webpages.db from the base64 TEXT format to the integer-keyed schema.")
+    parser.add_argument("databases", nargs="*", default=["webpages.db"], help="database files to migrate")
+    args = parser.parse_args()
+    for database_file in args.databases:
+        migrated = migrate(database_file)
+        print(f"{database_file}: {'migrated %d pages' % migrated if migrated else 'already in the current format'}")
+
+if __name__ == "__main__":
+    main()
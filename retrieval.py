@@ -1,36 +1,20 @@
-import sqlite3
-import re
 import math
 from collections import defaultdict, Counter
-from nltk.stem import PorterStemmer
 from datetime import datetime, timezone, timedelta
 import os
-from spider import spider, read_database as spider_read_database, webpage, load_stopwords, from_base64
-from indexer import indexer, check_database
-
-# 加载倒排索引数据
-def read_database(db_file):
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    cursor.execute("SELECT keyword, postings FROM inverted_index")
-    index = defaultdict(list)
-    rows = cursor.fetchall()
-    for keyword, postings_str in rows:
-        # 解码关键字
-        decoded_keyword = from_base64(keyword)
-        postings = []
-        if postings_str:
-            for item in postings_str.split(","):
-                parts = item.split(":")
-                # parts[0]、parts[1]、parts[2] 均为 base64 编码的字符串
-                if len(parts) == 3:
-                    decoded_url = from_base64(parts[0])
-                    decoded_tf = float(from_base64(parts[1]))
-                    decoded_tfidf = float(from_base64(parts[2]))
-                    postings.append({"url": decoded_url, "tf": decoded_tf, "tf-idf": decoded_tfidf})
-        index[decoded_keyword] = postings
-    conn.close()
-    return index
+import heapq
+import threading
+import time
+from bisect import bisect_left
+from itertools import accumulate
+from operator import itemgetter
+import numpy as np
+from spider import spider, open_page_store, webpage, database_path
+from analysis import STEMMER, load_stopwords, tokenize
+from indexer import indexer, check_database, read_index, TITLE_BOOST
+from segment import SEGMENT_FILE, open_segment
+from link_analysis import LINK_SCORES_FILE, read_link_scores
+from sparse_scoring import sparse_scorer, top_k_scores
 
 # 根据倒排索引构造文档向量（字典形式：{doc_url: {term: weight, ...}}）
 def build_doc_vectors(inverted_index):
@@ -97,13 +81,13 @@ def parse_query(query, stemmer, stopwords):
             else:
                 part = query[i:j]
                 i = j
-            tokens.extend([token for token in re.findall(r'\w+', part.lower()) if token not in stopwords])
+            tokens.extend([token for token in tokenize(part) if token not in stopwords])
     # 对普通查询词进行词干化
     query_terms = [stemmer.stem(token) for token in tokens if token]
     # 对短语部分：仅进行词干化，不过滤停用词
     query_phrases = []
     for phrase in phrases:
-        phrase_tokens = re.findall(r'\w+', phrase.lower())
+        phrase_tokens = tokenize(phrase)
         if phrase_tokens:
             query_phrases.append([stemmer.stem(token) for token in phrase_tokens])
     return query_terms, query_phrases
@@ -139,114 +123,527 @@ def cosine_similarity(vec_doc, vec_query):
     for term, weight in vec_query.items():
         if term in vec_doc:
             dot += vec_doc[term] * weight
-    norm_doc = math.sqrt(sum(w**2 for w in vec_doc.values()))
+    norm_doc = math.sqrt(math.fsum(w**2 for w in vec_doc.values()))  # 与 indexer.document_statistics 相同，与词项顺序无关
     norm_query = math.sqrt(sum(w**2 for w in vec_query.values()))
     if norm_doc == 0 or norm_query == 0:
         return 0.0
     return dot / (norm_doc * norm_query)
 
-# 检查短语是否在文档向量中出现（简单判断所有词是否出现）
-def phrase_in_doc(phrase_tokens, doc_vector):
-    return all(token in doc_vector for token in phrase_tokens)
+# 检查短语的各个词是否在给定位置上连续出现
+def phrase_at_positions(phrase_tokens, positions, wildcards=frozenset()):
+    """
+    :param phrase_tokens: 短语的词干列表。
+    :param positions: {词干: 该词干在文档中的升序位置列表}。
+    :param wildcards: 停用词的词干集合。停用词不进入索引，只占一个位置，任何单词都可以匹配。
+    :return: 短语是否出现。
+    """
+    required = [(offset, token) for offset, token in enumerate(phrase_tokens) if token not in wildcards]
+    if not required or any(not positions.get(token) for _, token in required):
+        return False
+    # 从出现次数最少的词开始，检查其余各词是否出现在相应的偏移处
+    first_offset, first_token = min(required, key=lambda item: len(positions[item[1]]))
+    others = [(offset - first_offset, set(positions[token])) for offset, token in required if token != first_token or offset != first_offset]
+    for position in positions[first_token]:
+        if position < first_offset:
+            continue
+        if all(position + delta in token_positions for delta, token_positions in others):
+            return True
+    return False
 
-# 检查短语是否在文档标题中出现（从标题向量判断）
-def phrase_in_title(phrase_tokens, title_vector):
-    return all(token in title_vector for token in phrase_tokens)
+# 检查短语是否在文档正文中出现（根据正文倒排索引中的位置判断）
+def phrase_in_doc(phrase_tokens, doc_positions, wildcards=frozenset()):
+    return phrase_at_positions(phrase_tokens, doc_positions, wildcards)
 
-# 主检索函数：返回按相似度排序的最多 max_results 个文档（格式为 (url, score)）
-def retrieval(start_url, query, max_pages=300, max_results=50):
-    stemmer = PorterStemmer()
-    body_index = None
-    title_index = None
-    webpages, start_page = spider_read_database("webpages.db")
-    # 没有数据库或数据库无效，重新生成索引
-    if (not os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)), "body_inverted_index.db"))) or (not os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)), "title_inverted_index.db"))) or (not os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)), "webpages.db"))) or (datetime.now(timezone.utc) - datetime.fromtimestamp(os.path.getmtime(os.path.join(os.path.dirname(os.path.abspath(__file__)), "body_inverted_index.db")), tz=timezone.utc) > timedelta(days=1)) or (datetime.now(timezone.utc) - datetime.fromtimestamp(os.path.getmtime(os.path.join(os.path.dirname(os.path.abspath(__file__)), "title_inverted_index.db")), tz=timezone.utc) > timedelta(days=1)) or (not check_database("webpages.db", start_url, start_page)):
-        body_index, title_index = indexer(start_url, max_pages)
-    # 数据库有效，加载两个倒排索引
-    else:
-        body_index = read_database("body_inverted_index.db")
-        title_index = read_database("title_inverted_index.db")
-    # 构建正文与标题的文档向量
-    body_doc_vectors = build_doc_vectors(body_index)
-    title_doc_vectors = build_doc_vectors(title_index)
-    # 合并文档向量，标题部分加权提升
-    merged_doc_vectors = merge_doc_vectors(body_doc_vectors, title_doc_vectors, title_boost=2.0)
-    # 计算全库文档集合总数（取正文与标题并集）
-    all_docs = set(body_doc_vectors.keys()) | set(title_doc_vectors.keys())
-    total_docs = len(all_docs) if all_docs else 1
-
-    # 解析查询，得到普通词和短语（短语为词列表）
-    query_terms, query_phrases = parse_query(query, stemmer, load_stopwords("stopwords.txt"))
-    # 构造带有权重的计数器，普通词权重为 1
-    q_tf = Counter(query_terms)
-    # 对于短语中的每个词，如果在普通词里未出现，则加上权重 0.5
-    for phrase in query_phrases:
-        # 先移除停用词（注意：这里假设停用词是在解析 query_terms 时已去除）
-        phrase_tokens = [token for token in phrase if token not in q_tf]
-        for token in phrase_tokens:
-            q_tf[token] += 0.5
-
-    # 构造 df_dict（文档频率），inverted_indexes 为 [body_index, title_index]
-    df_dict = {}
-    for term in q_tf:
-        docs_with_term = set()
-        for idx in [body_index, title_index]:
-            if term in idx:
-                for p in idx[term]:
-                    docs_with_term.add(p["url"])
-        df_dict[term] = len(docs_with_term)
+# 检查短语是否在文档标题中出现（根据标题倒排索引中的位置判断）
+def phrase_in_title(phrase_tokens, title_positions, wildcards=frozenset()):
+    return phrase_at_positions(phrase_tokens, title_positions, wildcards)
+
+# 从倒排索引中取出短语各词的位置：{词干: {url: 位置列表}}
+def phrase_postings(phrase_tokens, inverted_index):
+    return {token: {p["url"]: p["positions"] for p in inverted_index.get(token, ())} for token in set(phrase_tokens)}
+
+# 短语出现在标题中时得分乘以的倍数
+TITLE_PHRASE_BOOST = 3.0
+# 短语只出现在正文中时得分乘以的倍数
+BODY_PHRASE_BOOST = 1.5
+# MaxScore 剪枝时得分上界的余量，抵消上界与得分计算顺序不同带来的浮点舍入误差
+SCORE_BOUND_SLACK = 1e-9
 
-    # 构造查询向量：权重为 tf * idf
+# 短语加权：短语在标题中出现时为 TITLE_PHRASE_BOOST，只在正文中出现时为 BODY_PHRASE_BOOST，否则为 1
+def phrase_boost(phrase_tokens, title_positions, body_positions, wildcards=frozenset()):
+    # 检查标题中匹配（利用标题倒排索引中的位置）
+    if phrase_in_title(phrase_tokens, title_positions, wildcards):
+        return TITLE_PHRASE_BOOST
+    # 否则检查正文匹配
+    if phrase_in_doc(phrase_tokens, body_positions, wildcards):
+        return BODY_PHRASE_BOOST
+    return 1.0
+
+# 在段文件上构造查询向量：权重为 tf * idf，文档频率为合并 posting 的个数（正文与标题的并集），并归一化。
+# 文档向量中的权重（按各字段最大的 tf-idf 归一化并加权标题）和文档向量的范数在建立索引时已经算出，
+# 计算顺序与 build_doc_vectors、merge_doc_vectors 和 cosine_similarity 相同，得分与读入整个倒排索引时一致。
+# 返回 (查询向量, 查询向量的范数, {词项: (文档编号, 权重)})
+def segment_query_vector(segment, q_tf):
+    postings = {term: segment.merged.postings(term) for term in q_tf}
+    total_docs = segment.indexed_docs or 1
     q_vector = {}
     for term, tf in q_tf.items():
-        idf = math.log(total_docs / (1 + df_dict.get(term, 0)))
-        q_vector[term] = tf * idf
-    # 对查询向量归一化
+        q_vector[term] = tf * math.log(total_docs / (1 + len(postings[term][0])))
     norm = math.sqrt(sum(w**2 for w in q_vector.values()))
     if norm > 0:
         for term in q_vector:
             q_vector[term] /= norm
+    norm_query = math.sqrt(sum(w**2 for w in q_vector.values()))
+    return q_vector, norm_query, postings
+
+# 在段文件上用逐词（term-at-a-time）的 MaxScore 求得分最高的 max_results 个文档，只访问查询词的合并 posting：
+# - 查询词按对相似度贡献的上界（|查询权重| × merged.max_scores / 查询向量范数）从大到小处理，累加器中为已处理的词的点积；
+# - 每处理一个词之前，由累加器得到第 max_results 名的得分下界，剩余词的上界之和不足以超过它时不再加入新的文档，
+#   只为已有文档查找剩余的词（累加器较少时二分查找）；累加器中已知部分加上剩余上界仍不足的文档被删除；
+# - 最后按近似相似度从高到低精确计算得分（点积按查询词顺序累加，与逐个文档计算时一致），结果保存在大小为
+#   max_results 的堆中，剩余文档的得分上界低于第 max_results 名时停止，短语和链接分数只对这些文档计算。
+# final_score(文档编号, 相似度) 返回混合链接分数和短语加权后的得分；score_bound(相似度) 和 score_floor(相似度)
+# 返回该相似度下得分的上界和下界（均单调不减，下界在得分可能不大于 0 时为 -inf）。
+# 返回按得分降序（得分相同时文档编号升序）排列的 [(文档编号, 得分), ...]，只包括得分大于 0 的文档
+def segment_top_k(segment, q_vector, norm_query, postings, max_results, final_score, score_bound, score_floor):
+    if norm_query == 0 or max_results <= 0:
+        return []
+    doc_norms = segment.doc_norms
+    merged = segment.merged
+    # 按查询词顺序排列的 (查询权重, 文档编号, 权重)；权重为 0 的查询词不改变点积
+    q_terms = [(weight,) + postings[term] for term, weight in q_vector.items() if weight and len(postings[term][0])]
+    # (上界, 查询权重, 文档编号, 权重)，按上界从大到小排列
+    terms = sorted(((abs(weight) * merged.max_scores[merged.find(term)] / norm_query, weight) + postings[term]
+                    for term, weight in q_vector.items() if weight and len(postings[term][0])), key=itemgetter(0), reverse=True)
+    # rest[i] 为 terms[i:] 的上界之和
+    rest = list(accumulate(term[0] for term in reversed(terms)))[::-1]
+
+    def similarity(doc_id, dot):
+        norm_doc = doc_norms[doc_id]
+        return 0.0 if norm_doc == 0 else dot / (norm_doc * norm_query)
+
+    accumulators = {}
+    closed = False
+    for i, (_, weight, doc_ids, doc_weights) in enumerate(terms):
+        # 已处理的词的相似度之和不超过 rest[0] - rest[i]，得分下界不可能超过剩余上界时不必计算第 max_results 名
+        if len(accumulators) >= max_results and score_bound(rest[i]) + SCORE_BOUND_SLACK < score_floor(rest[0] - 2 * rest[i]):
+            # 第 max_results 名的得分下界：已知部分减去剩余上界
+            threshold = heapq.nlargest(max_results, (score_floor(similarity(doc_id, dot) - rest[i]) for doc_id, dot in accumulators.items()))[-1]
+            # 新的文档的相似度不超过 rest[i]
+            closed = closed or score_bound(rest[i]) + SCORE_BOUND_SLACK < threshold
+            if closed:
+                accumulators = {doc_id: dot for doc_id, dot in accumulators.items()
+                                if score_bound(similarity(doc_id, dot) + rest[i]) + SCORE_BOUND_SLACK >= threshold}
+        if not closed:
+            for doc_id, doc_weight in zip(doc_ids, doc_weights):
+                accumulators[doc_id] = accumulators.get(doc_id, 0.0) + doc_weight * weight
+        elif len(accumulators) * len(doc_ids).bit_length() < len(doc_ids):
+            for doc_id in accumulators:
+                j = bisect_left(doc_ids, doc_id)
+                if j < len(doc_ids) and doc_ids[j] == doc_id:
+                    accumulators[doc_id] += doc_weights[j] * weight
+        else:
+            for doc_id, doc_weight in zip(doc_ids, doc_weights):
+                if doc_id in accumulators:
+                    accumulators[doc_id] += doc_weight * weight
+
+    heap = []  # (得分, -文档编号) 的小顶堆
+    # 按 点积 / 文档向量范数 排序，与按相似度排序相同
+    candidates = sorted((-dot / doc_norms[doc_id] if doc_norms[doc_id] else 0.0, doc_id) for doc_id, dot in accumulators.items())
+    for negative_sim, doc_id in candidates:
+        if score_bound(-negative_sim / norm_query) + SCORE_BOUND_SLACK < (heap[0][0] if len(heap) == max_results else 0.0):
+            break
+        # 按查询词顺序精确计算点积
+        dot = 0.0
+        for weight, doc_ids, doc_weights in q_terms:
+            j = bisect_left(doc_ids, doc_id)
+            if j < len(doc_ids) and doc_ids[j] == doc_id:
+                dot += doc_weights[j] * weight
+        score = final_score(doc_id, similarity(doc_id, dot))
+        if score > 0:
+            if len(heap) < max_results:
+                heapq.heappush(heap, (score, -doc_id))
+            elif (score, -doc_id) > heap[0]:
+                heapq.heapreplace(heap, (score, -doc_id))
+    return [(-negative_doc_id, score) for score, negative_doc_id in sorted(heap, reverse=True)]
+
+# 从段文件的一个字段中取出短语各词的 posting：{词干: (文档编号, 每个文档的位置在 positions 中的起始下标, 位置)}
+def segment_phrase_postings(phrase_tokens, field):
+    result = {}
+    for token in set(phrase_tokens):
+        doc_ids, tfs, positions = field.postings(token)
+        result[token] = (doc_ids, list(accumulate(tfs, initial=0)), positions)
+    return result
+
+# 一个文档中短语各词的位置：{词干: 位置列表}，文档中没有该词时为 None
+def segment_doc_positions(phrase_postings, doc_id):
+    result = {}
+    for token, (doc_ids, offsets, positions) in phrase_postings.items():
+        i = bisect_left(doc_ids, doc_id)
+        result[token] = positions[offsets[i]:offsets[i + 1]].tolist() if i < len(doc_ids) and doc_ids[i] == doc_id else None
+    return result
+
+# 段文件中一个文档的短语加权：phrases 为 [(短语, 标题中的 posting, 正文中的 posting), ...]（见 segment_phrase_postings），
+# 各短语的加权相乘
+def segment_phrase_boost(phrases, doc_id, wildcards=frozenset()):
+    boost = 1.0
+    for phrase_tokens, title_postings, body_postings in phrases:
+        boost *= phrase_boost(phrase_tokens, segment_doc_positions(title_postings, doc_id),
+                              segment_doc_positions(body_postings, doc_id), wildcards)
+    return boost
+
+# searcher 监视的文件，其中任何一个被替换、修改或删除时重新加载
+WATCHED_FILES = ("webpages.db", "body_inverted_index.db", "title_inverted_index.db", LINK_SCORES_FILE, SEGMENT_FILE)
+# 重新加载时必须已经存在的倒排索引数据库
+INDEX_FILES = ("body_inverted_index.db", "title_inverted_index.db")
+# searcher 两次检查文件是否改变之间的最短间隔（秒）
+RELOAD_CHECK_INTERVAL = 1.0
+
+def file_stamps(files):
+    """返回各文件的 (inode, 修改时间, 大小)，文件不存在时为 None。原子替换和原地修改都会改变该值。"""
+    stamps = []
+    for database_file in files:
+        try:
+            stat = os.stat(database_path(database_file))
+            stamps.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            stamps.append(None)
+    return tuple(stamps)
+
+def index_expired(database_file):
+    """倒排索引数据库不存在或已超过一天未更新。"""
+    db_path = database_path(database_file)
+    return (not os.path.exists(db_path)) or datetime.now(timezone.utc) - datetime.fromtimestamp(os.path.getmtime(db_path), tz=timezone.utc) > timedelta(days=1)
+
+# 一代索引
+class index_generation:
+    """
+    searcher 在一次加载中打开的索引、网页存储和链接分数。加载后不再修改（只缓存按需计算的结果），
+    检索时先取得当前的一代再使用，重新加载时整体替换，正在进行的检索继续使用旧的一代；
+    旧的一代（包括映射的段文件和数据库连接）在不再被引用后释放，已返回的网页仍可以读取延迟字段。
+    """
+
+    def __init__(self, stamps, store, segment=None, body_index=None, title_index=None):
+        self.stamps = stamps
+        self.store = store
+        self.segment = segment
+        self.body_index = body_index
+        self.title_index = title_index
+        self.doc_vectors = None
+        self.link_scores = {}
+        self.scorer = None
+        self.link_vectors = {}
+
+    def merged_doc_vectors(self):
+        """没有段文件时使用：(正文文档向量, 标题文档向量, 合并后的文档向量, 文档总数)，第一次使用时计算。"""
+        if self.doc_vectors is None:
+            # 构建正文与标题的文档向量
+            body_doc_vectors = build_doc_vectors(self.body_index)
+            title_doc_vectors = build_doc_vectors(self.title_index)
+            # 合并文档向量，标题部分加权提升
+            merged_doc_vectors = merge_doc_vectors(body_doc_vectors, title_doc_vectors, title_boost=TITLE_BOOST)
+            # 计算全库文档集合总数（取正文与标题并集）
+            all_docs = set(body_doc_vectors.keys()) | set(title_doc_vectors.keys())
+            self.doc_vectors = (body_doc_vectors, title_doc_vectors, merged_doc_vectors, len(all_docs) if all_docs else 1)
+        return self.doc_vectors
 
-    # 计算每个文档的初始相似度得分（余弦相似度）
-    scores = {}
-    for url, doc_vector in merged_doc_vectors.items():
-        sim = cosine_similarity(doc_vector, q_vector)
-        scores[url] = sim
-
-    # 对于短语查询，检查短语是否出现在文档中，并额外提升得分
-    # 如果短语在标题中出现，乘以 2；若仅在正文中出现，乘以 1.5
-    for phrase_tokens in query_phrases:
-        for url in scores:
-            boost = 1.0
-            # 检查标题中匹配（利用 title_doc_vectors 中的信息）
-            if url in title_doc_vectors and phrase_in_title(phrase_tokens, title_doc_vectors[url]):
-                boost = 3.0
-            # 否则检查正文匹配
-            elif url in body_doc_vectors and phrase_in_doc(phrase_tokens, body_doc_vectors[url]):
-                boost = 1.5
-            scores[url] *= boost
-
-    # 排序并截取前 max_results 条文档（如果结果数量少于 max_results，则返回全部）
-    ranked = sorted([(url, score) for url, score in scores.items() if score > 0], key=lambda x: x[1], reverse=True)
-    results = ranked[:max_results]
-
-    # 构造一个从 url 到 webpage 对象的字典（如果 webpages 为 None，则字典为空）
-    webpage_dict = { page.url: page for page in webpages } if webpages else {}
-
-    final_results = []
-    for url, score in results:
-        page_obj = webpage_dict.get(url)
-        if page_obj is None:
-            # 调用 spider 函数爬取，start_url 设为当前 url，max_pages 为 1，bool_save_to_database 为 False
-            new_pages = spider(url, 1, False)
-            if new_pages:
-                for p in new_pages:
-                    if p.url == url:
-                        page_obj = p
-                        break
-        # 如果仍然未找到，则将 url 原样返回（一般不会发生）
-        if page_obj is None:
-            page_obj = url
-        final_results.append((page_obj, score))
-
-    return final_results
\ No newline at end of file
+    def read_link_scores(self, link_score):
+        """一种链接分数（见 link_analysis.read_link_scores），第一次使用时读取。"""
+        if link_score not in self.link_scores:
+            self.link_scores[link_score] = read_link_scores(LINK_SCORES_FILE, link_score)
+        return self.link_scores[link_score]
+
+    def sparse_scorer(self):
+        """有段文件时使用：段文件的 sparse_scorer，第一次使用时构造。"""
+        if self.scorer is None:
+            self.scorer = sparse_scorer(self.segment)
+        return self.scorer
+
+    def link_vector(self, link_score):
+        """有段文件时使用：按段文件中的文档编号排列的链接分数数组，第一次使用时构造。"""
+        if link_score not in self.link_vectors:
+            link_scores = self.read_link_scores(link_score)
+            self.link_vectors[link_score] = np.array([link_scores.get(self.segment.url(doc_id), 0.0) for doc_id in range(self.segment.doc_count)])
+        return self.link_vectors[link_score]
+
+# 常驻的检索器
+class searcher:
+    """
+    加载一次索引后反复检索：停用词、词干化器、网页存储、段文件（或读入的倒排索引）和链接分数在加载时准备好，
+    每次检索只做与查询有关的工作。检索时至多每 check_interval 秒检查一次 WATCHED_FILES，
+    文件发生变化（例如另一个进程重新建立了索引）时重新加载并原子地切换到新的一代。
+    索引的有效性（数据库过期、起始网页已更新）只在创建时检查，需要时由 indexer 重新建立；
+    重新加载只打开已经存在的文件，不发送请求也不重新建立索引，文件不完整时继续使用当前的一代。
+    可以在多个线程中同时检索。
+    """
+
+    def __init__(self, start_url, max_pages=300, use_segment=True, check_interval=RELOAD_CHECK_INTERVAL, use_sparse=False):
+        """
+        :param start_url: 起始 URL。
+        :param max_pages: 最大爬取页面数。
+        :param use_segment: 有段文件时是否用 mmap 打开段文件检索；为 False 时读入整个 SQLite 倒排索引。
+        :param check_interval: 两次检查文件是否改变之间的最短间隔（秒），为 0 时每次检索都检查。
+        :param use_sparse: 使用段文件时是否用 SciPy 稀疏矩阵计算得分（见 sparse_scoring）；为 False 时用 MaxScore 逐词累加。
+        """
+        self.start_url = start_url
+        self.max_pages = max_pages
+        self.use_segment = use_segment
+        self.check_interval = check_interval
+        self.use_sparse = use_sparse
+        self.stemmer = STEMMER
+        self.stopwords = load_stopwords("stopwords.txt")
+        # 短语中的停用词在匹配时作为占位符
+        self.stopword_stems = {self.stemmer.stem(word) for word in self.stopwords}
+        self.lock = threading.Lock()
+        self.generation = self.load()
+        self.checked = time.monotonic()
+
+    def load(self, regenerate=True):
+        """
+        加载新的一代索引。
+        :param regenerate: 数据库不存在或无效时是否先重新生成（爬取并建立索引）。重新加载时为 False：
+                           在检索请求中只打开已经存在的文件，重新生成由建立索引的进程负责。
+        :return: index_generation；regenerate 为 False 且文件不存在或不是当前格式时返回 None。
+        """
+        # 只读取起始网页，其余网页在得到检索结果后按 URL 读取
+        store = open_page_store("webpages.db")
+        start_page = store.start_page() if store else None
+        if not regenerate and (start_page is None or not all(os.path.exists(database_path(database_file)) for database_file in INDEX_FILES)):
+            if store:
+                store.close()
+            return None
+        # 没有数据库或数据库无效（包括没有起始网页），重新生成索引
+        if regenerate and (index_expired("body_inverted_index.db") or index_expired("title_inverted_index.db") or start_page is None
+                           or not check_database("webpages.db", self.start_url, start_page)):
+            if store:
+                store.close()
+            indexer(self.start_url, self.max_pages)
+            store = open_page_store("webpages.db")
+        # 在打开文件之前记录文件状态，打开之后才发生的变化会在下一次检查时发现
+        stamps = file_stamps(WATCHED_FILES)
+        # 有段文件时用 mmap 打开，不读入倒排索引；否则加载两个倒排索引，索引为旧格式时重新生成
+        segment = open_segment() if self.use_segment else None
+        if segment is not None:
+            return index_generation(stamps, store, segment=segment)
+        body_index = read_index("body_inverted_index.db")
+        title_index = read_index("title_inverted_index.db")
+        if body_index is None or title_index is None:
+            if store:
+                store.close()
+            if not regenerate:
+                return None
+            body_index, title_index = indexer(self.start_url, self.max_pages)
+            stamps = file_stamps(WATCHED_FILES)
+            store = open_page_store("webpages.db")
+        return index_generation(stamps, store, body_index=body_index, title_index=title_index)
+
+    def reload_if_changed(self):
+        """
+        文件发生变化时重新加载已经存在的文件（见 load）。同一时刻只有一个线程检查和加载，其他线程继续使用当前的一代。
+        :return: 是否切换到了新的一代。
+        """
+        if time.monotonic() - self.checked < self.check_interval or not self.lock.acquire(blocking=False):
+            return False
+        try:
+            self.checked = time.monotonic()
+            if file_stamps(WATCHED_FILES) == self.generation.stamps:
+                return False
+            generation = self.load(regenerate=False)
+            if generation is None:
+                # 文件正在重新生成或不完整，下一次检查时再加载
+                return False
+            self.generation = generation
+            return True
+        finally:
+            self.lock.release()
+
+    def query_weights(self, query):
+        """
+        解析查询。
+        :param query: 查询字符串，双引号中的部分为短语。
+        :return: ({词干: 查询词频}, 短语列表)，短语为词干列表。
+        """
+        # 解析查询，得到普通词和短语（短语为词列表）
+        query_terms, query_phrases = parse_query(query, self.stemmer, self.stopwords)
+        # 构造带有权重的计数器，普通词权重为 1
+        q_tf = Counter(query_terms)
+        # 对于短语中的每个词，如果在普通词里未出现，则加上权重 0.5
+        for phrase in query_phrases:
+            # 先移除停用词（注意：这里假设停用词是在解析 query_terms 时已去除）
+            phrase_tokens = [token for token in phrase if token not in q_tf]
+            for token in phrase_tokens:
+                q_tf[token] += 0.5
+        return q_tf, query_phrases
+
+    def rank_sparse(self, generation, queries, max_results, link_weight, link_score):
+        """
+        在段文件上用稀疏矩阵计算一批查询的得分：余弦相似度由一次矩阵乘法算出，链接分数按文档编号向量化地混合；
+        短语加权不小于 1，只为加权前的得分乘以最大加权后不低于第 max_results 名的文档检查短语。
+        :param generation: 有段文件的 index_generation。
+        :param queries: query_weights 的返回值的序列。
+        :return: 每个查询的按得分降序（得分相同时文档编号升序）排列的 [(url, 得分), ...]。
+        """
+        segment = generation.segment
+        scorer = generation.sparse_scorer()
+        similarities = scorer.similarities(scorer.query_matrix([q_tf for q_tf, _ in queries]))
+        link_vector = generation.link_vector(link_score) if link_weight > 0 else None
+        results = []
+        for (_, query_phrases), start, end in zip(queries, similarities.indptr[:-1], similarities.indptr[1:]):
+            doc_ids, scores = similarities.indices[start:end], similarities.data[start:end]
+            # 只有相似度大于 0 的文档可能出现在结果中
+            relevant = scores > 0
+            doc_ids, scores = doc_ids[relevant], scores[relevant]
+            # 混合链接分数
+            if link_weight > 0:
+                scores = (1 - link_weight) * scores + link_weight * link_vector[doc_ids]
+            # 对于短语查询，检查短语是否出现在文档中，并额外提升得分
+            if query_phrases and len(scores):
+                if len(scores) > max_results > 0:
+                    kth = scores[np.argpartition(-scores, max_results - 1)[max_results - 1]]
+                    candidates = scores * TITLE_PHRASE_BOOST ** len(query_phrases) + SCORE_BOUND_SLACK >= kth
+                    doc_ids, scores = doc_ids[candidates], scores[candidates]
+                phrases = [(phrase_tokens, segment_phrase_postings(phrase_tokens, segment.fields["title"]),
+                            segment_phrase_postings(phrase_tokens, segment.fields["body"])) for phrase_tokens in query_phrases]
+                scores = scores * np.array([segment_phrase_boost(phrases, doc_id, self.stopword_stems) for doc_id in doc_ids.tolist()])
+            results.append([(segment.url(doc_id), score) for doc_id, score in top_k_scores(doc_ids, scores, max_results)])
+        return results
+
+    def search_many(self, queries, max_results=50, link_weight=0.0, link_score="pagerank"):
+        """
+        批量检索，用于离线评估大量查询：有段文件时所有查询的余弦相似度由一次稀疏矩阵乘法算出（见 rank_sparse），
+        不读取网页。没有段文件时逐个调用 search。
+        :param queries: 查询字符串的序列。
+        :return: 每个查询的按得分降序排列的 [(url, 得分), ...]。
+        """
+        self.reload_if_changed()
+        generation = self.generation
+        if generation.segment is None:
+            return [[(page.url if isinstance(page, webpage) else page, score) for page, score in self.search(query, max_results, link_weight, link_score)]
+                    for query in queries]
+        return self.rank_sparse(generation, [self.query_weights(query) for query in queries], max_results, link_weight, link_score)
+
+    def search(self, query, max_results=50, link_weight=0.0, link_score="pagerank"):
+        """
+        检索。
+        :param query: 查询字符串，双引号中的部分为短语。
+        :param max_results: 最多返回的结果数。
+        :param link_weight: 大于 0 时按 (1 - link_weight) * 余弦相似度 + link_weight * 链接分数 混合链接分数。
+        :param link_score: "pagerank"、"authority" 或 "hub"。
+        :return: 按得分降序排列的 [(webpage, 得分), ...]。
+        """
+        self.reload_if_changed()
+        generation = self.generation
+        stopword_stems = self.stopword_stems
+        segment = generation.segment
+        store = generation.store
+
+        q_tf, query_phrases = self.query_weights(query)
+
+        if segment is not None and self.use_sparse:
+            results = self.rank_sparse(generation, [(q_tf, query_phrases)], max_results, link_weight, link_score)[0]
+        elif segment is not None:
+            q_vector, norm_query, postings = segment_query_vector(segment, q_tf)
+            link_scores = generation.read_link_scores(link_score) if link_weight > 0 else {}
+            phrases = [(phrase_tokens, segment_phrase_postings(phrase_tokens, segment.fields["title"]),
+                        segment_phrase_postings(phrase_tokens, segment.fields["body"])) for phrase_tokens in query_phrases]
+
+            def final_score(doc_id, sim):
+                # 混合链接分数，只改变与查询相关（相似度大于 0）的文档的得分
+                score = sim
+                if link_weight > 0 and sim > 0:
+                    score = (1 - link_weight) * sim + link_weight * link_scores.get(segment.url(doc_id), 0.0)
+                # 对于短语查询，检查短语是否出现在文档中，并额外提升得分
+                return score * segment_phrase_boost(phrases, doc_id, stopword_stems) if phrases else score
+
+            def score_bound(sim):
+                # 链接分数归一化到 [0, 1]，每个短语至多乘以 TITLE_PHRASE_BOOST
+                if link_weight > 0 and sim > 0:
+                    sim = max((1 - link_weight) * sim, (1 - link_weight) * sim + link_weight)
+                return max(sim, sim * TITLE_PHRASE_BOOST ** len(query_phrases))
+
+            def score_floor(sim):
+                # 得分可能不大于 0 的文档不会出现在结果中；短语加权不小于 1，链接分数不小于 0
+                if sim <= 0:
+                    return -math.inf
+                return (1 - link_weight) * sim if link_weight > 0 else sim
+
+            results = [(segment.url(doc_id), score)
+                       for doc_id, score in segment_top_k(segment, q_vector, norm_query, postings, max_results, final_score, score_bound, score_floor)]
+        else:
+            body_index, title_index = generation.body_index, generation.title_index
+            # 文档向量只在每一代第一次检索时构建
+            body_doc_vectors, title_doc_vectors, merged_doc_vectors, total_docs = generation.merged_doc_vectors()
+
+            # 构造 df_dict（文档频率），inverted_indexes 为 [body_index, title_index]
+            df_dict = {}
+            for term in q_tf:
+                docs_with_term = set()
+                for idx in [body_index, title_index]:
+                    if term in idx:
+                        for p in idx[term]:
+                            docs_with_term.add(p["url"])
+                df_dict[term] = len(docs_with_term)
+
+            # 构造查询向量：权重为 tf * idf
+            q_vector = {}
+            for term, tf in q_tf.items():
+                idf = math.log(total_docs / (1 + df_dict.get(term, 0)))
+                q_vector[term] = tf * idf
+            # 对查询向量归一化
+            norm = math.sqrt(sum(w**2 for w in q_vector.values()))
+            if norm > 0:
+                for term in q_vector:
+                    q_vector[term] /= norm
+
+            # 计算每个文档的初始相似度得分（余弦相似度）
+            scores = {}
+            for url, doc_vector in merged_doc_vectors.items():
+                sim = cosine_similarity(doc_vector, q_vector)
+                scores[url] = sim
+
+            # 混合链接分数，只改变与查询相关（相似度大于 0）的文档的得分
+            if link_weight > 0:
+                link_scores = generation.read_link_scores(link_score)
+                for url, sim in scores.items():
+                    if sim > 0:
+                        scores[url] = (1 - link_weight) * sim + link_weight * link_scores.get(url, 0.0)
+
+            # 对于短语查询，检查短语是否出现在文档中，并额外提升得分
+            for phrase_tokens in query_phrases:
+                title_postings = phrase_postings(phrase_tokens, title_index)
+                body_postings = phrase_postings(phrase_tokens, body_index)
+                for url in scores:
+                    scores[url] *= phrase_boost(phrase_tokens, {token: by_url.get(url) for token, by_url in title_postings.items()},
+                                                {token: by_url.get(url) for token, by_url in body_postings.items()}, stopword_stems)
+
+            # 用大小为 max_results 的堆取出得分最高的文档（与排序后截取相同）
+            results = heapq.nlargest(max_results, ((url, score) for url, score in scores.items() if score > 0), key=lambda x: x[1])
+
+        # 只读取结果中的网页，构造从 url 到 webpage 对象的字典（如果没有 webpages.db，则字典为空）。
+        # 网页的链接和关键词在访问时才从 store 读取
+        webpage_dict = store.get_many(url for url, _ in results) if store else {}
+
+        final_results = []
+        for url, score in results:
+            page_obj = webpage_dict.get(url)
+            if page_obj is None:
+                # 调用 spider 函数爬取，start_url 设为当前 url，max_pages 为 1，bool_save_to_database 为 False
+                new_pages = spider(url, 1, False)
+                if new_pages:
+                    for p in new_pages:
+                        if p.url == url:
+                            page_obj = p
+                            break
+            # 如果仍然未找到，则将 url 原样返回（一般不会发生）
+            if page_obj is None:
+                page_obj = url
+            final_results.append((page_obj, score))
+
+        return final_results
+
+# 主检索函数：返回按相似度排序的最多 max_results 个文档（格式为 (url, score)）
+# link_weight 大于 0 时，将建立索引时计算的链接分数（link_score 为 "pagerank"、"authority" 或 "hub"，归一化到 [0, 1]）
+# 按 (1 - link_weight) * 余弦相似度 + link_weight * 链接分数 混合到与查询相关的文档的得分中。
+# use_sparse 为 True 时在段文件上用 SciPy 稀疏矩阵计算得分。每次调用都重新加载索引；需要反复检索时使用 searcher
+def retrieval(start_url, query, max_pages=300, max_results=50, link_weight=0.0, link_score="pagerank", use_segment=True, use_sparse=False):
+    return searcher(start_url, max_pages, use_segment, use_sparse=use_sparse).search(query, max_results, link_weight, link_score)
@@ -0,0 +1,340 @@
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from spider import database_path
+
+# 不可变的索引段文件：indexer 在写入 SQLite 倒排索引的同时写出，检索时用 mmap 打开，
+# 词典和 posting 数组直接在映射的页面上访问，不需要读入和解码整个索引。
+# 打开段文件的耗时与索引大小无关；多个进程打开同一个段文件时共享操作系统的页面缓存。
+#
+# 文件结构（小端序）：
+# - 文件头：MAGIC、版本号和数组个数；
+# - 目录：每个数组一项，包括名称、array 类型码、起始偏移和元素个数；
+# - 数组：每个数组从 8 字节对齐的偏移开始。
+# 数组包括：
+# - meta：[网页总数 N, 至少有一个正文或标题词项的文档数]；
+# - doc_url_offsets / doc_urls：文档编号到 URL（UTF-8）的映射；
+# - doc_norms：合并正文和标题（标题加权）后的文档向量的 L2 范数；
+# - 每个字段（body、title）：
+#   - <字段>.term_offsets / <字段>.terms：按 UTF-8 字节序排列的词项；
+#   - <字段>.posting_offsets：每个词项在 doc_ids 和 tfs 中的起始下标，<字段>.position_offsets：在 positions 中的起始下标；
+#   - <字段>.doc_ids / <字段>.tfs / <字段>.positions：按文档编号升序排列的 posting；
+#   - <字段>.max_weights：每个文档在该字段中最大的 tf-idf，用于归一化文档向量；
+# - merged：合并正文和标题后的文档向量按词项转置得到的 posting，词项为两个字段词典的并集：
+#   - merged.term_offsets / merged.terms / merged.posting_offsets：与字段相同；
+#   - merged.doc_ids / merged.weights：按文档编号升序排列的文档编号和该词项在文档向量中的权重
+#     （tf-idf 除以该文档在字段中最大的 tf-idf，标题部分乘以标题权重后与正文部分相加），
+#     posting 个数即正文与标题并集的文档频率。检索时只需读取查询词的 merged posting；
+#   - merged.max_scores：每个词项的 |权重| / 文档向量范数 在所有文档中的最大值，
+#     即该词项对余弦相似度的贡献的上界（乘以查询向量中的权重后），用于 MaxScore 剪枝。
+# 段文件写入临时文件后原子地替换，已经打开的旧段文件不受影响。
+
+SEGMENT_FILE = "inverted_index.seg"
+MAGIC = b"SPIDXSEG"
+VERSION = 3
+# 文件头：MAGIC、版本号、数组个数
+HEADER = struct.Struct("<8sII")
+# 目录项：名称、类型码、起始偏移、元素个数
+ENTRY = struct.Struct("<32s1sQQ")
+# 段文件中的字段
+FIELDS = ("body", "title")
+# 合并正文和标题后的文档向量的 posting 在段文件中的名称
+MERGED = "merged"
+
+def padding(offset):
+    """返回将 offset 对齐到 8 字节需要填充的字节数。"""
+    return -offset % 8
+
+def field_arrays(field):
+    """一个字段在段文件中的数组：[(名称, 类型码), ...]。"""
+    return [(f"{field}.term_offsets", "Q"), (f"{field}.terms", "B"), (f"{field}.posting_offsets", "Q"), (f"{field}.position_offsets", "Q"),
+            (f"{field}.doc_ids", "I"), (f"{field}.tfs", "I"), (f"{field}.positions", "I"), (f"{field}.max_weights", "d")]
+
+# 段文件中的全部数组，按在文件中的顺序排列
+ARRAYS = ([("meta", "Q"), ("doc_url_offsets", "Q"), ("doc_urls", "B"), ("doc_norms", "d")] + [array for field in FIELDS for array in field_arrays(field)]
+          + [(f"{MERGED}.term_offsets", "Q"), (f"{MERGED}.terms", "B"), (f"{MERGED}.posting_offsets", "Q"), (f"{MERGED}.doc_ids", "I"), (f"{MERGED}.weights", "d"),
+             (f"{MERGED}.max_scores", "d")])
+
+# segment_writer 中每个数组写入临时文件之前缓冲的元素个数
+WRITE_BUFFER_ITEMS = 1 << 16
+
+# 流式写出段文件
+class segment_writer:
+    """
+    按数组分别追加数据，每个数组经过缓冲写入各自的临时文件，commit 时计算偏移并按 ARRAYS 的顺序连接为段文件，
+    写出整个段文件时不需要将所有数组同时放在内存中，各数组也可以按任意顺序交替追加。
+    可以用作上下文管理器，异常退出时丢弃已写入的数据。
+    """
+
+    def __init__(self, segment_file, arrays=ARRAYS):
+        """
+        :param segment_file: 段文件名，相对路径相对于 spider.DATA_DIR。
+        :param arrays: [(名称, 类型码), ...]。
+        """
+        self.path = database_path(segment_file)
+        self.typecodes = dict(arrays)
+        self.lengths = {name: 0 for name, _ in arrays}
+        self.buffers = {name: array(typecode) for name, typecode in arrays}
+        self.files = {name: tempfile.TemporaryFile() for name, _ in arrays}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.commit()
+        self.close()
+
+    def append(self, name, values):
+        """在数组 name 的末尾追加 values（整数或浮点数的可迭代对象，类型码为 B 时也可以是 bytes）。"""
+        buffer = self.buffers[name]
+        if isinstance(values, bytes):
+            buffer.frombytes(values)
+        elif isinstance(values, array) and values.typecode != buffer.typecode:
+            # array.extend 只接受类型码相同的 array
+            buffer.extend(iter(values))
+        else:
+            buffer.extend(values)
+        if len(buffer) >= WRITE_BUFFER_ITEMS:
+            self.flush(name)
+
+    def flush(self, name):
+        """将数组 name 缓冲的数据写入临时文件。"""
+        buffer = self.buffers[name]
+        if sys.byteorder == "big":
+            buffer.byteswap()
+        buffer.tofile(self.files[name])
+        self.lengths[name] += len(buffer)
+        self.buffers[name] = array(self.typecodes[name])
+
+    def commit(self):
+        """写出段文件：写入临时文件后原子地替换。"""
+        for name in self.files:
+            self.flush(name)
+        offset = HEADER.size + ENTRY.size * len(self.files)
+        entries = []
+        for name in self.files:
+            offset += padding(offset)
+            entries.append((name, offset))
+            offset += self.lengths[name] * array(self.typecodes[name]).itemsize
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(HEADER.pack(MAGIC, VERSION, len(entries)))
+            for name, offset in entries:
+                file.write(ENTRY.pack(name.encode("ascii"), self.typecodes[name].encode("ascii"), offset, self.lengths[name]))
+            for name, offset in entries:
+                file.write(b"\0" * (offset - file.tell()))
+                self.files[name].seek(0)
+                shutil.copyfileobj(self.files[name], file)
+        os.replace(temporary_path, self.path)
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+
+def max_score(postings, doc_norms):
+    """词项的 |权重| / 文档向量范数 的最大值，范数为 0 的文档的相似度为 0，不计入。"""
+    return max((abs(weight) / doc_norms[doc_id] for doc_id, weight in postings if doc_norms[doc_id]), default=0.0)
+
+def write_segment(segment_file, urls, fields, doc_norms, max_weights, indexed_docs, merged):
+    """
+    写出段文件。
+    :param segment_file: 段文件名，相对路径相对于 spider.DATA_DIR。
+    :param urls: 全部文档的 URL 列表，下标为文档编号。
+    :param fields: {字段名: 倒排索引}，倒排索引的格式为 {term: [{"url": url, "tf": tf, "positions": [position, ...]}, ...]}。
+    :param doc_norms: 每个文档的向量范数，下标为文档编号。
+    :param max_weights: {字段名: 每个文档在该字段中最大的 tf-idf 的列表}。
+    :param indexed_docs: 至少有一个正文或标题词项的文档数。
+    :param merged: 合并后的文档向量按词项转置的 {term: [(文档编号, 权重), ...]}。
+    """
+    doc_ids = {url: doc_id for doc_id, url in enumerate(urls)}
+    with segment_writer(segment_file) as writer:
+        writer.append("meta", [len(urls), indexed_docs])
+        encoded_urls = [url.encode("utf-8") for url in urls]
+        writer.append("doc_url_offsets", accumulate(map(len, encoded_urls), initial=0))
+        writer.append("doc_urls", b"".join(encoded_urls))
+        writer.append("doc_norms", doc_norms)
+        for field, inverted_index in fields.items():
+            terms = sorted((term.encode("utf-8"), term) for term in inverted_index)
+            term_offsets, posting_offsets, position_offsets = array("Q", [0]), array("Q", [0]), array("Q", [0])
+            field_doc_ids, tfs, positions = array("I"), array("I"), array("I")
+            for encoded, term in terms:
+                for posting in sorted(inverted_index[term], key=lambda posting: doc_ids[posting["url"]]):
+                    field_doc_ids.append(doc_ids[posting["url"]])
+                    tfs.append(posting["tf"])
+                    positions.extend(posting["positions"])
+                term_offsets.append(term_offsets[-1] + len(encoded))
+                posting_offsets.append(len(field_doc_ids))
+                position_offsets.append(len(positions))
+            writer.append(f"{field}.term_offsets", term_offsets)
+            writer.append(f"{field}.terms", b"".join(encoded for encoded, _ in terms))
+            writer.append(f"{field}.posting_offsets", posting_offsets)
+            writer.append(f"{field}.position_offsets", position_offsets)
+            writer.append(f"{field}.doc_ids", field_doc_ids)
+            writer.append(f"{field}.tfs", tfs)
+            writer.append(f"{field}.positions", positions)
+            writer.append(f"{field}.max_weights", max_weights[field])
+        terms = sorted((term.encode("utf-8"), term) for term in merged)
+        term_offsets, posting_offsets = array("Q", [0]), array("Q", [0])
+        for encoded, term in terms:
+            postings = sorted(merged[term])
+            writer.append(f"{MERGED}.doc_ids", [doc_id for doc_id, _ in postings])
+            writer.append(f"{MERGED}.weights", [weight for _, weight in postings])
+            writer.append(f"{MERGED}.max_scores", [max_score(postings, doc_norms)])
+            term_offsets.append(term_offsets[-1] + len(encoded))
+            posting_offsets.append(posting_offsets[-1] + len(postings))
+        writer.append(f"{MERGED}.term_offsets", term_offsets)
+        writer.append(f"{MERGED}.terms", b"".join(encoded for encoded, _ in terms))
+        writer.append(f"{MERGED}.posting_offsets", posting_offsets)
+
+# 段文件中的词典
+class segment_terms:
+    """通过 index_segment 的映射访问按 UTF-8 字节序排列的词典，返回的数组均为 mmap 上的 memoryview，不复制数据。"""
+
+    def __init__(self, segment, name):
+        self.term_offsets = segment.array(f"{name}.term_offsets")
+        self.terms = segment.array(f"{name}.terms")
+        self.posting_offsets = segment.array(f"{name}.posting_offsets")
+        self.doc_ids = segment.array(f"{name}.doc_ids")
+        self.term_count = len(self.term_offsets) - 1
+
+    def __len__(self):
+        return self.term_count
+
+    def __getitem__(self, i):
+        """第 i 个词项的 UTF-8 字节串。"""
+        return self.terms[self.term_offsets[i]:self.term_offsets[i + 1]].tobytes()
+
+    def find(self, term):
+        """二分查找词项，返回其下标，不存在时返回 None。"""
+        encoded = term.encode("utf-8")
+        i = bisect_left(self, encoded)
+        return i if i < self.term_count and self[i] == encoded else None
+
+    def df(self, term):
+        """词项的文档频率。"""
+        i = self.find(term)
+        return 0 if i is None else self.posting_offsets[i + 1] - self.posting_offsets[i]
+
+# 段文件中的一个字段
+class segment_field(segment_terms):
+    """一个字段的词典和 posting（文档编号、词频和位置）。"""
+
+    def __init__(self, segment, field):
+        super().__init__(segment, field)
+        self.position_offsets = segment.array(f"{field}.position_offsets")
+        self.tfs = segment.array(f"{field}.tfs")
+        self.positions = segment.array(f"{field}.positions")
+        self.max_weights = segment.array(f"{field}.max_weights")
+
+    def postings(self, term):
+        """
+        :return: (文档编号, 词频, 依次连接的位置)，均为 memoryview；词项不存在时为空。
+        """
+        i = self.find(term)
+        if i is None:
+            return self.doc_ids[0:0], self.tfs[0:0], self.positions[0:0]
+        start, end = self.posting_offsets[i], self.posting_offsets[i + 1]
+        return (self.doc_ids[start:end], self.tfs[start:end],
+                self.positions[self.position_offsets[i]:self.position_offsets[i + 1]])
+
+# 合并后的文档向量的 posting
+class segment_merged(segment_terms):
+    """合并正文和标题后每个词项的 (文档编号, 权重)，df 即正文与标题并集的文档频率。"""
+
+    def __init__(self, segment):
+        super().__init__(segment, MERGED)
+        self.weights = segment.array(f"{MERGED}.weights")
+        self.max_scores = segment.array(f"{MERGED}.max_scores")
+
+    def postings(self, term):
+        """
+        :return: (文档编号, 权重)，均为 memoryview；词项不存在时为空。
+        """
+        i = self.find(term)
+        if i is None:
+            return self.doc_ids[0:0], self.weights[0:0]
+        start, end = self.posting_offsets[i], self.posting_offsets[i + 1]
+        return self.doc_ids[start:end], self.weights[start:end]
+
+# 用 mmap 打开的段文件
+class index_segment:
+    """
+    只读地映射段文件。打开时只解析文件头和目录，词典和 posting 在访问时才由操作系统读入页面缓存。
+    可以用作上下文管理器。
+    """
+
+    def __init__(self, path):
+        """
+        :param path: 段文件路径；文件不是段文件或版本不同时抛出 ValueError。
+        """
+        with open(path, "rb") as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+        magic, version, count = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version {VERSION} index segment")
+        self.entries = {}
+        for i in range(count):
+            name, typecode, offset, length = ENTRY.unpack_from(self.mmap, HEADER.size + ENTRY.size * i)
+            self.entries[name.rstrip(b"\0").decode("ascii")] = (typecode.decode("ascii"), offset, length)
+        self.doc_count, self.indexed_docs = self.array("meta")
+        self.doc_url_offsets = self.array("doc_url_offsets")
+        self.doc_urls = self.array("doc_urls")
+        self.doc_norms = self.array("doc_norms")
+        self.fields = {field: segment_field(self, field) for field in FIELDS}
+        self.merged = segment_merged(self)
+
+    def array(self, name):
+        """返回数组在映射上的 memoryview；大端序的机器上返回字节序转换后的 array 副本。"""
+        typecode, offset, length = self.entries[name]
+        itemsize = array(typecode).itemsize
+        data = self.view[offset:offset + length * itemsize]
+        if sys.byteorder == "big":
+            values = array(typecode, data.tobytes())
+            values.byteswap()
+            return values
+        return data.cast(typecode)
+
+    def url(self, doc_id):
+        return self.doc_urls[self.doc_url_offsets[doc_id]:self.doc_url_offsets[doc_id + 1]].tobytes().decode("utf-8")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        解除映射。仍有从段文件取得的 memoryview 未释放时不能立即解除，映射在这些对象被回收后释放。
+        """
+        self.fields = {}
+        self.merged = None
+        self.view.release()
+        try:
+            self.mmap.close()
+        except BufferError:
+            pass
+
+def open_segment(segment_file=SEGMENT_FILE):
+    """
+    打开段文件。
+    :param segment_file: 段文件名，相对路径相对于 spider.DATA_DIR。
+    :return: index_segment；文件不存在或不是当前版本的段文件时返回 None。
+    """
+    path = database_path(segment_file)
+    if not os.path.exists(path):
+        return None
+    try:
+        return index_segment(path)
+    except (ValueError, struct.error, OSError):
+        return None
@@ -1,33 +1,273 @@
-import requests
 from lxml import html
-from collections import deque, Counter
-from urllib.parse import urljoin  # 用于处理相对链接
-from datetime import datetime, timezone
+from collections import deque, Counter, OrderedDict
+from collections.abc import MutableSet, Mapping
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from urllib.parse import urljoin, urlsplit, urlunsplit  # 用于处理相对链接
+from datetime import datetime, timezone, timedelta
 import sqlite3
-import re
 import os
 import sys
 import base64
+from array import array
+from itertools import chain, accumulate
+import hashlib
+import signal
+import threading
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from fetcher import shared_fetcher
+from bulk_writer import DEFAULT_BATCH_SIZE, connect, transaction, batches, insert_rows, replace_generation, id_map
+from analysis import load_stopwords, analyze_text
+
+# 数据库文件所在的目录，默认为本文件所在的目录；可以通过环境变量 SPIDER_DATA_DIR 指定，
+# 或在调用 spider、indexer、retrieval 之前修改 spider.DATA_DIR（例如 benchmark.py 使用临时目录）
+DATA_DIR = os.environ.get("SPIDER_DATA_DIR", os.path.dirname(os.path.abspath(__file__)))
+
+def database_path(database_file):
+    """返回数据库文件的路径，相对路径相对于 DATA_DIR。"""
+    return os.path.join(DATA_DIR, database_file)
+
+# 字符串编号表
+class intern_table:
+    """
+    为字符串（URL、关键词）分配表内唯一的整数编号，每个不同的字符串只保存一份。
+    网页用编号数组保存链接和关键词，而不是在每个网页中各自保存一份字符串。
+    编号只在同一张表内有效，不能写入数据库或传给其他进程。可以在多个线程中同时调用。
+    """
+
+    def __init__(self):
+        self.ids = {}  # {字符串: 编号}
+        self.values = []  # 编号对应的字符串
+        self.lock = threading.Lock()
+
+    def id(self, value):
+        """返回字符串的编号，不存在时分配新编号。"""
+        value_id = self.ids.get(value)
+        if value_id is None:
+            with self.lock:
+                value_id = self.ids.get(value)
+                if value_id is None:
+                    value_id = len(self.values)
+                    self.values.append(value)
+                    self.ids[value] = value_id
+        return value_id
+
+    def intern(self, value):
+        """返回与 value 相等的共享字符串。"""
+        return self.values[self.id(value)]
+
+# 一组网页共用的编号表
+class string_tables:
+    """
+    一次爬取（page_registry）、一次读取数据库或一个 page_store 中的网页共用的 URL 和关键词编号表。
+    表由创建网页的一方持有并传给 webpage，网页和其中的 link_set 引用这些表，
+    表随最后一个引用它的网页一起释放，长期运行的进程中不会随着见过的 URL 和关键词不断增长。
+    """
+    __slots__ = ("urls", "terms")
+
+    def __init__(self):
+        self.urls = intern_table()
+        self.terms = intern_table()
+
+# 按插入顺序排列的链接集合
+class link_set(MutableSet):
+    """
+    与 set 用法相同，但按插入顺序迭代。子链接按在网页中出现的顺序保存，
+    因此从数据库沿用的页面与重新解析的页面以相同顺序将子链接加入 BFS 队列。
+    链接以 URL 编号表中的编号保存在 array 中（每个链接 4 字节），查找为线性扫描，适用于单个网页的链接数量。
+    """
+    __slots__ = ("_ids", "_urls")
+
+    def __init__(self, links=(), urls=None):
+        """
+        :param links: 链接。
+        :param urls: URL 的 intern_table，通常为网页的 tables.urls；为 None 时使用新的表。
+        """
+        self._ids = array("I")
+        self._urls = urls if urls is not None else intern_table()
+        seen = set()
+        for link in links:
+            link_id = self._urls.id(link)
+            if link_id not in seen:
+                seen.add(link_id)
+                self._ids.append(link_id)
+
+    def __contains__(self, link):
+        link_id = self._urls.ids.get(link)
+        return link_id is not None and link_id in self._ids
+
+    def __iter__(self):
+        values = self._urls.values
+        return (values[link_id] for link_id in self._ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, link):
+        link_id = self._urls.id(link)
+        if link_id not in self._ids:
+            self._ids.append(link_id)
+
+    def discard(self, link):
+        link_id = self._urls.ids.get(link)
+        if link_id is not None and link_id in self._ids:
+            self._ids.remove(link_id)
+
+    def __reduce__(self):
+        # 编号只在同一张表内有效，序列化时保存 URL
+        return (link_set, (list(self),))
+
+    def __repr__(self):
+        return f"link_set({list(self)!r})"
+
+# webpage.body_keywords 和 webpage.body_positions 的只读视图
+class keyword_view(Mapping):
+    """
+    以 {关键词: 值} 的形式读取网页的关键词数组，访问时才解码。
+    按关键词查找时第一次建立 {编号: 下标} 的索引，视图本身不保存在网页中。
+    """
+
+    def __init__(self, term_ids, tfs, positions, terms):
+        self._term_ids = term_ids
+        self._tfs = tfs
+        self._positions = positions
+        self._terms = terms  # 关键词的 intern_table
+        self._index = None
+
+    def _find(self, word):
+        if self._index is None:
+            self._index = {term_id: i for i, term_id in enumerate(self._term_ids)}
+        i = self._index.get(self._terms.ids.get(word))
+        if i is None:
+            raise KeyError(word)
+        return i
+
+    def __iter__(self):
+        values = self._terms.values
+        return (values[term_id] for term_id in self._term_ids)
+
+    def __len__(self):
+        return len(self._term_ids)
+
+class keyword_counts(keyword_view):
+    """{关键词: 词频}。"""
+
+    def __getitem__(self, word):
+        return self._tfs[self._find(word)]
+
+    def values(self):
+        return self._tfs.tolist()
+
+    def items(self):
+        return list(zip(self, self._tfs))
+
+class keyword_positions(keyword_view):
+    """{关键词: 位置列表}；网页没有位置信息时为空。"""
+
+    def __init__(self, term_ids, tfs, positions, terms):
+        super().__init__(term_ids, tfs, positions, terms)
+        self._offsets = None
+
+    def __getitem__(self, word):
+        if not self._positions:
+            raise KeyError(word)
+        i = self._find(word)
+        if self._offsets is None:
+            self._offsets = list(accumulate(self._tfs, initial=0))
+        return self._positions[self._offsets[i]:self._offsets[i + 1]].tolist()
+
+    def __iter__(self):
+        return super().__iter__() if self._positions else iter(())
+
+    def __len__(self):
+        return len(self._term_ids) if self._positions else 0
+
+    def items(self):
+        # 按顺序切分位置数组，不需要逐个查找关键词
+        items = []
+        offset = 0
+        for word, tf in zip(self, self._tfs):
+            items.append((word, self._positions[offset:offset + tf].tolist()))
+            offset += tf
+        return items
+
+    @property
+    def flat(self):
+        """按关键词顺序依次连接的全部位置。"""
+        return self._positions
 
 # 网页
 class webpage:
-    title = ""  # 网页标题
-    url = ""  # 网页链接
-    date = datetime(1970, 1, 1, 0, 0, 0, tzinfo=timezone.utc)  # 最后修改时间
-    size = 0
-    body_keywords = {}  # 正文关键词及其频率
-    parent_links = set()  # 父链接
-    child_links = set()  # 子链接
-
-    def __init__(self, url="", title="", date=None, size=0, body_keywords=None, parent_links=None, child_links=None):
-        self.url = url
+    """
+    网页。字段：
+    - url、title、date（最后修改时间）、size；
+    - body_keywords：正文关键词及其频率；body_positions：正文关键词在正文单词序列（包括停用词）中的位置，用于短语查询；
+    - parent_links：父链接；child_links：子链接（按在网页中出现的顺序）；
+    - last_modified、etag：响应头中的 Last-Modified 和 ETag 原文，用于条件请求；
+    - crawled：最后一次抓取或验证该页面的时间；
+    - simhash：正文的 SimHash 指纹，为 0 时不参与近似重复检测；
+    - duplicate_urls：与本页近似重复、已合并到本页的网页链接。
+    为了爬取和索引大型网站时节省内存，网页使用 __slots__，关键词以编号、词频和位置三个 array 保存，
+    body_keywords 和 body_positions 返回这些数组的只读视图。URL 和关键词的编号来自 tables（见 string_tables），
+    同一次爬取或读取的网页应共用一个 string_tables。
+    赋值 body_positions 时同时设置关键词和词频；赋值 body_keywords 时清除位置。
+    """
+    __slots__ = ("url", "title", "date", "size", "parent_links", "child_links", "last_modified", "etag", "crawled", "simhash", "duplicate_urls",
+                 "tables", "_term_ids", "_tfs", "_positions")
+
+    def __init__(self, url="", title="", date=None, size=0, body_keywords=None, parent_links=None, child_links=None, last_modified="", etag="", crawled=None, body_positions=None, simhash=0, duplicate_urls=None, tables=None):
+        self.tables = tables if tables is not None else string_tables()
+        self.url = self.tables.urls.intern(url)
         self.title = title
         self.date = date if date else datetime(1970, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
         self.size = size
-        self.body_keywords = body_keywords if body_keywords else {}
+        self._term_ids, self._tfs, self._positions = array("I"), array("I"), array("I")
+        if body_keywords:
+            self.body_keywords = body_keywords
+        # 指定 body_positions 时由它得到关键词和词频
+        if body_positions:
+            self.body_positions = body_positions
         self.parent_links = parent_links if parent_links else set()
-        self.child_links = child_links if child_links else set()
+        self.child_links = link_set(child_links or (), self.tables.urls)
+        self.last_modified = last_modified
+        self.etag = etag
+        self.crawled = crawled if crawled else datetime(1970, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
+        self.simhash = simhash
+        self.duplicate_urls = link_set(duplicate_urls or (), self.tables.urls)
+
+    @property
+    def body_keywords(self):
+        return keyword_counts(self._term_ids, self._tfs, self._positions, self.tables.terms)
+
+    @body_keywords.setter
+    def body_keywords(self, keywords):
+        self.set_terms(list(keywords), keywords.values(), ())
+
+    @property
+    def body_positions(self):
+        return keyword_positions(self._term_ids, self._tfs, self._positions, self.tables.terms)
+
+    @body_positions.setter
+    def body_positions(self, positions):
+        if positions:
+            self.set_terms(list(positions), map(len, positions.values()), chain.from_iterable(positions.values()))
+        else:
+            self._positions = array("I")
+
+    def set_terms(self, words, tfs, positions):
+        """
+        设置正文关键词。
+        :param words: 关键词列表。
+        :param tfs: 与 words 顺序一致的词频。
+        :param positions: 依次连接的每个关键词的 tf 个位置，没有位置信息时为空。
+        """
+        self._term_ids = array("I", map(self.tables.terms.id, words))
+        self._tfs = array("I", tfs)
+        self._positions = array("I", positions)
+
+    def __reduce__(self):
+        # 编号只在同一张表内有效，序列化时保存字符串
+        return (webpage, (self.url, self.title, self.date, self.size, dict(self.body_keywords), self.parent_links, list(self.child_links),
+                          self.last_modified, self.etag, self.crawled, dict(self.body_positions), self.simhash, list(self.duplicate_urls)))
 
     def __eq__(self, other):
         if isinstance(other, webpage):
@@ -39,6 +279,228 @@ class webpage:
     def __hash__(self):
         return hash(self.url)
 
+def normalize_url(url):
+    """
+    规范化 URL，用作页面登记表的键：协议和主机名转为小写，去掉默认端口和片段（#...）。
+    :param url: 绝对 URL。
+    :return: 规范化后的 URL。
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme == "http" and netloc.endswith(":80")) or (scheme == "https" and netloc.endswith(":443")):
+        netloc = netloc.rsplit(":", 1)[0]
+    path = parts.path if parts.path or not netloc else "/"
+    return urlunsplit((scheme, netloc, path, parts.query, ""))
+
+# SimHash 指纹的位数，以及视为近似重复的最大汉明距离
+SIMHASH_BITS = 64
+SIMHASH_DISTANCE = 3
+# 计算指纹所需的最少不同 shingle 数；更短的正文（占位页、只有模板的页面）不计算指纹，不参与近似重复检测
+SIMHASH_MIN_SHINGLES = 8
+
+def simhash(words, shingle_size=3):
+    """
+    计算单词序列的 SimHash 指纹，特征为连续 shingle_size 个单词组成的 shingle，权重为出现次数。
+    使用 blake2b 而不是 hash()，保证不同进程计算出的指纹相同。
+    :param words: 单词列表。
+    :param shingle_size: 每个 shingle 的单词数。
+    :return: SIMHASH_BITS 位的指纹；不同的 shingle 少于 SIMHASH_MIN_SHINGLES 个时返回 0。
+    """
+    shingles = Counter(" ".join(words[i:i+shingle_size]) for i in range(len(words) - shingle_size + 1))
+    if len(shingles) < SIMHASH_MIN_SHINGLES:
+        return 0
+    weights = [0] * SIMHASH_BITS
+    for shingle, count in shingles.items():
+        feature = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=SIMHASH_BITS // 8).digest(), "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += count if feature >> bit & 1 else -count
+    return sum(1 << bit for bit in range(SIMHASH_BITS) if weights[bit] > 0)
+
+def simhash_distance(a, b):
+    """两个指纹的汉明距离。"""
+    return (a ^ b).bit_count()
+
+# SimHash 指纹索引
+class simhash_index:
+    """
+    将指纹分为 max_distance + 1 段，按每一段的值分别建立桶。
+    汉明距离不超过 max_distance 的两个指纹至少有一段完全相同，因此只需比较同一个桶中的指纹。
+    """
+
+    def __init__(self, max_distance=SIMHASH_DISTANCE):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        width = SIMHASH_BITS // bands
+        # 每一段的 (起始位, 位数)，最后一段包含除不尽的剩余位
+        self.bands = [(i * width, width if i < bands - 1 else SIMHASH_BITS - i * width) for i in range(bands)]
+        self.buckets = [{} for _ in self.bands]
+
+    def add(self, fingerprint, key):
+        """登记 key 的指纹；同一 key 再次登记时，旧指纹所在的桶不会被清除。"""
+        for (shift, width), buckets in zip(self.bands, self.buckets):
+            buckets.setdefault(fingerprint >> shift & ((1 << width) - 1), {})[key] = fingerprint
+
+    def candidates(self, fingerprint):
+        """按登记顺序返回与 fingerprint 的汉明距离不超过 max_distance 的 key（可能重复）。"""
+        for (shift, width), buckets in zip(self.bands, self.buckets):
+            for key, candidate in buckets.get(fingerprint >> shift & ((1 << width) - 1), {}).items():
+                if simhash_distance(candidate, fingerprint) <= self.max_distance:
+                    yield key
+
+# 爬虫的页面登记表
+class page_registry:
+    """
+    以规范化 URL 为键登记爬虫中的页面：
+    - visited：已访问的页面；
+    - frontier：等待抓取的页面，按入队顺序排列（BFS 队列）；
+    - in_flight：已出队、正在抓取但尚未处理的页面。
+    三者的成员判断、查找、插入和删除均为 O(1)。同一 URL 在 frontier 和 in_flight 中最多出现一次，
+    重复入队时只合并其 parent_links。
+
+    已访问页面的 SimHash 指纹登记在 fingerprints 中，用于查找近似重复的页面；
+    近似重复的页面不加入 visited，只记录在规范页面的 duplicate_urls 和 duplicates 中。
+
+    登记表还记录自上一次检查点以来发生变化（changed，规范化 URL）和被移除（removed，原始 URL）的已访问页面，
+    以便检查点只写入增量。
+    """
+
+    def __init__(self):
+        self.visited = {}
+        self.frontier = OrderedDict()
+        self.in_flight = {}
+        self.changed = set()
+        self.removed = set()
+        self.fingerprints = simhash_index()
+        self.duplicates = {}  # 近似重复页面的规范化 URL → 规范页面的规范化 URL
+        self.tables = string_tables()  # 本次爬取中新建的网页共用的编号表，随爬取结果一起释放
+
+    def __len__(self):
+        """已访问的页面数。"""
+        return len(self.visited)
+
+    def pages(self):
+        """返回已访问的 webpage 集合。"""
+        return set(self.visited.values())
+
+    def get_visited(self, url):
+        """返回 url 对应的已访问页面，不存在时返回 None。"""
+        return self.visited.get(normalize_url(url))
+
+    def add_visited(self, page):
+        """将页面登记为已访问，替换同一 URL 的旧页面。"""
+        key = normalize_url(page.url)
+        self.visited[key] = page
+        self.changed.add(key)
+        self.removed.discard(page.url)
+        if page.simhash:
+            self.fingerprints.add(page.simhash, key)
+        for duplicate_url in page.duplicate_urls:
+            self.duplicates[normalize_url(duplicate_url)] = key
+
+    def remove_visited(self, url):
+        """将 url 对应的页面移出已访问集合。"""
+        key = normalize_url(url)
+        page = self.visited.pop(key, None)
+        if page:
+            self.changed.discard(key)
+            self.removed.add(page.url)
+            for duplicate_url in page.duplicate_urls:
+                self.duplicates.pop(normalize_url(duplicate_url), None)
+
+    def add_parent(self, page, parent_url):
+        """为已访问的页面添加父链接。"""
+        page.parent_links.add(parent_url)
+        self.changed.add(normalize_url(page.url))
+
+    def find_duplicate(self, page):
+        """
+        查找与 page 近似重复的其他已访问页面：标题相同，且正文指纹的汉明距离不超过 max_distance。
+        :return: 规范页面，不存在时返回 None。
+        """
+        if not page.simhash:
+            return None
+        key = normalize_url(page.url)
+        for candidate_key in self.fingerprints.candidates(page.simhash):
+            candidate = self.visited.get(candidate_key)
+            # 指纹索引中可能残留已被替换或移除的页面，需要以页面当前的指纹为准
+            if candidate_key != key and candidate and candidate.simhash and candidate.title == page.title and simhash_distance(candidate.simhash, page.simhash) <= self.fingerprints.max_distance:
+                return candidate
+        return None
+
+    def add_duplicate(self, page, duplicate_url):
+        """将 duplicate_url 作为近似重复页面合并到已访问的规范页面 page。"""
+        page.duplicate_urls.add(duplicate_url)
+        key = normalize_url(page.url)
+        self.duplicates[normalize_url(duplicate_url)] = key
+        self.changed.add(key)
+
+    def is_duplicate(self, url):
+        """检查 url 是否已作为近似重复页面合并到某个已访问页面。"""
+        return normalize_url(url) in self.duplicates
+
+    def queued_pages(self):
+        """按出队顺序返回正在抓取和等待抓取的页面。"""
+        return list(self.in_flight.values()) + list(self.frontier.values())
+
+    def mark_saved(self):
+        """清空变化记录，在写入检查点之后调用。"""
+        self.changed.clear()
+        self.removed.clear()
+
+    def get_queued(self, url):
+        """返回 url 对应的等待抓取或正在抓取的页面，不存在时返回 None。"""
+        key = normalize_url(url)
+        return self.frontier.get(key) or self.in_flight.get(key)
+
+    def enqueue(self, page):
+        """
+        将页面加入 BFS 队列。如果同一 URL 已在队列中或正在抓取，则只合并 parent_links。
+        :return: 队列中代表该 URL 的 webpage 对象。
+        """
+        queued_page = self.get_queued(page.url)
+        if queued_page:
+            queued_page.parent_links |= page.parent_links
+            return queued_page
+        self.frontier[normalize_url(page.url)] = page
+        return page
+
+    def dequeue(self):
+        """取出队首页面并标记为正在抓取。"""
+        key, page = self.frontier.popitem(last=False)
+        self.in_flight[key] = page
+        return page
+
+    def finish(self, page):
+        """
+        结束页面的抓取，取消其正在抓取的标记。
+        :return: 页面在抓取期间未被移出队列时返回 True。
+        """
+        key = normalize_url(page.url)
+        if self.in_flight.get(key) is not page:
+            return False
+        del self.in_flight[key]
+        return True
+
+    def remove_parent(self, child_url, parent_url, start_url):
+        """
+        从 child_url 对应页面（已访问的以及队列中的）的 parent_links 中移除 parent_url，
+        如果页面不是 start_url 且没有父链接了，则将其从登记表中移除。
+        """
+        key = normalize_url(child_url)
+        child_page = self.visited.get(key)
+        if child_page:
+            child_page.parent_links.discard(parent_url)
+            self.changed.add(key)
+            if child_page.url != start_url and not child_page.parent_links:
+                self.remove_visited(child_page.url)
+        for pages in (self.frontier, self.in_flight):
+            queued_page = pages.get(key)
+            if queued_page:
+                queued_page.parent_links.discard(parent_url)
+                if queued_page.url != start_url and not queued_page.parent_links:
+                    del pages[key]
+
 def to_base64(s):
     """将字符串 s 编码成 base64 字符串。"""
     return base64.b64encode(s.encode("utf-8")).decode("utf-8")
@@ -47,14 +509,94 @@ def from_base64(b64_str):
     """将 base64 字符串解码成 UTF-8 字符串。"""
     return base64.b64decode(b64_str.encode("utf-8")).decode("utf-8")
 
+EPOCH = datetime(1970, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
+
+# webpages.db 的表结构：
+# - urls：所有出现过的 URL（网页本身、子链接、父链接和近似重复网页），url_id 为整数编号；
+# - documents：已访问的网页，doc_id 即网页 URL 的 url_id，时间为 UTC 微秒时间戳；
+# - links：网页的子链接，position 为子链接在网页中的顺序；
+# - parents：网页的父链接；
+# - duplicates：合并到网页的近似重复网页；
+# - terms / doc_terms：正文关键词，以及每个网页中各关键词的编号、词频和位置。doc_terms 每个网页一行，
+#   term_ids、tfs 和 positions 均为 encode_integers 编码的整数数组 BLOB；positions 依次存放每个关键词的 tf 个位置，
+#   网页没有位置信息时（例如从 2-5 词短语格式迁移的网页）为空。
+#   与每个（网页, 关键词）一行相比，数据库更小，读写时也不需要逐行绑定参数。
+# TABLES 为 {表名: 表定义}，INDEXES 中的索引在全量写入之后建立。
+TABLES = {
+    "urls": "(url_id INTEGER PRIMARY KEY, url TEXT NOT NULL UNIQUE)",
+    "documents": """(
+        doc_id INTEGER PRIMARY KEY,
+        title TEXT NOT NULL,
+        date INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        is_start INTEGER NOT NULL,
+        last_modified TEXT NOT NULL,
+        etag TEXT NOT NULL,
+        crawled INTEGER NOT NULL,
+        simhash INTEGER NOT NULL
+    )""",
+    "links": "(parent_id INTEGER NOT NULL, position INTEGER NOT NULL, child_id INTEGER NOT NULL, PRIMARY KEY (parent_id, position)) WITHOUT ROWID",
+    "parents": "(doc_id INTEGER NOT NULL, parent_id INTEGER NOT NULL, PRIMARY KEY (doc_id, parent_id)) WITHOUT ROWID",
+    "duplicates": "(doc_id INTEGER NOT NULL, position INTEGER NOT NULL, url_id INTEGER NOT NULL, PRIMARY KEY (doc_id, position)) WITHOUT ROWID",
+    "terms": "(term_id INTEGER PRIMARY KEY, term TEXT NOT NULL UNIQUE)",
+    "doc_terms": "(doc_id INTEGER PRIMARY KEY, term_ids BLOB NOT NULL, tfs BLOB NOT NULL, positions BLOB NOT NULL)",
+}
+INDEXES = ("CREATE INDEX IF NOT EXISTS links_child ON links (child_id)",)
+# 以网页为单位写入和删除的表及其网页编号字段
+DOCUMENT_TABLES = (("documents", "doc_id"), ("links", "parent_id"), ("parents", "doc_id"), ("duplicates", "doc_id"), ("doc_terms", "doc_id"))
+
+def to_timestamp(date):
+    """将 datetime 转换为 UTC 微秒时间戳（整数，可以无损还原）。"""
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return (date - EPOCH) // timedelta(microseconds=1)
+
+def from_timestamp(timestamp):
+    """将 UTC 微秒时间戳还原为 datetime。"""
+    return EPOCH + timedelta(microseconds=timestamp)
+
+def encode_integers(values):
+    """
+    将非负整数列表编码为 BLOB：首字节为 array 的类型码，其后为小端序的整数数组，
+    按最大值选用 1、2 或 4 字节的元素，多数关键词编号、词频和位置只需 1 到 2 个字节。
+    """
+    values = values if isinstance(values, list) else list(values)
+    largest = max(values, default=0)
+    typecode = "B" if largest < (1 << 8) else "H" if largest < (1 << 16) else "I"
+    values = array(typecode, values)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return typecode.encode("ascii") + values.tobytes()
+
+def decode_integers(blob):
+    """将 encode_integers 编码的 BLOB 还原为整数列表。"""
+    values = array(chr(blob[0]))
+    values.frombytes(blob[1:])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tolist()
+
+def to_signed(fingerprint):
+    """SQLite 的 INTEGER 为有符号 64 位整数，将 64 位无符号指纹转换为有符号数存储。"""
+    return fingerprint - (1 << 64) if fingerprint >= (1 << 63) else fingerprint
+
+def to_unsigned(fingerprint):
+    """to_signed 的逆变换。"""
+    return fingerprint + (1 << 64) if fingerprint < 0 else fingerprint
+
+def has_schema(cursor):
+    """检查数据库中是否已有当前格式的表。"""
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    return set(TABLES) <= {row[0] for row in cursor.fetchall()}
+
 def read_database(database_file):
     """
-    读取 webpages.db 并返回网页集合和 is_start 为 1 的页面，
-    数据库中的每一项均为 base64 编码（单个字段直接编码，join后的字段不整体编码），读取后进行解码。
+    读取 webpages.db 并返回网页集合和 is_start 为 1 的页面。
     :param database_file: SQLite 数据库文件名。
-    :return: (webpage 集合, start_page) 或 (None, None)
+    :return: (webpage 集合, start_page) 或 (None, None)；数据库不存在、已损坏或为旧格式
+             （旧格式可以用 migrate_database.py 转换）时返回 (None, None)。
     """
-    db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), database_file)
+    db_path = database_path(database_file)
     if not os.path.exists(db_path):
         return None, None
 
@@ -62,65 +604,46 @@ def read_database(database_file):
     cursor = conn.cursor()
 
     try:
-        cursor.execute("SELECT url, title, date, size, body_keywords, parent_links, child_links, is_start FROM webpages")
-        rows = cursor.fetchall()
-        webpages = set()
-        start_page = None
-        for row in rows:
-            try:
-                url = from_base64(row[0])
-                title = from_base64(row[1])
-                date_str = from_base64(row[2])
-                size_str = from_base64(row[3])
-                # body_keywords 字段：存储的是每个项 key:value 都分别 Base64 编码后用 ":" 分隔，再用逗号连接
-                body_keywords_str = row[4] if row[4] else ""
-                body_keywords = {}
-                if body_keywords_str:
-                    for item in body_keywords_str.split(","):
-                        parts = item.split(":")
-                        if len(parts) == 2:
-                            key = from_base64(parts[0])
-                            try:
-                                value = int(from_base64(parts[1]))
-                            except:
-                                value = 0
-                            body_keywords[key] = value
-
-                # parent_links 字段：每个链接已单独 Base64 编码，用逗号分隔
-                parent_links_str = row[5] if row[5] else ""
-                parent_links = set(from_base64(link) for link in parent_links_str.split(",")) if parent_links_str else set()
-
-                # child_links 字段：同理，按逗号分隔后逐个解码
-                child_links_str = row[6] if row[6] else ""
-                child_links = set(from_base64(link) for link in child_links_str.split(",")) if child_links_str else set()
-
-                is_start_str = from_base64(row[7]) if row[7] else "0"
-            except Exception:
-                continue
-
-            date = datetime.fromisoformat(date_str) if date_str else datetime(1970, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
-            try:
-                size = int(size_str)
-            except:
-                size = 0
+        if not has_schema(cursor):
+            return None, None
+
+        urls = dict(cursor.execute("SELECT url_id, url FROM urls"))
+        terms = dict(cursor.execute("SELECT term_id, term FROM terms"))
 
+        tables = string_tables()  # 读取的网页共用的编号表
+        pages = {}
+        start_page = None
+        for doc_id, title, date, size, is_start, last_modified, etag, crawled, fingerprint in cursor.execute(
+                "SELECT doc_id, title, date, size, is_start, last_modified, etag, crawled, simhash FROM documents"):
             page = webpage(
-                url=url,
+                url=urls[doc_id],
                 title=title,
-                date=date,
+                date=from_timestamp(date),
                 size=size,
-                body_keywords=body_keywords,
-                parent_links=parent_links,
-                child_links=child_links
+                last_modified=last_modified,
+                etag=etag,
+                crawled=from_timestamp(crawled),
+                simhash=to_unsigned(fingerprint),
+                tables=tables
             )
-            webpages.add(page)
-            if is_start_str == "1":
+            pages[doc_id] = page
+            if is_start:
                 start_page = page
 
+        # 子链接和近似重复网页按 position 排序，保持原来的顺序
+        for parent_id, child_id in cursor.execute("SELECT parent_id, child_id FROM links ORDER BY parent_id, position"):
+            pages[parent_id].child_links.add(urls[child_id])
+        for doc_id, parent_id in cursor.execute("SELECT doc_id, parent_id FROM parents"):
+            pages[doc_id].parent_links.add(urls[parent_id])
+        for doc_id, url_id in cursor.execute("SELECT doc_id, url_id FROM duplicates ORDER BY doc_id, position"):
+            pages[doc_id].duplicate_urls.add(urls[url_id])
+        for doc_id, term_ids, tfs, positions in cursor.execute("SELECT doc_id, term_ids, tfs, positions FROM doc_terms"):
+            pages[doc_id].set_terms([terms[term_id] for term_id in decode_integers(term_ids)], decode_integers(tfs), decode_integers(positions) if positions else ())
+
         if not start_page:
             return None, None
 
-        return webpages, start_page
+        return set(pages.values()), start_page
 
     except Exception:
         return None, None
@@ -128,256 +651,784 @@ def read_database(database_file):
     finally:
         conn.close()
 
-def save_to_database(database_file, visited, start_url):
+# SQLite 一条语句中参数个数的安全上限
+MAX_VARIABLES = 900
+
+def lazy_field(name, load):
+    """
+    stored_page 的延迟字段：第一次读取时调用 load(page)，它返回 {字段名: 值}（可以同时读取多个字段）。
+    赋值后不再从数据库读取。
+    """
+    def getter(page):
+        if name not in page.__dict__:
+            for field, value in load(page).items():
+                # 不覆盖已经赋值的字段
+                page.__dict__.setdefault(field, value)
+        return page.__dict__[name]
+
+    def setter(page, value):
+        page.__dict__[name] = value
+
+    return property(getter, setter)
+
+def load_links(page):
+    return {"child_links": page.store.read_child_links(page.doc_id)}
+
+def load_parents(page):
+    return {"parent_links": page.store.read_parent_links(page.doc_id)}
+
+def load_duplicates(page):
+    return {"duplicate_urls": page.store.read_duplicate_urls(page.doc_id)}
+
+def lazy_terms(field):
+    """
+    stored_page 的正文关键词字段：第一次访问时由 page_store.read_terms 读取关键词和位置（保存在同一行中，一起解码），
+    通过 set_terms 填入网页自己的关键词数组，返回与 webpage 相同的视图（keyword_counts、keyword_positions）。
+    赋值前同样先读取，使只清除位置等部分赋值与 webpage 的行为一致；之后不再从数据库读取。
+    :param field: webpage 中对应的 property。
+    """
+    def load(page):
+        if not page.terms_loaded:
+            page.set_terms(*page.store.read_terms(page.doc_id))
+            page.terms_loaded = True
+
+    def getter(page):
+        load(page)
+        return field.fget(page)
+
+    def setter(page, value):
+        load(page)
+        field.fset(page, value)
+
+    return property(getter, setter)
+
+# page_store 中的网页
+class stored_page(webpage):
+    """
+    由 page_store 返回的 webpage。标题、日期等字段在创建时读取；
+    链接、近似重复网页和正文关键词在第一次访问时才从数据库读取和解码；
+    正文关键词解码到网页自己的关键词数组，body_keywords 和 body_positions 返回与 webpage 相同的视图。
+    """
+    child_links = lazy_field("child_links", load_links)
+    parent_links = lazy_field("parent_links", load_parents)
+    duplicate_urls = lazy_field("duplicate_urls", load_duplicates)
+    body_keywords = lazy_terms(webpage.body_keywords)
+    body_positions = lazy_terms(webpage.body_positions)
+
+    def __init__(self, store, doc_id, url, title, date, size, last_modified, etag, crawled, simhash):
+        # 不调用 webpage.__init__，以免给延迟字段赋默认值
+        self.store = store
+        self.doc_id = doc_id
+        self.url = url
+        self.title = title
+        self.date = date
+        self.size = size
+        self.last_modified = last_modified
+        self.etag = etag
+        self.crawled = crawled
+        self.simhash = simhash
+        self.tables = store.tables
+        self.terms_loaded = False
+
+# 按需读取的网页存储
+class page_store:
+    """
+    按 URL 从 webpages.db 读取网页，只读取和解码被访问的网页和字段，
+    内存和耗时取决于访问的网页数而不是数据库中的网页总数。
+    返回的 stored_page 在访问延迟字段时使用 page_store 的连接，因此在使用完这些网页之前不要关闭 page_store。
+    可以用作上下文管理器。
+    """
+
+    def __init__(self, db_path):
+        """
+        :param db_path: 数据库文件路径，数据库必须已有当前格式的表（见 open_page_store）。
+        """
+        # 网页可能在创建连接以外的线程（例如 Flask 的请求线程）中访问；连接只用于读取
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.tables = string_tables()  # 本存储返回的网页共用的编号表
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def __contains__(self, url):
+        return self.get(url) is not None
+
+    def iter_pages(self, where="", parameters=()):
+        """按条件读取 documents 表，逐个产生 stored_page，内存与网页总数无关。"""
+        for doc_id, url, title, date, size, last_modified, etag, crawled, fingerprint in self.conn.execute(
+                "SELECT doc_id, url, title, date, size, last_modified, etag, crawled, simhash FROM documents "
+                "JOIN urls ON url_id = doc_id " + where, parameters):
+            yield stored_page(self, doc_id, url, title, from_timestamp(date), size, last_modified, etag, from_timestamp(crawled), to_unsigned(fingerprint))
+
+    def iter_signatures(self):
+        """
+        按编号顺序逐个产生每个网页的 (url, 正文签名, 标题签名)，均为 16 字节，内容不变时签名不变。
+        正文签名由 doc_terms 中未解码的 BLOB 计算，不需要解码关键词或创建网页。
+        关键词编号在增量保存时保持不变；整个数据库被替换（非增量爬取）后编号可能改变，所有网页的签名随之改变。
+        """
+        for url, title, term_ids, tfs, positions in self.conn.execute(
+                "SELECT url, title, term_ids, tfs, positions FROM documents JOIN urls ON url_id = doc_id JOIN doc_terms USING (doc_id) ORDER BY doc_id"):
+            body = hashlib.blake2b(digest_size=16)
+            for blob in (term_ids, tfs, positions):
+                body.update(len(blob).to_bytes(8, "little"))
+                body.update(blob)
+            yield url, body.digest(), hashlib.blake2b(title.encode("utf-8"), digest_size=16).digest()
+
+    def pages(self, where="", parameters=()):
+        """按条件读取 documents 表，返回 stored_page 列表。"""
+        return list(self.iter_pages(where, parameters))
+
+    def get(self, url):
+        """返回 url 对应的网页，不存在时返回 None。"""
+        pages = self.pages("WHERE url = ?", (url,))
+        return pages[0] if pages else None
+
+    def get_many(self, urls):
+        """
+        批量读取网页，每 MAX_VARIABLES 个 URL 一次查询。
+        :return: {url: stored_page}，不包括数据库中没有的 URL。
+        """
+        urls = list(dict.fromkeys(urls))
+        found = {}
+        for start in range(0, len(urls), MAX_VARIABLES):
+            chunk = urls[start:start + MAX_VARIABLES]
+            for page in self.pages(f"WHERE url IN ({', '.join('?' for _ in chunk)})", chunk):
+                found[page.url] = page
+        return found
+
+    def start_page(self):
+        """返回 is_start 为 1 的网页，不存在时返回 None。"""
+        pages = self.pages("WHERE is_start = 1")
+        return pages[0] if pages else None
+
+    def read_child_links(self, doc_id):
+        return link_set((url for url, in self.conn.execute(
+            "SELECT url FROM links JOIN urls ON url_id = child_id WHERE parent_id = ? ORDER BY position", (doc_id,))), self.tables.urls)
+
+    def read_parent_links(self, doc_id):
+        return {url for url, in self.conn.execute(
+            "SELECT url FROM parents JOIN urls ON url_id = parent_id WHERE doc_id = ?", (doc_id,))}
+
+    def read_duplicate_urls(self, doc_id):
+        return link_set((url for url, in self.conn.execute(
+            "SELECT url FROM duplicates JOIN urls USING (url_id) WHERE doc_id = ? ORDER BY position", (doc_id,))), self.tables.urls)
+
+    def read_terms(self, doc_id):
+        """返回 set_terms 的参数 (关键词列表, 词频列表, 依次连接的位置列表)；没有位置信息时位置列表为空。"""
+        row = self.conn.execute("SELECT term_ids, tfs, positions FROM doc_terms WHERE doc_id = ?", (doc_id,)).fetchone()
+        if row is None:
+            return [], [], []
+        term_ids, tfs, positions = row
+        term_ids = decode_integers(term_ids)
+        terms = {}
+        unique_ids = list(set(term_ids))
+        for start in range(0, len(unique_ids), MAX_VARIABLES):
+            chunk = unique_ids[start:start + MAX_VARIABLES]
+            terms.update(self.conn.execute(f"SELECT term_id, term FROM terms WHERE term_id IN ({', '.join('?' for _ in chunk)})", chunk))
+        return [terms[term_id] for term_id in term_ids], decode_integers(tfs), decode_integers(positions) if positions else []
+
+def open_page_store(database_file):
+    """
+    打开 webpages.db 用于按需读取网页。
+    :param database_file: SQLite 数据库文件名。
+    :return: page_store；数据库不存在、已损坏或为旧格式时返回 None。
+    """
+    db_path = database_path(database_file)
+    if not os.path.exists(db_path):
+        return None
+    store = page_store(db_path)
+    try:
+        if has_schema(store.conn.cursor()):
+            return store
+    except sqlite3.DatabaseError:
+        pass
+    store.close()
+    return None
+
+def create_tables(cursor):
+    """创建 webpages.db 中尚不存在的表和索引。"""
+    for table, definition in TABLES.items():
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} {definition}")
+    for statement in INDEXES:
+        cursor.execute(statement)
+
+def delete_documents(cursor, doc_ids):
+    """删除网页在各个表中的行（urls 和 terms 中的行保留）。"""
+    doc_ids = [(doc_id,) for doc_id in doc_ids]
+    for table, column in DOCUMENT_TABLES:
+        cursor.executemany(f"DELETE FROM {table} WHERE {column} = ?", doc_ids)
+
+def write_webpages(cursor, pages, start_url, removed_urls=(), revalidated_pages=(), staging=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    将网页写入 webpages.db 的表，不提交事务。网页按 batch_size 个一组编码和写入，pages 可以是生成器。
+    :param cursor: SQLite 游标。
+    :param pages: 需要插入或替换的 webpage。
+    :param start_url: 起始 URL。
+    :param removed_urls: 需要删除的网页 URL。
+    :param revalidated_pages: 只需更新 crawled 字段的 webpage。
+    :param staging: replace_generation 返回的 {表名: 新表名}；写入新一代的空表时不读取已有编号，也不删除或更新旧行。
+    :param batch_size: 每组的网页数，也是每次 executemany 的行数。
+    """
+    tables = staging or {table: table for table in TABLES}
+    url_ids = id_map(None if staging else cursor, "urls", "url_id", "url")
+    term_ids = id_map(None if staging else cursor, "terms", "term_id", "term")
+
+    if not staging:
+        delete_documents(cursor, [url_ids.ids[url] for url in removed_urls if url in url_ids.ids])
+        cursor.executemany("UPDATE documents SET crawled = ? WHERE doc_id = ?",
+                           [(to_timestamp(page.crawled), url_ids.ids[page.url]) for page in revalidated_pages if page.url in url_ids.ids])
+
+    for batch in batches(pages, batch_size):
+        if not staging:
+            delete_documents(cursor, [url_ids.ids[page.url] for page in batch if page.url in url_ids.ids])
+        documents, links, parents, duplicates, doc_terms = [], [], [], [], []
+        for page in batch:
+            doc_id = url_ids[page.url]
+            documents.append((doc_id, page.title, to_timestamp(page.date), page.size, int(page.url == start_url),
+                              page.last_modified, page.etag, to_timestamp(page.crawled), to_signed(page.simhash)))
+            links.extend((doc_id, position, url_ids[link]) for position, link in enumerate(page.child_links))
+            parents.extend((doc_id, url_ids[link]) for link in page.parent_links)
+            duplicates.extend((doc_id, position, url_ids[link]) for position, link in enumerate(page.duplicate_urls))
+            doc_terms.append((doc_id,
+                              encode_integers(list(map(term_ids.__getitem__, page.body_keywords))),
+                              encode_integers(page.body_keywords.values()),
+                              encode_integers(page.body_positions.flat) if page.body_positions else b""))
+        url_ids.flush(cursor, tables["urls"], batch_size)
+        term_ids.flush(cursor, tables["terms"], batch_size)
+        insert_rows(cursor, tables["documents"], ("doc_id", "title", "date", "size", "is_start", "last_modified", "etag", "crawled", "simhash"), documents, batch_size)
+        insert_rows(cursor, tables["links"], ("parent_id", "position", "child_id"), links, batch_size)
+        insert_rows(cursor, tables["parents"], ("doc_id", "parent_id"), parents, batch_size)
+        insert_rows(cursor, tables["duplicates"], ("doc_id", "position", "url_id"), duplicates, batch_size)
+        insert_rows(cursor, tables["doc_terms"], ("doc_id", "term_ids", "tfs", "positions"), doc_terms, batch_size)
+
+def save_to_database(database_file, visited, start_url, changed_urls=None, removed_urls=None, revalidated_urls=None, batch_size=DEFAULT_BATCH_SIZE):
     """
     Save all visited webpages to a SQLite database.
-    存入数据库时，每个字段都以 base64 编码后存储。
+    默认在一个事务中以新一代的表替换数据库中原有的全部网页（包括旧格式的 webpages 表），读取者只会看到完整的旧数据或新数据；
+    指定 changed_urls 时只写回发生变化的网页（增量更新），如果数据库中还没有当前格式的表，则仍然全部写入。
     :param database_file: SQLite 数据库文件名。
     :param visited: 一个 webpage 的集合。
     :param start_url: 起始 URL。
+    :param changed_urls: 需要写回的网页 URL 集合，为 None 时全部写入。
+    :param removed_urls: 增量更新时需要从数据库删除的网页 URL 集合。
+    :param revalidated_urls: 增量更新时只需更新 crawled 字段的网页 URL 集合。
+    :param batch_size: 每组写入的网页数。
+    """
+    conn = connect(database_path(database_file))
+    try:
+        if changed_urls is not None and has_schema(conn.cursor()):
+            # 增量更新：只写回发生变化的网页，删除不再存在的网页
+            revalidated_urls = revalidated_urls or set()
+            with transaction(conn) as cursor:
+                write_webpages(cursor,
+                               (page for page in visited if page.url in changed_urls),
+                               start_url,
+                               removed_urls or (),
+                               [page for page in visited if page.url in revalidated_urls],
+                               batch_size=batch_size)
+        else:
+            # 替换为新一代的表，移除上一次爬取留下的网页
+            with replace_generation(conn, TABLES, INDEXES) as (cursor, staging):
+                write_webpages(cursor, visited, start_url, staging=staging, batch_size=batch_size)
+                cursor.execute("DROP TABLE IF EXISTS webpages")
+    finally:
+        conn.close()
+
+# 爬取检查点文件
+CHECKPOINT_FILE = "crawl_checkpoint.db"
+
+def remove_database(database_file):
+    """删除数据库文件（如果存在），同时删除 WAL 模式留下的 -wal 和 -shm 文件。"""
+    db_path = database_path(database_file)
+    for path in (db_path, db_path + "-wal", db_path + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+def remove_checkpoint(checkpoint_file):
+    """删除检查点文件（如果存在）。"""
+    remove_database(checkpoint_file)
+
+def save_checkpoint(checkpoint_file, registry, start_url, max_pages):
+    """
+    将爬取进度写入检查点，所有内容在同一个事务中提交：
+    - 网页表：与 webpages.db 格式相同，只写入自上一次检查点以来发生变化的已访问网页；
+    - frontier / frontier_parents 表：按出队顺序保存的全部待抓取网页（包括正在抓取的网页）及其父链接；
+    - checkpoint_meta 表：起始 URL 和最大页面数，用于判断检查点是否属于同一次爬取。
+    :param checkpoint_file: 检查点文件名。
+    :param registry: 爬虫的 page_registry。
+    :param start_url: 起始 URL。
+    :param max_pages: 最大爬取页面数。
+    """
+    conn = connect(database_path(checkpoint_file))
+    try:
+        with transaction(conn) as cursor:
+            create_tables(cursor)
+            cursor.execute("CREATE TABLE IF NOT EXISTS frontier (position INTEGER PRIMARY KEY, url_id INTEGER NOT NULL)")
+            cursor.execute("CREATE TABLE IF NOT EXISTS frontier_parents (position INTEGER NOT NULL, parent_id INTEGER NOT NULL)")
+            cursor.execute("CREATE TABLE IF NOT EXISTS checkpoint_meta (key TEXT PRIMARY KEY, value TEXT)")
+
+            changed_pages = (registry.visited[key] for key in registry.changed if key in registry.visited)
+            write_webpages(cursor, changed_pages, start_url, registry.removed)
+
+            queued_pages = registry.queued_pages()
+            url_ids = id_map(cursor, "urls", "url_id", "url")
+            frontier = [(position, url_ids[page.url]) for position, page in enumerate(queued_pages)]
+            frontier_parents = [(position, url_ids[link]) for position, page in enumerate(queued_pages) for link in page.parent_links]
+            url_ids.flush(cursor)
+            cursor.execute("DELETE FROM frontier")
+            cursor.execute("DELETE FROM frontier_parents")
+            insert_rows(cursor, "frontier", ("position", "url_id"), frontier)
+            insert_rows(cursor, "frontier_parents", ("position", "parent_id"), frontier_parents)
+            insert_rows(cursor, "checkpoint_meta", ("key", "value"), [("start_url", start_url), ("max_pages", str(max_pages))], replace=True)
+    finally:
+        conn.close()
+    registry.mark_saved()
+
+def load_checkpoint(checkpoint_file, start_url, max_pages):
+    """
+    读取检查点。
+    :param checkpoint_file: 检查点文件名。
+    :param start_url: 起始 URL。
+    :param max_pages: 最大爬取页面数。
+    :return: (已访问的 webpage 集合, 按出队顺序排列的待抓取 webpage 列表)；
+             检查点不存在、已损坏或不属于同一次爬取时返回 (None, None)。
     """
-    conn = sqlite3.connect(os.path.join(os.path.dirname(os.path.abspath(__file__)), database_file))
+    checkpoint_path = database_path(checkpoint_file)
+    if not os.path.exists(checkpoint_path):
+        return None, None
+
+    conn = sqlite3.connect(checkpoint_path)
     cursor = conn.cursor()
+    try:
+        meta = dict(cursor.execute("SELECT key, value FROM checkpoint_meta"))
+        if meta.get("start_url") != start_url or meta.get("max_pages") != str(max_pages):
+            return None, None
+
+        urls = dict(cursor.execute("SELECT url_id, url FROM urls"))
+        tables = string_tables()
+        queued_pages = [webpage(url=urls[url_id], tables=tables) for url_id, in cursor.execute("SELECT url_id FROM frontier ORDER BY position")]
+        for position, parent_id in cursor.execute("SELECT position, parent_id FROM frontier_parents"):
+            queued_pages[position].parent_links.add(urls[parent_id])
+    except Exception:
+        return None, None
+    finally:
+        conn.close()
+
+    visited, _ = read_database(checkpoint_file)
+    if visited is None:
+        return None, None
+    return visited, queued_pages
 
-    # 创建表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS webpages (
-            url TEXT PRIMARY KEY,
-            title TEXT,
-            date TEXT,
-            size TEXT,
-            body_keywords TEXT,
-            parent_links TEXT,
-            child_links TEXT,
-            is_start TEXT
-        )
-    ''')
-
-    for page in visited:
-        parent_links_b64 = ",".join(to_base64(link) for link in page.parent_links)
-        child_links_b64 = ",".join(to_base64(link) for link in page.child_links)
-        body_keywords_b64 = ",".join(f"{to_base64(key)}:{to_base64(str(value))}" for key, value in page.body_keywords.items())
-        is_start = "1" if page.url == start_url else "0"
-
-        # 将所有数据转换为字符串，然后分别 Base64 编码
-        url_b64 = to_base64(page.url)
-        title_b64 = to_base64(page.title)
-        date_b64 = to_base64(page.date.isoformat())
-        size_b64 = to_base64(str(page.size))
-        is_start_b64 = to_base64(is_start)
-
-        cursor.execute('''
-            INSERT OR REPLACE INTO webpages (url, title, date, size, body_keywords, parent_links, child_links, is_start)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (url_b64, title_b64, date_b64, size_b64, body_keywords_b64, parent_links_b64, child_links_b64, is_start_b64))
-
-    conn.commit()
-    conn.close()
-
-def load_stopwords(stopwords_file):
-    """
-    从文件中加载停用词。
-    :return: 停用词集合。
+def parse_last_modified(last_modified):
     """
+    将 HTTP Last-Modified 字段转换为 datetime 对象。
+    :param last_modified: Last-Modified 字段的字符串，可为 None。
+    :return: UTC datetime 对象；字段不存在或格式错误时返回 None。
+    """
+    if not last_modified:
+        return None
     try:
-        with open(os.path.dirname(os.path.abspath(__file__)) + "/" + stopwords_file, "r", encoding="utf-8") as file:
-            stopwords = set(line.strip() for line in file if line.strip())
-        return stopwords
-    except FileNotFoundError:
-        return set()
+        return datetime.strptime(last_modified, "%a, %d %b %Y %H:%M:%S %Z").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+def conditional_headers(page):
+    """
+    根据页面保存的 ETag 和 Last-Modified 生成条件请求头。
+    :param page: webpage 对象，可为 None。
+    :return: 请求头字典；页面没有缓存验证字段时为空。
+    """
+    headers = {}
+    if page is not None:
+        if page.etag:
+            headers["If-None-Match"] = page.etag
+        if page.last_modified:
+            headers["If-Modified-Since"] = page.last_modified
+    return headers
 
-def tokenize_and_filter(text, stopwords):
+def fetch_page(fetcher, url, headers=None):
     """
-    对文本进行分词，并移除停用词。
-    :param text: 输入的纯文本。
+    抓取网页，在抓取线程中运行。
+    :param fetcher: 抓取层 fetcher。
+    :param url: 网页链接。
+    :param headers: 额外的请求头（如条件请求头）。
+    :return: requests 的 Response 对象；状态码不是 2xx/3xx 时抛出异常。
+    """
+    response = fetcher.get(url, headers=headers, timeout=5)
+    response.raise_for_status()  # 出错时抛出异常
+    return response
+
+# 解析进程中使用的停用词，由 init_analyzer 设置
+analyzer_stopwords = None
+
+def init_analyzer(stopwords):
+    """解析进程池的初始化函数：保存停用词，避免每个页面都传一次。"""
+    global analyzer_stopwords
+    analyzer_stopwords = stopwords
+
+def start_analyzer(processes, stopwords):
+    """
+    创建解析进程池并立即启动全部解析进程。
+    进程池在第一次 submit 时才 fork 出进程；如果这发生在抓取线程中，其他抓取线程此时可能持有锁（例如连接池的锁），
+    子进程继承了被持有的锁就可能死锁。因此在创建抓取线程池之前提交一个空任务并等待它完成，
+    使用 fork 时进程池会在第一次 submit 时创建全部进程。
+    :param processes: 解析进程数。
     :param stopwords: 停用词集合。
-    :return: 过滤后的单词列表。
+    :return: ProcessPoolExecutor。
+    """
+    analyzer = ProcessPoolExecutor(max_workers=processes, initializer=init_analyzer, initargs=(stopwords,))
+    analyzer.submit(os.getpid).result()
+    return analyzer
+
+def analyze_page(url, content, stopwords=None):
+    """
+    解析网页并提取关键词和链接，是爬虫中 CPU 密集的部分，可以在解析进程池中运行。
+    :param url: 网页链接，用于将相对链接转换为绝对链接。
+    :param content: 网页的二进制内容。
+    :param stopwords: 停用词集合，为 None 时使用 init_analyzer 设置的停用词。
+    :return: (标题, body_positions, 按出现顺序排列的绝对链接列表, 正文的 SimHash 指纹)
     """
-    # 使用正则表达式提取单词（忽略标点符号）
-    words = re.findall(r'\b\w+\b', text.lower())
+    stopwords = stopwords if stopwords is not None else analyzer_stopwords
 
-    # 移除停用词
-    filtered_words = [word for word in words if word not in stopwords]
-    return filtered_words
+    # 解析 HTML
+    tree = html.fromstring(content)
 
-def spider(start_url, max_pages, bool_save_to_database=True):
+    # 提取网页正文内容
+    body_text = " ".join(tree.xpath('//body//text()[not(parent::script) and not(parent::style)]'))
+
+    # 一次分词同时得到原始单词序列和每个非停用词在其中的位置；停用词只占位置，不记录，
+    # 短语查询通过位置是否连续判断，无需再展开 2 到 5 个单词的短语
+    words, body_positions = analyze_text(body_text, stopwords)
+
+    # 计算正文指纹，用于发现镜像、打印版本等近似重复的网页
+    fingerprint = simhash(words)
+
+    # 提取网页标题
+    title = tree.xpath('//title/text()')
+    title = title[0] if title else "Untitled"
+
+    # 提取所有链接，并将相对链接转换为绝对链接
+    absolute_links = [urljoin(url, link) for link in tree.xpath('//a/@href')]
+    return title, body_positions, absolute_links, fingerprint
+
+def fetch_and_analyze(fetcher, url, headers, analyzer, stopwords):
+    """
+    爬虫流水线中的一项，在抓取线程中运行：先抓取网页（I/O），再交给解析进程池解析（CPU），
+    等待解析期间其他抓取线程继续进行网络请求。
+    :param fetcher: 抓取层 fetcher。
+    :param url: 网页链接。
+    :param headers: 额外的请求头（如条件请求头）。
+    :param analyzer: 解析进程池，为 None 时在当前线程中解析。
+    :param stopwords: 停用词集合，在当前线程中解析时使用。
+    :return: (Response, analyze_page 的结果)；服务器返回 304 时解析结果为 None。
+    """
+    response = fetch_page(fetcher, url, headers)
+    if response.status_code == 304:
+        return response, None
+    if analyzer is None:
+        return response, analyze_page(url, response.content, stopwords)
+    return response, analyzer.submit(analyze_page, url, response.content).result()
+
+def head_last_modified(fetcher, url, headers=None):
+    """
+    发送 HEAD 请求获取网页的最后修改时间，在抓取线程中运行。
+    :param fetcher: 抓取层 fetcher。
+    :param url: 网页链接。
+    :param headers: 额外的请求头（如条件请求头）。
+    :return: Last-Modified 对应的 datetime；没有该字段时返回当前时间；
+             服务器返回 304（页面未更改）或请求失败时返回 1970-01-01。
+    """
+    try:
+        response = fetcher.head(url, headers=headers, timeout=5)
+        response.raise_for_status()  # 如果状态码不是 2xx，抛出异常
+        if response.status_code == 304:
+            return datetime(1970, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
+        last_modified_date = parse_last_modified(response.headers.get("Last-Modified"))
+        # 如果 Last-Modified 不存在，将当前时间（UTC）作为日期
+        return last_modified_date if last_modified_date else datetime.now(timezone.utc)
+    except Exception:
+        return datetime(1970, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
+
+def page_changed(page, stored_page):
+    """
+    比较本次爬取得到的网页与数据库中的记录，判断 webpages 表中对应的行是否需要更新（不比较 crawled）。
+    :param page: 本次爬取得到的 webpage。
+    :param stored_page: 数据库中同一 URL 的 webpage，可为 None。
+    :return: 需要更新时返回 True。
+    """
+    if stored_page is None:
+        return True
+    return ((page.url, page.title, page.date, page.size, page.last_modified, page.etag)
+            != (stored_page.url, stored_page.title, stored_page.date, stored_page.size, stored_page.last_modified, stored_page.etag)
+            or page.body_positions != stored_page.body_positions
+            or page.body_keywords != stored_page.body_keywords
+            or page.simhash != stored_page.simhash
+            or set(page.duplicate_urls) != set(stored_page.duplicate_urls)
+            or set(page.parent_links) != set(stored_page.parent_links)
+            or list(page.child_links) != list(stored_page.child_links))
+
+def spider(start_url, max_pages, bool_save_to_database=True, max_workers=8, incremental=False, max_age=timedelta(days=1), checkpoint_interval=100, resume=False, fetcher=None, parse_processes=None):
     """
     A simple web spider that crawls pages using BFS.
+    爬取按流水线进行：抓取线程池负责网络请求（I/O），解析进程池负责 HTML 解析和关键词提取（CPU），
+    主线程按 BFS 出队顺序逐个处理结果并维护链接，因此结果与串行爬取一致。
+    各阶段之间最多有 max_workers 个页面，超出时不再出队新的页面。
+
+    标题与已访问网页相同、正文的 SimHash 指纹相近（汉明距离不超过 SIMHASH_DISTANCE）的网页视为近似重复，
+    只记录在先访问的规范网页的 duplicate_urls 中，不计入 max_pages，也不单独存储和索引；
+    其中尚未访问的链接仍然加入队列。正文过短的网页没有指纹（见 SIMHASH_MIN_SHINGLES），不会被合并。
+
+    增量模式下，数据库中 max_age 内抓取过的网页直接沿用，不发送任何请求；过期的网页发送条件请求，
+    新发现的网页正常抓取。保存时只写回发生变化的行，并删除不再可达的网页。
+
+    保存到数据库时，爬取进度每隔 checkpoint_interval 个页面变化写入一次检查点（crawl_checkpoint.db），
+    在主线程中被 Ctrl-C 中断时也会写入。resume 为 True 时从同一起始 URL 和最大页面数的检查点继续爬取，
+    不会重新抓取已完成的页面。爬取完成后删除检查点。
 
     :param start_url: The starting URL for the spider.
     :param max_pages: The maximum number of pages to crawl.
+    :param bool_save_to_database: 是否将结果存入 webpages.db。
+    :param max_workers: 同时进行的网络请求数上限，为 1 时等同于串行爬取。
+    :param incremental: 是否基于 webpages.db 增量刷新。
+    :param max_age: 增量模式下网页的有效期，超过该时间的网页需要重新验证。
+    :param checkpoint_interval: 两次检查点之间的页面变化数，为 0 时不写入检查点。
+    :param resume: 是否从检查点继续爬取。
+    :param fetcher: 抓取层，负责连接复用、按主机限速和 robots.txt，默认使用进程内共享的 fetcher。
+    :param parse_processes: 解析进程数，默认为 CPU 核数（单核时为 0）；为 0 或只爬取一个页面时在抓取线程中解析。
     :return: A set of visited webpage objects.
     """
     # 加载停用词
     stopwords = load_stopwords("stopwords.txt")
+    max_workers = max(1, max_workers)
+    fetcher = fetcher if fetcher else shared_fetcher()
+    if parse_processes is None:
+        # 单核机器上进程池只会增加序列化开销
+        parse_processes = os.cpu_count() or 1
+        parse_processes = parse_processes if parse_processes > 1 else 0
 
-    visited = set()  # 访问过的网页对象集合
-    queue = deque([webpage(url=start_url)])  # BFS 队列，初始化时只设置 URL
+    registry = page_registry()  # 页面登记表，包含已访问页面和 BFS 队列
+    checkpoint_interval = checkpoint_interval if bool_save_to_database else 0
+    checkpoint_pages, checkpoint_queue = load_checkpoint(CHECKPOINT_FILE, start_url, max_pages) if resume and checkpoint_interval else (None, None)
+    if checkpoint_pages is not None:
+        # 从检查点恢复已访问的网页和 BFS 队列
+        for page in checkpoint_pages:
+            registry.add_visited(page)
+        for page in checkpoint_queue:
+            registry.enqueue(page)
+        registry.mark_saved()
+    else:
+        if checkpoint_interval:
+            remove_checkpoint(CHECKPOINT_FILE)
+        registry.enqueue(webpage(url=start_url, tables=registry.tables))  # 初始化时只设置 URL
+    in_flight = deque()  # 已出队、正在抓取的 (webpage, Future)，按出队顺序排列
 
-    # 尝试从数据库读取数据
-    webpages, start_page = read_database("webpages.db")
+    # 上一次爬取的网页，用于发送条件请求和增量刷新。增量模式保存时需要与全部已存储的网页比较，因此读取整个数据库；
+    # 否则只按 URL 读取本次抓取的网页，耗时与数据库中的网页总数无关
+    if incremental:
+        webpages, start_page = read_database("webpages.db")
+        stored_pages = {normalize_url(page.url): page for page in webpages} if webpages else {}
+        store = None
+    else:
+        stored_pages, start_page = {}, None
+        store = open_page_store("webpages.db")
 
-    # 检查数据库是否有效
-    valid_old_database = True
-    if webpages is None or start_page is None or max_pages != len(webpages) or start_page.url != start_url:
-        valid_old_database = False
+    def find_stored_page(url):
+        """返回数据库中 url 对应的网页，不存在时返回 None。"""
+        key = normalize_url(url)
+        if store is None:
+            return stored_pages.get(key)
+        return store.get(url) or (store.get(key) if key != url else None)
 
-    while queue and len(visited) < max_pages:
-        current_page = queue.popleft()  # 从队列中取出一个 webpage 对象
+    now = datetime.now(timezone.utc)
 
-        try:
-            # 抓取当前页面的内容
-            response = requests.get(current_page.url, timeout=5)
-            response.raise_for_status()  # 出错时抛出异常
+    # 在主线程中爬取时，Ctrl-C 只设置标记，在处理完当前页面后写入检查点再中断，保证检查点的一致性
+    interrupted = []
+    previous_sigint_handler = None
+    analyzer = None
+    if checkpoint_interval and threading.current_thread() is threading.main_thread():
+        previous_sigint_handler = signal.signal(signal.SIGINT, lambda signum, frame: interrupted.append(signum))
 
-            # 获取 Last-Modified 字段
-            last_modified = response.headers.get("Last-Modified")
-            if last_modified:
-                try:
-                    # 将 Last-Modified 转换为 datetime 对象
-                    last_modified_date = datetime.strptime(last_modified, "%a, %d %b %Y %H:%M:%S %Z").replace(tzinfo=timezone.utc)
-                    current_page.date = last_modified_date  # 更新为 Last-Modified 的值
-                except ValueError:
-                    # 如果 Last-Modified 不存在
-                    if response.status_code != 304 or not valid_old_database:
-                        # 将当前时间（UTC）作为日期
-                        current_page.date = datetime.now(timezone.utc)
-                    else:
-                        continue
-            else:
-                # 如果 Last-Modified 不存在
-                if response.status_code != 304 or not valid_old_database:
-                    # 将当前时间（UTC）作为日期
-                    current_page.date = datetime.now(timezone.utc)
-                else:
-                    continue
+    try:
+        # 解析进程在抓取线程启动之前创建
+        analyzer = start_analyzer(parse_processes, stopwords) if parse_processes > 0 and max_pages > 1 else None
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while (registry.frontier or in_flight) and len(registry) < max_pages:
+                # 被中断时保存进度，之后可以 resume
+                if interrupted:
+                    save_checkpoint(CHECKPOINT_FILE, registry, start_url, max_pages)
+                    raise KeyboardInterrupt
+
+                # 定期写入检查点
+                if checkpoint_interval and len(registry.changed) + len(registry.removed) >= checkpoint_interval:
+                    save_checkpoint(CHECKPOINT_FILE, registry, start_url, max_pages)
 
-            # 使用 HTML 内容的长度计算网页大小
-            html_content = response.content  # 获取网页的二进制内容
-            current_page.size = len(html_content)  # 使用内容长度作为字节数
-
-            # 检查当前页面是否已经被访问过
-            existing_page = next((page for page in visited if page.url == current_page.url), None)
-            if existing_page:
-                # 如果 current_page 的最后修改时间更新，则删除 visited 中的项
-                if current_page.date > existing_page.date:
-                    visited.remove(existing_page)
-                else:
+                # 填充抓取窗口：正在抓取的页面数不超过 max_workers，且不超过剩余的页面配额
+                while registry.frontier and len(in_flight) < max_workers and len(registry) + len(in_flight) < max_pages:
+                    queued_page = registry.dequeue()
+                    if registry.is_duplicate(queued_page.url):
+                        # 入队后才得知是近似重复的网页（例如沿用的网页中记录的重复网页）
+                        registry.finish(queued_page)
+                        continue
+                    stored_page = find_stored_page(queued_page.url)
+                    if incremental and stored_page and now - stored_page.crawled < max_age:
+                        # 增量模式下未过期的网页不需要抓取
+                        in_flight.append((queued_page, None))
+                    else:
+                        headers = conditional_headers(stored_page)
+                        in_flight.append((queued_page, executor.submit(fetch_and_analyze, fetcher, queued_page.url, headers, analyzer, stopwords)))
+                current_page, future = in_flight.popleft()  # 按出队顺序取出一个 webpage 对象
+                if not registry.finish(current_page):
+                    # 抓取期间已被移出队列
+                    if future:
+                        future.cancel()
                     continue
 
-            # 解析 HTML
-            tree = html.fromstring(response.content)
-
-            # 提取网页正文内容
-            body_text = " ".join(tree.xpath('//body//text()[not(parent::script) and not(parent::style)]'))
-
-            # 单词统计：先经过 tokenize_and_filter（移除停用词）
-            words = tokenize_and_filter(body_text, stopwords)
-            single_counter = Counter(words)
-
-            # 提取原始单词列表（不过滤），用于短语提取
-            raw_words = re.findall(r'\b\w+\b', body_text.lower())
-            phrase_counter = Counter()
-            for n in range(2, 6):  # 组合连续2到5个单词为短语
-                for i in range(len(raw_words) - n + 1):
-                    phrase = " ".join(raw_words[i:i+n])
-                    phrase_counter[phrase] += 1
-
-            # 合并单词和短语的统计结果
-            combined_counter = single_counter + phrase_counter
-
-            # 更新到当前页面的 body_keywords
-            current_page.body_keywords = dict(combined_counter)
-
-            # 更新网页标题
-            title = tree.xpath('//title/text()')
-            current_page.title = title[0] if title else "Untitled"
-
-            # 将当前页面添加到 visited 集合
-            visited.add(current_page)
-
-            # 提取所有链接
-            links = tree.xpath('//a/@href')  # 解析所有超链接
-            child_pages = []
-            for link in links:
-                # 将相对链接转换为绝对链接
-                absolute_link = urljoin(current_page.url, link)
-                # 添加绝对链接为子链接
-                current_page.child_links.add(absolute_link)
-                # 检查链接是否已经在 visited 中
-                existing_child_page = next((page for page in visited if page.url == absolute_link), None)
-                if existing_child_page:
-                    last_modified_date = datetime(1970, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
-                    try:
-                        # 发送 HEAD 请求
-                        response = requests.head(absolute_link, timeout=5)
-                        response.raise_for_status()  # 如果状态码不是 2xx，抛出异常
+                try:
+                    # 等待当前页面抓取和解析完成（未过期的网页没有请求）
+                    response, analysis = future.result() if future else (None, None)
 
+                    stored_page = find_stored_page(current_page.url)
+                    reused = response is None or response.status_code == 304
+                    if reused:
+                        # 页面未过期或未更改：沿用数据库中的记录，不再下载和解析
+                        if stored_page is None:
+                            continue
+                        current_page.crawled = stored_page.crawled if response is None else datetime.now(timezone.utc)
+                        current_page.date = stored_page.date
+                        current_page.size = stored_page.size
+                        current_page.last_modified = stored_page.last_modified
+                        current_page.etag = stored_page.etag
+                    else:
                         # 获取 Last-Modified 字段
-                        last_modified = response.headers.get("Last-Modified")
-                        if last_modified:
-                            try:
-                                # 将 Last-Modified 转换为 datetime 对象
-                                last_modified_date = datetime.strptime(last_modified, "%a, %d %b %Y %H:%M:%S %Z").replace(tzinfo=timezone.utc)
-                            except ValueError:
-                                # 如果 Last-Modified 不存在
-                                if last_modified_date == datetime(1970, 1, 1, 0, 0, 0, tzinfo=timezone.utc) or response.status_code != 304:
-                                    # 将当前时间（UTC）作为日期
-                                    last_modified_date = datetime.now(timezone.utc)
+                        last_modified_date = parse_last_modified(response.headers.get("Last-Modified"))
+                        if last_modified_date:
+                            current_page.date = last_modified_date  # 更新为 Last-Modified 的值
+                        else:
+                            # 如果 Last-Modified 不存在或格式错误，将当前时间（UTC）作为日期
+                            current_page.date = datetime.now(timezone.utc)
+
+                        # 保存缓存验证字段，供下一次爬取发送条件请求
+                        current_page.last_modified = response.headers.get("Last-Modified", "")
+                        current_page.etag = response.headers.get("ETag", "")
+                        current_page.crawled = datetime.now(timezone.utc)
+
+                        # 使用 HTML 内容的长度计算网页大小
+                        html_content = response.content  # 获取网页的二进制内容
+                        current_page.size = len(html_content)  # 使用内容长度作为字节数
+
+                    # 检查当前页面是否已经被访问过
+                    existing_page = registry.get_visited(current_page.url)
+                    if existing_page:
+                        # 如果 current_page 的最后修改时间更新，则删除 visited 中的项
+                        if current_page.date > existing_page.date:
+                            registry.remove_visited(existing_page.url)
                         else:
-                            # 如果 Last-Modified 不存在
-                            if last_modified_date == datetime(1970, 1, 1, 0, 0, 0, tzinfo=timezone.utc) or response.status_code != 304:
-                                # 将当前时间（UTC）作为日期
-                                last_modified_date = datetime.now(timezone.utc)
-
-                    except Exception:
-                        pass
-                    if last_modified_date > existing_child_page.date:  # 链接已经在 visited 中但页面已被更改，则创建新的 webpage 对象并加入队列
-                        new_page = webpage(url=absolute_link, parent_links=(existing_child_page.parent_links | {current_page.url}))
-                        queue.append(new_page)
-                        child_pages.append(new_page)
-                    # 如果链接已经在 visited 中且页面未被更改，更新其 parent_links
+                            continue
+
+                    if reused:
+                        current_page.title = stored_page.title
+                        current_page.body_keywords = stored_page.body_keywords
+                        current_page.body_positions = stored_page.body_positions
+                        current_page.simhash = stored_page.simhash
+                        absolute_links = list(stored_page.child_links)
                     else:
-                        existing_child_page.parent_links.add(current_page.url)
-                        child_pages.append(existing_child_page)
-                else:
-                    # 如果链接未被访问过，则创建新的 webpage 对象并加入队列
-                    new_page = webpage(url=absolute_link, parent_links={current_page.url})
-                    queue.append(new_page)
-                    child_pages.append(new_page)
-
-            # 在之前是子链接但现在不是子链接的网页的父链接里移除本页
-            if existing_page:
-                # 比对 existing_page.child_links 与 child_pages
-                for child_link in existing_page.child_links:
-                    # 如果 child_link 不在 child_pages 中
-                    if child_link not in {page.url for page in child_pages}:
-                        # 在 visited 中找到对应的页面
-                        child_page = next((page for page in visited if page.url == child_link), None)
-                        if child_page:
-                            # 从 child_page 的 parent_links 中移除 current_page.url
-                            if current_page.url in child_page.parent_links:
-                                child_page.parent_links.remove(current_page.url)
-
-                            # 如果 child_page 不是 start_url 且其 parent_links 为空，则从 visited 中移除
-                            if child_page.url != start_url and not child_page.parent_links:
-                                visited.remove(child_page)
-
-                        # 在 queue 中找到对应的页面
-                        for queued_page in queue:
-                            if queued_page.url == child_link:
-                                # 从 queued_page 的 parent_links 中移除 current_page.url
-                                if current_page.url in queued_page.parent_links:
-                                    queued_page.parent_links.remove(current_page.url)
-
-                                # 如果 queued_page 不是 start_url 且其 parent_links 为空，则从 queue 中移除
-                                if queued_page.url != start_url and not queued_page.parent_links:
-                                    queue.remove(queued_page)
-                                break
-
-        except Exception:
-            pass
+                        # 使用解析进程池的结果更新标题、body_positions（同时得到 body_keywords）和指纹
+                        current_page.title, current_page.body_positions, absolute_links, current_page.simhash = analysis
+
+                    # 与已访问的网页近似重复时，合并到该网页，不计入 max_pages；其中尚未访问的链接仍然加入队列，
+                    # 以免只能从重复网页到达的网页被遗漏（重新抓取的已访问网页保留原来的身份）
+                    canonical_page = None if existing_page else registry.find_duplicate(current_page)
+                    if canonical_page:
+                        registry.add_duplicate(canonical_page, current_page.url)
+                        for absolute_link in absolute_links:
+                            if not registry.is_duplicate(absolute_link) and not registry.get_visited(absolute_link):
+                                registry.enqueue(webpage(url=absolute_link, parent_links={current_page.url}, tables=registry.tables))
+                        continue
+
+                    if reused:
+                        # 沿用数据库中记录的近似重复网页，本次已作为网页访问的除外
+                        current_page.duplicate_urls = link_set((url for url in stored_page.duplicate_urls if not registry.get_visited(url)), current_page.tables.urls)
+
+                    # 将当前页面添加到 visited 集合
+                    registry.add_visited(current_page)
+
+                    # 对已经在 visited 中的子链接并发发送 HEAD 请求，检查页面是否已被更改
+                    # （增量模式下 visited 中的网页都在有效期内，不需要再次验证）
+                    head_futures = {}
+                    for absolute_link in absolute_links:
+                        if not incremental and absolute_link not in head_futures and registry.get_visited(absolute_link):
+                            headers = conditional_headers(registry.get_visited(absolute_link))
+                            head_futures[absolute_link] = executor.submit(head_last_modified, fetcher, absolute_link, headers)
+
+                    child_keys = set()  # 当前子页面的规范化 URL
+                    for absolute_link in absolute_links:
+                        # 添加绝对链接为子链接
+                        current_page.child_links.add(absolute_link)
+                        child_keys.add(normalize_url(absolute_link))
+                        # 已合并到其他网页的近似重复网页不再抓取
+                        if registry.is_duplicate(absolute_link):
+                            continue
+                        # 检查链接是否已经在 visited 中
+                        existing_child_page = registry.get_visited(absolute_link)
+                        if existing_child_page:
+                            last_modified_date = head_futures[absolute_link].result() if absolute_link in head_futures else existing_child_page.date
+                            if last_modified_date > existing_child_page.date:  # 链接已经在 visited 中但页面已被更改，则创建新的 webpage 对象并加入队列
+                                registry.enqueue(webpage(url=absolute_link, parent_links=(existing_child_page.parent_links | {current_page.url}), tables=registry.tables))
+                            # 如果链接已经在 visited 中且页面未被更改，更新其 parent_links
+                            else:
+                                registry.add_parent(existing_child_page, current_page.url)
+                        else:
+                            # 如果链接未被访问过，则创建新的 webpage 对象并加入队列（已在队列中时只合并父链接）
+                            registry.enqueue(webpage(url=absolute_link, parent_links={current_page.url}, tables=registry.tables))
+
+                    # 在之前是子链接但现在不是子链接的网页（包括队列中的网页）的父链接里移除本页
+                    if existing_page:
+                        for child_link in existing_page.child_links:
+                            if normalize_url(child_link) not in child_keys:
+                                registry.remove_parent(child_link, current_page.url, start_url)
+
+                except Exception:
+                    pass
+
+            # 达到 max_pages 后，取消尚未开始的抓取
+            for _, future in in_flight:
+                if future:
+                    future.cancel()
+    finally:
+        if analyzer is not None:
+            analyzer.shutdown(cancel_futures=True)
+        if previous_sigint_handler is not None:
+            signal.signal(signal.SIGINT, previous_sigint_handler)
+        if store is not None:
+            store.close()
 
+    visited = registry.pages()
     if bool_save_to_database:
-        save_to_database("webpages.db", visited, start_url)
-    return visited
\ No newline at end of file
+        if incremental and stored_pages:
+            # 只写回新增或发生变化的网页（包括起始页面标记的变化），删除不再可达的网页
+            stored_start_url = start_page.url if start_page else None
+            changed_urls = set()
+            revalidated_urls = set()  # 只有 crawled 发生变化（重新验证后未更改）的网页
+            for page in visited:
+                stored_page = stored_pages.get(normalize_url(page.url))
+                if page_changed(page, stored_page) or (page.url == start_url) != (stored_page.url == stored_start_url):
+                    changed_urls.add(page.url)
+                elif page.crawled != stored_page.crawled:
+                    revalidated_urls.add(page.url)
+            removed_urls = {stored_page.url for key, stored_page in stored_pages.items()
+                            if registry.visited.get(key) is None or registry.visited[key].url != stored_page.url}
+            save_to_database("webpages.db", visited, start_url, changed_urls, removed_urls, revalidated_urls)
+        else:
+            save_to_database("webpages.db", visited, start_url)
+    if checkpoint_interval:
+        remove_checkpoint(CHECKPOINT_FILE)
+    return visited
@@ -4,6 +4,7 @@ from collections import Counter
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 import spider
 import indexer
+import analysis
 # import io
 
 # # 强制将标准输出和错误流的编码设置为 UTF-8
@@ -42,8 +43,8 @@ with open((os.path.dirname(os.path.abspath(__file__)) + "/spider_result.txt"), "
     total_pages = len(webpages)
     for index, page in enumerate(webpages):
         # 处理标题关键词
-        stopwords = spider.load_stopwords("stopwords.txt")
-        title_words = spider.tokenize_and_filter(page.title, stopwords)  # 分词并移除停用词
+        stopwords = analysis.load_stopwords("stopwords.txt")
+        title_words = analysis.tokenize_and_filter(page.title, stopwords)  # 分词并移除停用词
         title_keywords = Counter(title_words)  # 统计词频
 
         # 合并正文关键词和标题关键词
@@ -1,8 +1,10 @@
 from flask import Flask, request, render_template_string, send_from_directory, redirect, url_for
-from nltk.stem import PorterStemmer
+from collections.abc import Mapping
 import os
-from spider import webpage, load_stopwords, tokenize_and_filter, read_database as spider_read_database
-from retrieval import retrieval
+import threading
+from spider import open_page_store, remove_database
+from analysis import tokenize_and_filter
+from retrieval import searcher
 
 app = Flask(__name__)
 
@@ -11,6 +13,10 @@ DEFAULT_START_URL = "https://www.cse.ust.hk/~kwtleung/COMP4321/testpage.htm"
 DEFAULT_MAX_PAGES = 300
 DEFAULT_MAX_RESULTS = 50
 
+# 当前的检索器，起始 URL 或最大爬取页面数改变时重新创建
+current_searcher = None
+current_searcher_lock = threading.Lock()
+
 # HTML 模板：使用 <pre> 标签及内联 CSS 控制对齐格式
 html_template = """
 <!DOCTYPE html>
@@ -110,12 +116,12 @@ html_template = """
         </form>
         {% if results %}
             <p>{{ results|length }} results found.</p>
-            {% for page, score in results %}
+            {% for page, score, keywords in results %}
 <pre style="text-align: left; font-family: inherit; font-size: inherit; font-weight: inherit; width: fit-content; margin-left: auto; margin-right: auto;">
 <strong>{{ score|round(4) }}</strong>&#9;<a href="{{ page.url }}" target="_blank"  class="title-link" style="color: inherit; text-decoration: none;">{{ page.title or "Untitled" }}</a>
 &#9;&#9;<a href="{{ page.url }}" target="_blank">{{ page.url }}</a>
 &#9;&#9;{{ page.date }}, {{ page.size }} Bytes
-&#9;&#9;{{ page.keywords }}
+&#9;&#9;{{ keywords }}
 {%- for link in page.parent_links %}
 &#9;&#9;<a href="{{ link }}" target="_blank">{{ link }}</a>
 {%- endfor %}
@@ -134,22 +140,44 @@ html_template = """
 def favicon():
     return send_from_directory(os.path.join(app.root_path, ''), 'favicon.ico', mimetype='image/x-icon')
 
+def get_searcher(start_url, max_pages):
+    """
+    返回起始 URL 和最大爬取页面数与请求相同的检索器，不同时创建新的检索器。
+    只在创建时检查 webpages.db 是否属于同一个起始 URL，之后的请求只做与查询有关的工作，
+    索引文件的变化由检索器自己发现并重新加载。
+    """
+    global current_searcher
+    with current_searcher_lock:
+        if current_searcher is None or current_searcher.start_url != start_url or current_searcher.max_pages != max_pages:
+            # 只读取起始网页和网页数，不读取全部网页
+            page_count, start_page = None, None
+            try:
+                store = open_page_store("webpages.db")
+                if store:
+                    with store:
+                        page_count, start_page = len(store), store.start_page()
+            except Exception:
+                pass
+            if (page_count is None or start_page is None or page_count > max_pages or start_page.url != start_url):
+                current_searcher = None
+                for db_file in ["webpages.db", "body_inverted_index.db", "title_inverted_index.db", "link_scores.db", "inverted_index.seg"]:
+                    remove_database(db_file)
+            current_searcher = searcher(start_url, max_pages)
+        return current_searcher
+
 def generate_keywords(page, stemmer, stopwords):
     """
-    生成关键词字符串：首先从 page.body_keywords 中移除多词短语（只保留单词项），
-    然后对剩余单词词干化并统计；再利用 tokenize_and_filter 对页面标题生成单词
-    （不生成短语），词干化并统计，最后合并两部分。
+    生成关键词字符串：首先对 page.body_keywords 中的单词词干化并统计；
+    再利用 tokenize_and_filter 对页面标题生成单词，词干化并统计，最后合并两部分。
     返回格式为 "keyword1 freq1; keyword2 freq2; ..."，
     如果关键词总数多于 5，则返回前 5 项，并在第 5 项后加上省略号。
     """
     from collections import Counter  # 防止未引入Counter
     body_counter = Counter()
-    if hasattr(page, "body_keywords") and isinstance(page.body_keywords, dict):
+    if hasattr(page, "body_keywords") and isinstance(page.body_keywords, Mapping):
         for kw, freq in page.body_keywords.items():
-            # 仅保留单词项，去除多词短语
-            if len(kw.split()) == 1:
-                stemmed = stemmer.stem(kw)
-                body_counter[stemmed] += freq
+            stemmed = stemmer.stem(kw)
+            body_counter[stemmed] += freq
 
     title_counter = Counter()
     if page.title:
@@ -215,22 +243,14 @@ def index():
         max_results = DEFAULT_MAX_RESULTS
         
     # 后续的数据库读取和检索逻辑...
-    try:
-        db_pages, start_page = spider_read_database("webpages.db")
-    except Exception:
-        db_pages = None
-    if (db_pages is None or start_page is None or len(db_pages) > max_pages or start_page.url != start_url):
-        for db_file in ["webpages.db", "body_inverted_index.db", "title_inverted_index.db"]:
-            if os.path.exists(db_file):
-                os.remove(db_file)
-                
-    results = retrieval(start_url, query, max_pages, max_results)
-    stopwords = set(load_stopwords("stopwords.txt"))
-    stemmer = PorterStemmer()
+    current = get_searcher(start_url, max_pages)
+    results = current.search(query, max_results)
+    stopwords = current.stopwords
+    stemmer = current.stemmer
+    # webpage 使用 __slots__，关键词字符串与网页一起放入结果中，不作为网页的属性
     for i, (page, score) in enumerate(results):
         kw_str = generate_keywords(page, stemmer, stopwords)
-        page.keywords = kw_str
-        results[i] = (page, score)
+        results[i] = (page, score, kw_str)
     return render_template_string(html_template,
                                   results=results,
                                   start_url=start_url,